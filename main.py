@@ -6,13 +6,40 @@ from collections import defaultdict
 import sys
 import os
 import glob
+import hashlib
+import json
 import pandas as pd
 
 # Project module imports
 from src.data_collector import collect_all_trade_data
 from src.excel_exporter import export_to_excel
 from src.db_connector import DBConnector
-from src.processing import process_yearly_data
+from src.processing import (
+    format_stage_timings,
+    get_stage_timings,
+    process_multi_year_data,
+    process_ticker_groups,
+)
+from src.fifo import TradeMatcher
+from src.fifo_vector import VectorTradeMatcher
+from src.nbp import (
+    get_nbp_stats,
+    preload_rates,
+    set_offline_mode,
+    set_fail_fast_mode,
+    format_nbp_stats,
+)
+from src.nbp_archive import parse_archive_file
+from src.profiling import Profiler
+from src.progress import ConsoleRenderer, ERROR, reporter
+from src.result_cache import ResultCache, cache_key
+from src.ticker_deps import (
+    LINKING_EVENTS,
+    build_ticker_graph,
+    ticker_closure,
+    ticker_groups,
+)
+from src.withholding import TAX_WINDOW_DAYS
 
 # Import parser functions to enable data loading from main.py
 from src.parser import parse_csv, save_to_database
@@ -26,6 +53,9 @@ except ImportError:
     print("WARNING: src/report_pdf.py not found. PDF export disabled.")
     PDF_AVAILABLE = False
 
+# FIFO engines selectable with --fifo-engine; all produce identical results
+FIFO_ENGINES = {"standard": TradeMatcher, "vector": VectorTradeMatcher}
+
 
 def prepare_data_for_pdf(target_year, raw_trades, realized_gains, dividends, inventory):
     """
@@ -78,8 +108,7 @@ def prepare_data_for_pdf(target_year, raw_trades, realized_gains, dividends, inv
     history_trades = []
     corp_actions = []
 
-    # Sort by 'Date' key (PascalCase from DB)
-    raw_trades.sort(key=lambda x: x["Date"])
+    # Rows come in DB order (Date, rowid): no re-sort needed
 
     for t in raw_trades:
         # Check year. Key 'Date'
@@ -226,13 +255,14 @@ def run_import_routine():
     combined = {"trades": [], "dividends": [], "taxes": [], "corp_actions": []}
     print(f"Found {len(files)} files to process.")
 
-    for fp in sorted(files):
-        try:
-            parsed = parse_csv(fp)
-            for k in combined:
-                combined[k].extend(parsed[k])
-        except Exception as e:
-            print(f"Error reading {fp}: {e}")
+    with reporter.stage("import", total=len(files)):
+        for fp in reporter.track(sorted(files), every=1):
+            try:
+                parsed = parse_csv(fp)
+                for k in combined:
+                    combined[k].extend(parsed[k])
+            except Exception as e:
+                reporter.message(ERROR, f"Error reading {fp}: {e}")
 
     if any(combined.values()):
         print("💾 Saving to database...")
@@ -241,81 +271,234 @@ def run_import_routine():
         print("⚠️ No valid data found in files.")
 
 
-def main():
-    parser = argparse.ArgumentParser(description="IBKR Tax Calculator")
+def history_digest(raw_trades, as_of):
+    """
+    Content hash of the DB rows dated up to as_of, in DB order. Row ids are
+    left out: an import re-inserts every row, renumbering them.
+    """
+    digest = hashlib.sha256()
+    for row in raw_trades:
+        if row["Date"] > as_of:
+            break
+        fields = {k: v for k, v in row.items() if k != "TradeId"}
+        digest.update(json.dumps(fields, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
 
-    # Import Argument
-    parser.add_argument(
-        "--import-data",
-        action="store_true",
-        help="Import all CSV files from data/ folder into DB.",
-    )
 
-    # Filtering Arguments
-    parser.add_argument(
-        "--target-year",
-        type=int,
-        default=date.today().year,
-        help="Tax year for calculation (e.g., 2024).",
-    )
-    parser.add_argument(
-        "--ticker", type=str, default=None, help="Filter by ticker symbol (e.g., AAPL)."
-    )
+def load_fifo_state(path, raw_trades, target_year, ticker, engine=TradeMatcher):
+    """
+    Restores a FIFO snapshot saved by a previous run if it is still valid for
+    this run: same ticker filter, not newer than the target year and built from
+    the same DB rows up to its as_of date (history_digest). Rows added after
+    as_of are the delta replayed on top of it; any change at or before as_of,
+    an edit that keeps the row count included, invalidates it. The matcher is
+    restored as an `engine` instance.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        matcher = engine.load_state(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"WARNING: Ignoring FIFO state {path}: {e}")
+        return None
+
+    meta = matcher.state_meta
+    if (
+        matcher.as_of > f"{target_year}-12-31"
+        or meta.get("ticker") != ticker
+        or meta.get("history") != history_digest(raw_trades, matcher.as_of)
+    ):
+        print(f"INFO: FIFO state {path} is stale, replaying full history.")
+        return None
+
+    print(f"INFO: Warm start from FIFO state as of {matcher.as_of}.")
+    return matcher
+
+
+def run_add_alias(alias, ticker):
+    """Stores a ticker rename in the alias table and re-maps the history."""
+    alias, ticker = alias.strip().upper(), ticker.strip().upper()
+    try:
+        with DBConnector() as db:
+            db.initialize_schema()
+            updated = db.set_ticker_alias(alias, ticker)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return
+    print(f"✅ {alias} -> {ticker}: {updated} records re-mapped.")
 
-    # Export Arguments
-    parser.add_argument(
-        "--export-excel", action="store_true", help="Export full history to Excel."
-    )
-    parser.add_argument(
-        "--export-pdf", action="store_true", help="Export tax report to PDF."
-    )
 
-    args = parser.parse_args()
+def run_rates_import(patterns):
+    """Bulk-loads NBP Table A archive files (CSV/XML) into the local rate store."""
+    print("--- 💱 NBP RATES IMPORT ---")
 
-    # --- 1. Import Mode ---
-    if args.import_data:
-        run_import_routine()
-        return  # Stop here if we are just importing
+    files = []
+    for pattern in patterns:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
 
-    # --- 2. Calculation Mode ---
-    print(f"Starting tax calculation for year {args.target_year}...")
+    rows = []
+    for fp in files:
+        try:
+            parsed = parse_archive_file(fp)
+            print(f"📂 {os.path.basename(fp)}: {len(parsed)} rates")
+            rows.extend(parsed)
+        except Exception as e:
+            print(f"Error reading {fp}: {e}")
 
-    # Load data from DB
-    raw_trades = []
+    if not rows:
+        print("⚠️ No rates found in files.")
+        return
+
+    with DBConnector() as db:
+        db.initialize_schema()
+        db.save_nbp_rates(rows)
+    print(f"✅ Stored {len(rows)} NBP rates.")
+
+
+def run_calculation(args, years, raw_trades, tax_window):
+    """FIFO matching and NBP conversion over the loaded history (cache miss)."""
+    print("INFO: Running FIFO matching and NBP currency conversion...")
     try:
-        # Initialize connection (env vars loaded internally)
-        with DBConnector() as db:
-            db.initialize_schema()
-            raw_trades = db.get_trades_for_calculation(
-                target_year=args.target_year, ticker=args.ticker
+        # process_multi_year_data works with original PascalCase DB keys
+        engine = FIFO_ENGINES[args.fifo_engine]
+        matcher = engine()
+        if args.fifo_state:
+            matcher = (
+                load_fifo_state(
+                    args.fifo_state, raw_trades, years[0], args.ticker, engine
+                )
+                or matcher
+            )
+        results = process_multi_year_data(
+            raw_trades,
+            years,
+            workers=args.workers,
+            matcher=matcher,
+            verify=args.verify_fifo,
+            tax_window=tax_window,
+            snapshot=bool(args.fifo_state),
+        )
+        print(f"INFO: Pipeline stages: {format_stage_timings(get_stage_timings())}")
+        if args.fifo_state and matcher.as_of:
+            matcher.save_state(
+                args.fifo_state,
+                meta={
+                    "ticker": args.ticker,
+                    "history": history_digest(raw_trades, matcher.as_of),
+                },
             )
-            print(f"INFO: Loaded {len(raw_trades)} records from DB.")
     except Exception as e:
-        print(f"CRITICAL ERROR: Could not connect or fetch data. {e}")
+        print(f"CRITICAL ERROR during processing: {e}")
         sys.exit(1)
+    return results
 
-    if not raw_trades:
-        print(
-            "WARNING: No trades found. Please import data first (python main.py --import-data)."
-        )
-        return
 
-    # Run FIFO Logic
-    print("INFO: Running FIFO matching and NBP currency conversion...")
+def run_low_memory_calculation(args, years, groups, tax_window):
+    """
+    --low-memory: reads and replays one ticker group at a time (cache miss).
+    Returns the results, the rows of the reported years (all the exports
+    read) and the number of rows read. Only the history before the reported
+    years is bounded by the largest group: the results and the reported
+    years' rows are kept for all groups, for the exports.
+    """
+    print("INFO: Running FIFO matching and NBP currency conversion per ticker group...")
+    year_start = f"{years[0]}-01-01"
+    report_rows = []
+    records = 0
+
+    def row_groups(db):
+        nonlocal records
+        for group in groups:
+            rows = db.get_trades_for_calculation(target_year=years[-1], ticker=group)
+            records += len(rows)
+            report_rows.extend(t for t in rows if t["Date"] >= year_start)
+            yield rows
+
     try:
-        # process_yearly_data works with original PascalCase DB keys
-        realized_gains, dividends, inventory = process_yearly_data(
-            raw_trades, args.target_year
-        )
+        with DBConnector() as db:
+            results = process_ticker_groups(
+                row_groups(db),
+                years,
+                verify=args.verify_fifo,
+                tax_window=tax_window,
+                total=len(groups),
+                engine=FIFO_ENGINES[args.fifo_engine],
+            )
+        print(f"INFO: Pipeline stages: {format_stage_timings(get_stage_timings())}")
     except Exception as e:
         print(f"CRITICAL ERROR during processing: {e}")
         sys.exit(1)
+    # Groups come in ticker order; the exports expect DB order
+    report_rows.sort(key=lambda t: (t["Date"], t["TradeId"]))
+    return results, report_rows, records
+
+
+def load_cached_results(key):
+    """Cached results of this calculation, or None on a miss."""
+    try:
+        with ResultCache() as cache:
+            return cache.get(key)
+    except (Exception, SystemExit) as e:
+        # A broken cache only costs a full calculation
+        print(f"WARNING: Result cache unavailable, calculating from scratch. {e}")
+        return None
+
 
+def store_cached_results(key, value):
+    try:
+        with ResultCache() as cache:
+            if not cache.put(key, value):
+                print("INFO: Results exceed the cache size limit, not cached.")
+    except (Exception, SystemExit) as e:
+        print(f"WARNING: Could not update the result cache. {e}")
+
+
+def parse_years(spec):
+    """'2020-2024' or '2020,2022' (or a mix) -> sorted list of tax years."""
+    years = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        try:
+            start, end = int(first), int(last or first)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid year range: {part!r}")
+        if start > end:
+            raise argparse.ArgumentTypeError(f"empty year range: {part!r}")
+        years.update(range(start, end + 1))
+    return sorted(years)
+
+
+def filter_to_ticker(results, raw_trades, ticker):
+    """
+    Narrows the results and rows of a ticker closure (see ticker_deps) to
+    the requested canonical ticker: the linked tickers are only loaded to
+    replay its history completely and are not part of its report.
+    """
+    raw_trades = [t for t in raw_trades if t["Ticker"] == ticker]
+    results = {
+        year: tuple([r for r in part if r["ticker"] == ticker] for part in parts)
+        for year, parts in results.items()
+    }
+    return results, raw_trades
+
+
+def report_year(
+    args,
+    year,
+    raw_trades,
+    db_records,
+    realized_gains,
+    dividends,
+    inventory,
+    profiler=None,
+):
+    """Prints the totals of one tax year and writes its Excel/PDF exports."""
+    profiler = profiler or Profiler()
     # Calculate Totals
     total_pl = sum(r["profit_loss"] for r in realized_gains)
     total_dividends = sum(d["gross_amount_pln"] for d in dividends)
 
-    print(f"\n--- Results for {args.target_year} ---")
+    print(f"\n--- Results for {year} ---")
     print(f"Realized P&L (FIFO): {total_pl:.2f} PLN")
     print(f"Dividends (Gross): {total_dividends:.2f} PLN")
     print(f"Open Positions (lots): {len(inventory)}")
@@ -327,23 +510,23 @@ def main():
     if args.export_excel:
         print("\nStarting Excel export...")
         try:
-            sheets_dict, ticker_summary = collect_all_trade_data(
-                realized_gains, dividends, inventory
-            )
+            with profiler.stage("collect_all_trade_data", year=year):
+                sheets_dict, ticker_summary = collect_all_trade_data(
+                    realized_gains, dividends, inventory
+                )
 
             summary_metrics = {
                 "Total P&L": f"{total_pl:.2f} PLN",
                 "Total Dividends (Gross)": f"{total_dividends:.2f} PLN",
-                "Report Year": args.target_year,
+                "Report Year": year,
                 "Filtered Ticker": args.ticker if args.ticker else "All Tickers",
-                "Database Records": len(raw_trades),
+                "Database Records": db_records,
             }
-            output_path_xlsx = (
-                f"output/tax_report_{args.target_year}{file_name_suffix}.xlsx"
-            )
-            export_to_excel(
-                sheets_dict, output_path_xlsx, summary_metrics, ticker_summary
-            )
+            output_path_xlsx = f"output/tax_report_{year}{file_name_suffix}.xlsx"
+            with profiler.stage("excel", year=year):
+                export_to_excel(
+                    sheets_dict, output_path_xlsx, summary_metrics, ticker_summary
+                )
             print(f"SUCCESS: Excel report saved to {output_path_xlsx}")
         except Exception as e:
             print(f"ERROR exporting to Excel: {e}")
@@ -352,22 +535,295 @@ def main():
     if args.export_pdf:
         if PDF_AVAILABLE:
             print("\nStarting PDF export...")
-            output_path_pdf = (
-                f"output/tax_report_{args.target_year}{file_name_suffix}.pdf"
-            )
+            output_path_pdf = f"output/tax_report_{year}{file_name_suffix}.pdf"
 
             # Prepare data for PDF (handling PascalCase keys)
             try:
-                pdf_data = prepare_data_for_pdf(
-                    args.target_year, raw_trades, realized_gains, dividends, inventory
-                )
-                generate_pdf(pdf_data, output_path_pdf)
+                with profiler.stage("pdf", year=year):
+                    pdf_data = prepare_data_for_pdf(
+                        year, raw_trades, realized_gains, dividends, inventory
+                    )
+                    generate_pdf(pdf_data, output_path_pdf)
                 print(f"SUCCESS: PDF report saved to {output_path_pdf}")
             except Exception as e:
                 print(f"ERROR: Could not generate PDF: {e}")
         else:
             print("ERROR: PDF generation module (src/report_pdf.py) not found.")
 
+
+def main():
+    parser = argparse.ArgumentParser(description="IBKR Tax Calculator")
+
+    # Import Argument
+    parser.add_argument(
+        "--import-data",
+        action="store_true",
+        help="Import all CSV files from data/ folder into DB.",
+    )
+
+    parser.add_argument(
+        "--import-rates",
+        nargs="+",
+        metavar="FILE",
+        help="Import NBP Table A archive files (CSV/XML) into the local rate store.",
+    )
+    parser.add_argument(
+        "--add-alias",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Record OLD as a former symbol of NEW (e.g. FB META); stored rows are re-mapped.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Never contact api.nbp.pl; use only locally stored rates.",
+    )
+    parser.add_argument(
+        "--nbp-fail-fast",
+        action="store_true",
+        help="Abort if the NBP API is unreachable instead of falling back to rate 1.0.",
+    )
+
+    # Filtering Arguments
+    parser.add_argument(
+        "--target-year",
+        type=int,
+        default=date.today().year,
+        help="Tax year for calculation (e.g., 2024).",
+    )
+    parser.add_argument(
+        "--years",
+        type=parse_years,
+        metavar="RANGE",
+        help="Several tax years from one FIFO replay (e.g., 2020-2024); "
+        "overrides --target-year.",
+    )
+    parser.add_argument(
+        "--ticker", type=str, default=None, help="Filter by ticker symbol (e.g., AAPL)."
+    )
+
+    parser.add_argument(
+        "--fifo-state",
+        metavar="FILE",
+        help="Warm start: resume FIFO from this snapshot and update it after the run.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Run FIFO matching per ticker in N parallel processes.",
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help=(
+            "Read and replay the history one ticker group at a time. Bounds the "
+            "memory of the replay; the report of the requested years is still "
+            "built in memory for the whole account."
+        ),
+    )
+    parser.add_argument(
+        "--tax-window",
+        type=int,
+        metavar="DAYS",
+        help="Match withholding tax rows to dividends up to DAYS apart "
+        "(default: TAX_WINDOW_DAYS or 10).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always recalculate instead of reusing cached results.",
+    )
+    parser.add_argument(
+        "--fifo-engine",
+        choices=sorted(FIFO_ENGINES),
+        default="standard",
+        help="FIFO engine: standard (indexed lot queues) or vector (NumPy batch "
+        "matching of tickers without corporate actions). Results are identical.",
+    )
+    parser.add_argument(
+        "--verify-fifo",
+        action="store_true",
+        help="Cross-check FIFO results against the lot-by-lot reference engine.",
+    )
+
+    # Profiling Arguments
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print wall/CPU time and peak memory (tracemalloc) per stage.",
+    )
+    parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        help="Write the per-stage timing report as JSON (implies --profile).",
+    )
+    parser.add_argument(
+        "--profile-pstats",
+        metavar="FILE",
+        help="Save a cProfile dump of the run for pstats (implies --profile).",
+    )
+
+    # Export Arguments
+    parser.add_argument(
+        "--export-excel", action="store_true", help="Export full history to Excel."
+    )
+    parser.add_argument(
+        "--export-pdf", action="store_true", help="Export tax report to PDF."
+    )
+
+    args = parser.parse_args()
+    # Stage progress line and messages of the parser, pipeline and exporters
+    reporter.subscribe(ConsoleRenderer())
+    if args.low_memory and (args.fifo_state or args.workers > 1):
+        parser.error("--low-memory cannot be combined with --fifo-state or --workers.")
+
+    # --- 1. Import Mode ---
+    if args.import_data:
+        run_import_routine()
+        return  # Stop here if we are just importing
+
+    if args.import_rates:
+        run_rates_import(args.import_rates)
+        return
+
+    if args.add_alias:
+        run_add_alias(*args.add_alias)
+        return
+
+    if args.offline:
+        set_offline_mode(True)
+    if args.nbp_fail_fast:
+        set_fail_fast_mode(True)
+
+    # --- 2. Calculation Mode ---
+    profiler = Profiler(
+        enabled=args.profile or bool(args.profile_json),
+        pstats_path=args.profile_pstats,
+    )
+    profiler.start()
+    years = args.years or [args.target_year]
+    if len(years) > 1:
+        print(f"Starting tax calculation for years {years[0]}-{years[-1]}...")
+    else:
+        print(f"Starting tax calculation for year {years[0]}...")
+
+    # Load data from DB
+    raw_trades = []
+    cached = None
+    try:
+        # Initialize connection (env vars loaded internally)
+        with profiler.stage("db"), DBConnector() as db:
+            db.initialize_schema()
+            tax_window = TAX_WINDOW_DAYS if args.tax_window is None else args.tax_window
+            tickers = None
+            if args.ticker or args.low_memory:
+                aliases = db.get_ticker_aliases()
+                graph = build_ticker_graph(
+                    db.get_corporate_actions(LINKING_EVENTS), aliases
+                )
+            if args.ticker:
+                ticker = aliases.get(args.ticker, args.ticker)
+                tickers = ticker_closure(graph, ticker)
+                if ticker != args.ticker:
+                    print(f"INFO: {args.ticker} is an old symbol of {ticker}.")
+                if len(tickers) > 1:
+                    print(
+                        f"INFO: {ticker} is linked by corporate actions to "
+                        f"{', '.join(t for t in tickers if t != ticker)}; "
+                        "loading them too (reporting only its own rows)."
+                    )
+            data_version = db.get_data_version()
+            key = cache_key(data_version, years, tickers, tax_window=tax_window)
+            if not (args.no_cache or args.verify_fifo):
+                cached = load_cached_results(key)
+            if cached is None and args.low_memory:
+                groups = (
+                    [tickers]
+                    if tickers
+                    else ticker_groups(graph, db.get_tickers(years[-1]))
+                )
+                print(f"INFO: Low-memory mode, {len(groups)} ticker groups.")
+            elif cached is None:
+                raw_trades = db.get_trades_for_calculation(
+                    target_year=years[-1], ticker=tickers
+                )
+                print(f"INFO: Loaded {len(raw_trades)} records from DB.")
+            if cached is None:
+                months = preload_rates(db.get_nbp_rates())
+                if months:
+                    print(f"INFO: Preloaded NBP rates for {months} currency-months.")
+    except Exception as e:
+        print(f"CRITICAL ERROR: Could not connect or fetch data. {e}")
+        sys.exit(1)
+
+    if cached is not None:
+        # Same DB state, years, filter and code: skip straight to the export
+        print("INFO: Results loaded from cache (no DB changes since last run).")
+        results, raw_trades, db_records = (
+            cached["results"],
+            cached["rows"],
+            cached["records"],
+        )
+    else:
+        if args.low_memory:
+            with profiler.stage("calculation"):
+                results, raw_trades, db_records = run_low_memory_calculation(
+                    args, years, groups, tax_window
+                )
+        else:
+            db_records = len(raw_trades)
+            if db_records:
+                with profiler.stage("calculation"):
+                    results = run_calculation(args, years, raw_trades, tax_window)
+        if not db_records:
+            print(
+                "WARNING: No trades found. Please import data first (python main.py --import-data)."
+            )
+            return
+        # Rates that fell back to 1.0 may be fixed by a later run: not cached
+        if get_nbp_stats()["fallbacks"] == 0:
+            year_start = f"{years[0]}-01-01"
+            with profiler.stage("cache_store"):
+                store_cached_results(
+                    key,
+                    {
+                        "results": results,
+                        # The exports only read the rows of the reported years
+                        "rows": [t for t in raw_trades if t["Date"] >= year_start],
+                        "records": db_records,
+                    },
+                )
+
+    if tickers and len(tickers) > 1:
+        results, raw_trades = filter_to_ticker(results, raw_trades, ticker)
+
+    # All years come out of the single replay above
+    for year in years:
+        report_year(
+            args, year, raw_trades, db_records, *results[year], profiler=profiler
+        )
+
+    print("\n--- NBP Currency Conversion ---")
+    for line in format_nbp_stats():
+        print(line)
+
+    profiler.finish()
+    if profiler.enabled:
+        print("\n--- Profile ---")
+        for line in profiler.format_lines():
+            print(line)
+        if args.profile_pstats:
+            print(f"INFO: cProfile dump saved to {args.profile_pstats}")
+        if args.profile_json:
+            profiler.write_json(
+                args.profile_json,
+                pipeline=get_stage_timings(),
+                nbp=get_nbp_stats(),
+                cache_hit=cached is not None,
+            )
+            print(f"INFO: Timing report saved to {args.profile_json}")
+
     print("Processing completed.")
 
 
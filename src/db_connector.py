@@ -10,6 +10,15 @@ from decouple import config
 DB_PATH = config("DATABASE_PATH", default="db/ibkr_history.db.enc")
 DB_KEY = config("SQLCIPHER_KEY", default=None)
 
+# Renamed tickers seeded into ticker_aliases: old symbol -> current symbol
+DEFAULT_TICKER_ALIASES = {
+    "TOT": "TTE",  # TotalEnergies old ticker
+    "FB": "META",  # Facebook old ticker
+}
+
+# Tables with a db_meta change counter (get_data_version, bump_data_version)
+VERSIONED_TABLES = ("transactions", "nbp_rates")
+
 
 class DBConnector:
     def __init__(self, db_path=None):
@@ -88,14 +97,91 @@ class DBConnector:
         );
         """
         self.conn.execute(query)
+        # Renamed tickers: Alias (old symbol) -> Ticker (canonical symbol).
+        # Every transaction row carries its canonical symbol in
+        # CanonicalTicker, set on insert and by set_ticker_alias, so reads
+        # filter and group on it without remapping rows.
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ticker_aliases (
+                Alias TEXT PRIMARY KEY,
+                Ticker TEXT
+            );
+            """)
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO ticker_aliases VALUES (?, ?);",
+            DEFAULT_TICKER_ALIASES.items(),
+        )
+        columns = [
+            row[1] for row in self.conn.execute("PRAGMA table_info(transactions)")
+        ]
+        if "CanonicalTicker" not in columns:
+            # Database created before the column existed
+            self.conn.execute(
+                "ALTER TABLE transactions ADD COLUMN CanonicalTicker TEXT;"
+            )
+            self.conn.execute("""
+                UPDATE transactions SET CanonicalTicker = COALESCE(
+                    (SELECT a.Ticker FROM ticker_aliases a
+                     WHERE a.Alias = transactions.Ticker),
+                    Ticker
+                );
+                """)
+        self.conn.execute("DROP INDEX IF EXISTS idx_transactions_ticker;")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_canonical "
+            "ON transactions (CanonicalTicker, Date);"
+        )
+        # Local NBP rate store (filled by --import-rates from NBP archive files).
+        # Rates are kept as TEXT to preserve exact Decimal values.
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS nbp_rates (
+                Currency TEXT,
+                Date TEXT,
+                Rate TEXT,
+                PRIMARY KEY (Currency, Date)
+            );
+            """)
+        # Change counters of the tables the calculation reads (see
+        # get_data_version), bumped once per write operation by the methods
+        # that write them, plus a random id telling this database apart from
+        # a re-created one.
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS db_meta (Name TEXT PRIMARY KEY, Value);"
+        )
+        self.conn.execute(
+            "INSERT OR IGNORE INTO db_meta VALUES ('db_id', ?);", (os.urandom(8).hex(),)
+        )
+        for table in VERSIONED_TABLES:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO db_meta VALUES (?, 0);", (f"{table}_version",)
+            )
         self.conn.commit()
 
+    def get_data_version(self):
+        """
+        {name: value} from db_meta: db_id and a change counter per table.
+        Any write to transactions or nbp_rates through this class changes it.
+        """
+        cursor = self.conn.execute("SELECT Name, Value FROM db_meta ORDER BY Name")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def bump_data_version(self, table):
+        """
+        Counts one write to `table` (see VERSIONED_TABLES) in db_meta; called
+        once per write operation, not per row, and committed with it.
+        """
+        self.conn.execute(
+            "UPDATE db_meta SET Value = Value + 1 WHERE Name = ?", (f"{table}_version",)
+        )
+
     def save_transaction(self, data):
         """Saves a single transaction record to the database."""
         query = """
             INSERT INTO transactions 
-            (Date, EventType, Ticker, Quantity, Price, Currency, Amount, Fee, Description)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            (Date, EventType, Ticker, Quantity, Price, Currency, Amount, Fee, Description,
+             CanonicalTicker)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,
+                    COALESCE((SELECT Ticker FROM ticker_aliases WHERE Alias = ?), ?))
         """
         self.conn.execute(
             query,
@@ -109,21 +195,26 @@ class DBConnector:
                 data.get("amount", 0),
                 data["fee"],
                 data["desc"],
+                data["ticker"],
+                data["ticker"],
             ),
         )
+        self.bump_data_version("transactions")
         self.conn.commit()
 
     def get_trades_for_calculation(self, target_year=None, ticker=None):
         """
         Fetches transactions for FIFO and tax reporting with explicit columns.
         Explicit listing is required for test compliance and clarity.
+        Ticker is the canonical symbol; `ticker` filters on it and is one
+        symbol or a list of them (see ticker_deps).
         """
         query = """
             SELECT 
                 rowid as TradeId, 
                 Date, 
                 EventType, 
-                Ticker, 
+                CanonicalTicker AS Ticker, 
                 Quantity, 
                 Price, 
                 Currency, 
@@ -135,15 +226,81 @@ class DBConnector:
         """
         params = []
 
-        if ticker:
-            query += " AND Ticker = ?"
+        if isinstance(ticker, str):
+            query += " AND CanonicalTicker = ?"
             params.append(ticker)
+        elif ticker:
+            query += f" AND CanonicalTicker IN ({', '.join('?' * len(ticker))})"
+            params.extend(ticker)
 
         if target_year:
             query += " AND Date <= ?"
             params.append(f"{target_year}-12-31")
 
-        query += " ORDER BY Date ASC"
+        query += " ORDER BY Date ASC, rowid ASC"
 
         cursor = self.conn.execute(query, params)
         return [dict(row) for row in cursor.fetchall()]
+
+    def get_tickers(self, target_year=None):
+        """Distinct canonical tickers with rows up to the end of target_year."""
+        query = "SELECT DISTINCT CanonicalTicker FROM transactions"
+        params = []
+        if target_year:
+            query += " WHERE Date <= ?"
+            params.append(f"{target_year}-12-31")
+        cursor = self.conn.execute(query, params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_ticker_aliases(self):
+        """{alias: canonical ticker} from the alias table."""
+        cursor = self.conn.execute("SELECT Alias, Ticker FROM ticker_aliases")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def set_ticker_alias(self, alias, ticker):
+        """
+        Makes `ticker` the canonical symbol of `alias` and re-maps the stored
+        rows: those of the alias and those already mapped onto it.
+        """
+        ticker = self.get_ticker_aliases().get(ticker, ticker)
+        if alias == ticker:
+            raise ValueError(f"{alias} cannot be an alias of itself.")
+        self.conn.execute(
+            "UPDATE ticker_aliases SET Ticker = ? WHERE Ticker = ?", (ticker, alias)
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ticker_aliases VALUES (?, ?)", (alias, ticker)
+        )
+        cursor = self.conn.execute(
+            "UPDATE transactions SET CanonicalTicker = ? "
+            "WHERE CanonicalTicker = ? OR Ticker = ?",
+            (ticker, alias, alias),
+        )
+        self.bump_data_version("transactions")
+        self.conn.commit()
+        return cursor.rowcount
+
+    def get_corporate_actions(self, event_types):
+        """(canonical Ticker, Description) of the rows of the given event types."""
+        event_types = list(event_types)
+        query = "SELECT CanonicalTicker, Description FROM transactions"
+        # One placeholder per event type; the values themselves are bound
+        query += f" WHERE EventType IN ({', '.join('?' * len(event_types))})"
+        cursor = self.conn.execute(query, event_types)
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def save_nbp_rates(self, rows):
+        """Bulk upserts (currency, date, rate) rows into the local rate store."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO nbp_rates (Currency, Date, Rate) VALUES (?, ?, ?)",
+            [(cur, d, str(rate)) for cur, d, rate in rows],
+        )
+        self.bump_data_version("nbp_rates")
+        self.conn.commit()
+
+    def get_nbp_rates(self):
+        """Returns all stored NBP rates as (currency, date, rate_str) tuples."""
+        cursor = self.conn.execute(
+            "SELECT Currency, Date, Rate FROM nbp_rates ORDER BY Currency, Date"
+        )
+        return [tuple(row) for row in cursor.fetchall()]
@@ -3,6 +3,8 @@
 import pandas as pd
 from typing import Dict, Any
 
+from src.progress import ERROR, INFO, reporter
+
 
 def export_to_excel(
     sheets_data: Dict[str, pd.DataFrame],
@@ -56,21 +58,26 @@ def export_to_excel(
             df_ticker_summary.to_excel(writer, sheet_name="Ticker Summary", index=False)
 
         # 3. Write Separate Data Sheets (Sales, Dividends, Inventory)
-        for sheet_name, df in sheets_data.items():
-            if not df.empty:
-                # Create a copy to modify without affecting the original dataframe
-                df_export = df.copy()
+        with reporter.stage("excel sheets"):
+            for sheet_name, df in reporter.track(sheets_data.items(), every=1):
+                if not df.empty:
+                    # Create a copy to modify without affecting the original dataframe
+                    df_export = df.copy()
 
-                # Insert 'No.' column at position 0
-                df_export.insert(0, "No.", range(1, len(df_export) + 1))
+                    # Insert 'No.' column at position 0
+                    df_export.insert(0, "No.", range(1, len(df_export) + 1))
 
-                df_export.to_excel(writer, sheet_name=sheet_name, index=False)
-                print(f"INFO: Added sheet '{sheet_name}' with {len(df)} rows.")
-            else:
-                print(f"INFO: Skipping empty sheet '{sheet_name}'.")
+                    df_export.to_excel(writer, sheet_name=sheet_name, index=False)
+                    reporter.message(
+                        INFO, f"Added sheet '{sheet_name}' with {len(df)} rows."
+                    )
+                else:
+                    reporter.message(INFO, f"Skipping empty sheet '{sheet_name}'.")
 
         writer.close()
-        print(f"SUCCESS: Data exported to Excel at {file_path}")
+        reporter.message(INFO, f"✅ Data exported to Excel at {file_path}")
 
     except Exception as e:
-        print(f"ERROR: Failed to export Excel file at {file_path}. Reason: {e}")
+        reporter.message(
+            ERROR, f"Failed to export Excel file at {file_path}. Reason: {e}"
+        )
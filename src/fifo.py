@@ -1,67 +1,592 @@
 # src/fifo.py
 
+import copy
+import heapq
 import json
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
-from collections import deque
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 from .nbp import get_rate_for_tax_date
 from .utils import money
 
+# Lots within this quantity of the remaining sale are consumed whole
+_QTY_EPSILON = Decimal("0.00000001")
+
+# Versioned snapshot format for TradeMatcher.dump_state()/from_state()
+STATE_FORMAT = "ibkr-tax-fifo-state"
+STATE_VERSION = 1
+
+# Priority: SPLIT (process first if same day to adjust holdings) -> BUY -> SELL
+_TYPE_PRIORITY = {
+    "SPLIT": 0,
+    "STOCK_DIV": 1,
+    "MERGER": 1,
+    "SPLIT_ADD": 1,
+    "BUY": 2,
+    "TRANSFER": 2,
+    "SELL": 3,
+}
+
+
+def event_sort_key(trade):
+    return (trade["date"], _TYPE_PRIORITY.get(trade["type"], 99))
+
+
+# Partitions handed to forked workers by index instead of being pickled
+_FORKED_JOBS = None
+
+
+def _fork_context():
+    try:
+        return multiprocessing.get_context("fork")
+    except ValueError:
+        return None  # Platform without fork (Windows): jobs are pickled
+
+
+def _match_partition(job):
+    """
+    Process-pool worker: runs one ticker's events through a fresh matcher.
+    Returns (ticker, remaining lots, split ratios, [(seq, realized record), ...]).
+    """
+    if isinstance(job, int):
+        job = _FORKED_JOBS[job]
+    matcher_cls, options, ticker, lots, splits, events = job
+    matcher = matcher_cls(**options)
+    matcher.inventory[ticker] = lots if lots is not None else LotQueue()
+    if splits:
+        matcher.splits[ticker] = splits
+    gains = matcher._match_ticker(ticker, events)
+    return ticker, matcher.inventory[ticker], matcher.splits.get(ticker), gains
+
+
+def _sale_totals(qty, price, rate, commission, cost_basis_pln):
+    """(revenue, total cost incl. commission, profit) of a sale, in PLN."""
+    revenue_pln = money(price * qty * rate)
+    total_cost = cost_basis_pln + money(abs(commission) * rate)
+    return revenue_pln, total_cost, revenue_pln - total_cost
+
+
+def _output_record(record):
+    return dict(record, matched_buys=[lot.to_dict() for lot in record["matched_buys"]])
+
+
+class Lot:
+    """
+    One open purchase lot (BUY, TRANSFER in or corporate action addition).
+    Slotted to keep per-lot memory small on DRIP / fractional-share accounts.
+    """
+
+    __slots__ = (
+        "date",
+        "qty",
+        "price",
+        "rate",
+        "cost_pln",
+        "currency",
+        "source",
+        "epoch",
+    )
+
+    def __init__(self, date, qty, price, rate, cost_pln, currency, source, epoch=0):
+        self.date = date
+        self.qty = qty
+        self.price = price
+        self.rate = rate
+        self.cost_pln = cost_pln
+        self.currency = currency
+        self.source = source
+        # Number of the ticker's splits already applied to qty/price
+        self.epoch = epoch
+
+    def copy(self) -> "Lot":
+        return Lot(
+            self.date,
+            self.qty,
+            self.price,
+            self.rate,
+            self.cost_pln,
+            self.currency,
+            self.source,
+            self.epoch,
+        )
+
+    def __reduce__(self):
+        # Positional rebuild is much cheaper than the default slot-state pickling
+        return (
+            Lot,
+            (
+                self.date,
+                self.qty,
+                self.price,
+                self.rate,
+                self.cost_pln,
+                self.currency,
+                self.source,
+                self.epoch,
+            ),
+        )
+
+    def to_state(self) -> List[str]:
+        """Compact positional form for snapshots; Decimals as exact strings."""
+        return [
+            self.date,
+            str(self.qty),
+            str(self.price),
+            str(self.rate),
+            str(self.cost_pln),
+            self.currency,
+            self.source,
+        ]
+
+    @classmethod
+    def from_state(cls, row: List[str]) -> "Lot":
+        date, qty, price, rate, cost_pln, currency, source = row
+        return cls(
+            date,
+            Decimal(qty),
+            Decimal(price),
+            Decimal(rate),
+            Decimal(cost_pln),
+            currency,
+            source,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "date": self.date,
+            "qty": self.qty,
+            "price": self.price,
+            "rate": self.rate,
+            "cost_pln": self.cost_pln,
+            "currency": self.currency,
+            "source": self.source,
+        }
+
+
+def _unchanged(lot):
+    return lot
+
+
+class LotQueue:
+    """
+    FIFO queue of one ticker's open lots with a prefix-sum index.
+
+    cum_qty[i] / cum_cost[i] hold running totals of the lots up to i;
+    taken_qty / taken_cost are what has been consumed of them. A sale finds
+    its split point with a binary search over cum_qty and costs the lots it
+    consumes whole with one subtraction instead of a Python loop.
+    Consumed lots stay in `lots` (before `head`) until the next compaction.
+
+    Splits leave the index as it is (see split): lots added between two
+    splits form a segment, cum_qty restarts at every segment in the units
+    its lots were added in, and the segment's cumulative split factor
+    converts them to current units when they are read. taken_qty is in
+    current units. cum_cost is absolute, as splits do not change costs.
+    Lot objects are settled by the `settle` callback only when a sale
+    reads or returns them (see TradeMatcher._settle).
+    """
+
+    __slots__ = (
+        "lots",
+        "head",
+        "cum_qty",
+        "cum_cost",
+        "taken_qty",
+        "taken_cost",
+        "seg_start",
+        "seg_scale",
+    )
+
+    # Compact once this many consumed lots are retained and they are the majority
+    COMPACT_MIN = 1024
+
+    def __init__(self, lots=()):
+        self.lots = []
+        self.head = 0
+        self.cum_qty = []
+        self.cum_cost = []
+        self.taken_qty = Decimal(0)
+        self.taken_cost = Decimal(0)
+        # First lot of each open segment and its cumulative split factor;
+        # the first segment is the head's
+        self.seg_start = []
+        self.seg_scale = []
+        for lot in lots:
+            self.append(lot)
+
+    def __len__(self):
+        return len(self.lots) - self.head
+
+    def __bool__(self):
+        return len(self.lots) > self.head
+
+    def __iter__(self):
+        return iter(self.lots[self.head :])
+
+    def __getitem__(self, index):
+        if 0 <= index < len(self):
+            return self.lots[self.head + index]
+        return self.lots[self.head :][index]
+
+    def append(self, lot):
+        if not self.seg_start:
+            self.seg_start.append(len(self.lots))
+            self.seg_scale.append(Decimal(1))
+        in_segment = len(self.lots) > self.seg_start[-1]
+        self.lots.append(lot)
+        self.cum_qty.append((self.cum_qty[-1] if in_segment else 0) + lot.qty)
+        # An empty cost index (fresh or fully compacted) continues from taken_cost
+        self.cum_cost.append(
+            (self.cum_cost[-1] if self.cum_cost else self.taken_cost) + lot.cost_pln
+        )
+
+    def split(self, ratio: Decimal):
+        """
+        Applies a split to the index in O(segments): scales the open
+        segments and starts a new one for the lots added after it.
+        """
+        starts, scales = self.seg_start, self.seg_scale
+        # A trailing segment without lots yet is already in post-split units
+        open_segments = len(starts)
+        if starts and starts[-1] == len(self.lots):
+            open_segments -= 1
+        for k in range(open_segments):
+            scales[k] *= ratio
+        self.taken_qty *= ratio
+        if open_segments == len(starts):
+            starts.append(len(self.lots))
+            scales.append(Decimal(1))
+
+    def _advance(self, end):
+        """Moves the head to `end`, dropping the segments consumed whole."""
+        if end == self.head:
+            return
+        self.head = end
+        starts, scales = self.seg_start, self.seg_scale
+        if end == len(self.lots):
+            starts.clear()
+            scales.clear()
+            self.taken_qty = Decimal(0)
+            return
+        while len(starts) > 1 and starts[1] <= end:
+            del starts[0], scales[0]
+        if end > starts[0]:
+            self.taken_qty = self.cum_qty[end - 1] * scales[0]
+        else:
+            self.taken_qty = Decimal(0)
+
+    def popleft(self, settle: Callable[[Lot], Lot] = _unchanged):
+        lot = settle(self.lots[self.head])
+        self.taken_cost += lot.cost_pln
+        self._advance(self.head + 1)
+        return lot
+
+    def compact(self):
+        """Drops consumed lots; prefix sums are per segment, so they are just sliced."""
+        head = self.head
+        self.lots = self.lots[head:]
+        self.cum_qty = self.cum_qty[head:]
+        self.cum_cost = self.cum_cost[head:]
+        self.seg_start = [max(start - head, 0) for start in self.seg_start]
+        self.head = 0
+
+    def take(
+        self,
+        qty: Decimal,
+        with_detail: bool = True,
+        settle: Callable[[Lot], Lot] = _unchanged,
+    ):
+        """
+        Consumes `qty` from the head, with the same epsilon and rounding rules
+        as lot-by-lot FIFO. Returns (cost_pln, matched lots, unfilled qty).
+        """
+        lots, head = self.lots, self.head
+        end, whole_qty, cost = self._whole_lots(qty)
+
+        matched = [settle(lot) for lot in lots[head:end]] if with_detail else []
+        self.taken_cost += cost
+        qty -= whole_qty
+        self._advance(end)
+
+        if qty > 0 and end < len(lots):
+            # Take partial lot
+            lot = settle(lots[end])
+            part_cost = money(lot.cost_pln * (qty / lot.qty))
+
+            if with_detail:
+                partial_record = lot.copy()
+                partial_record.qty = qty
+                partial_record.cost_pln = part_cost
+                matched.append(partial_record)
+
+            cost += part_cost
+            lot.qty -= qty
+            lot.cost_pln -= part_cost
+            self.taken_qty += qty
+            self.taken_cost += part_cost
+            qty = Decimal(0)
+
+        if self.head >= self.COMPACT_MIN and self.head * 2 >= len(lots):
+            self.compact()
+        return cost, matched, max(qty, Decimal(0))
+
+    def _whole_lots(self, qty: Decimal):
+        """(end index, qty, cost) of the lots a sale of `qty` consumes whole."""
+        cum_qty, starts, scales = self.cum_qty, self.seg_start, self.seg_scale
+        head = end = self.head
+        whole_qty = Decimal(0)
+        taken = self.taken_qty
+        for k, scale in enumerate(scales):
+            rest = qty - whole_qty
+            if rest <= 0:
+                break
+            stop = starts[k + 1] if k + 1 < len(starts) else len(self.lots)
+            target = taken + rest
+            key = None if scale == 1 else (lambda c: c * scale)
+
+            # Whole lots: remaining cumulative qty within qty + epsilon, but never
+            # past the first lot that already fills the sale (tiny trailing lots)
+            hi = bisect_right(cum_qty, target + _QTY_EPSILON, end, stop, key=key)
+            hi = min(hi, bisect_left(cum_qty, target, end, stop, key=key) + 1)
+            if hi > end:
+                whole_qty += cum_qty[hi - 1] * scale - taken
+                end = hi
+            if end < stop:
+                break
+            taken = Decimal(0)
+
+        if end > head:
+            return end, whole_qty, self.cum_cost[end - 1] - self.taken_cost
+        return end, Decimal(0), Decimal("0.00")
+
+    def total_qty(self) -> Decimal:
+        """Open quantity, in current (post-split) units."""
+        if not self:
+            return Decimal(0)
+        total = -self.taken_qty
+        for k, (start, scale) in enumerate(zip(self.seg_start, self.seg_scale)):
+            stop = (
+                self.seg_start[k + 1] if k + 1 < len(self.seg_start) else len(self.lots)
+            )
+            if stop > start:
+                total += self.cum_qty[stop - 1] * scale
+        return total
+
+    def quote(self, qty: Decimal, settle: Callable[[Lot], Lot] = _unchanged):
+        """
+        What take(qty) would return as (cost_pln, unfilled qty), read-only:
+        one binary search plus at most one partial lot.
+        """
+        end, whole_qty, cost = self._whole_lots(qty)
+        qty -= whole_qty
+        if qty > 0 and end < len(self.lots):
+            lot = settle(self.lots[end])
+            return cost + money(lot.cost_pln * (qty / lot.qty)), Decimal(0)
+        return cost, max(qty, Decimal(0))
+
+    def take_sequential(
+        self,
+        qty: Decimal,
+        with_detail: bool = True,
+        settle: Callable[[Lot], Lot] = _unchanged,
+    ):
+        """
+        Lot-by-lot equivalent of take() that ignores the prefix sums for
+        selection (kept as the reference for cross-checking the index).
+        """
+        cost = Decimal("0.00")
+        matched = []
+        while qty > 0 and self:
+            lot = settle(self.lots[self.head])
+
+            # Avoid precision issues with tiny leftovers
+            if lot.qty <= qty + _QTY_EPSILON:
+                # Take whole lot
+                cost += lot.cost_pln
+                if with_detail:
+                    matched.append(lot)
+                self.popleft()
+                qty -= lot.qty
+            else:
+                # Take partial lot
+                part_cost = money(lot.cost_pln * (qty / lot.qty))
+
+                if with_detail:
+                    partial_record = lot.copy()
+                    partial_record.qty = qty
+                    partial_record.cost_pln = part_cost
+                    matched.append(partial_record)
+
+                cost += part_cost
+                lot.qty -= qty
+                lot.cost_pln -= part_cost
+                self.taken_qty += qty
+                self.taken_cost += part_cost
+                qty = Decimal(0)
+        return cost, matched, max(qty, Decimal(0))
+
 
 class TradeMatcher:
-    def __init__(self):
+    # True: always match ticker by ticker (see _match_ticker), even serially
+    per_ticker = False
+
+    def __init__(
+        self,
+        keep_lot_detail: bool = True,
+        sink: Optional[Callable[[Dict[str, Any]], None]] = None,
+        years: Optional[Iterable[int]] = None,
+    ):
+        # keep_lot_detail=False skips building matched_buys for each sale
+        self.keep_lot_detail = keep_lot_detail
+        # Realized gains go to sink(record) as they are created (same form as
+        # get_realized_gains()) instead of accumulating in realized_pnl.
+        self.sink = sink
+        # Reporting window: sales dated in other years still consume lots,
+        # but no record is built for them.
+        self.years = set(years) if years is not None else None
         self.inventory = {}
         self.realized_pnl = []
+        # Date of the latest processed event and number of events seen.
+        # Restored from snapshots so that only newer events are fed afterwards.
+        self.as_of = None
+        self.events_processed = 0
+        # Free-form metadata stored alongside a snapshot (see dump_state)
+        self.state_meta = {}
+        # Split ratios per ticker, applied lazily to lots (see _settle)
+        self.splits = {}
+
+    def process_trades(
+        self,
+        trades_list: List[Dict[str, Any]],
+        workers: int = 1,
+        presorted: bool = False,
+    ):
+        """
+        Runs FIFO matching over the events.
+
+        workers > 1 partitions the stream by ticker (FIFO queues are independent
+        per ticker), matches the partitions in a process pool and merges the
+        results back in the serial order, so the output is identical to workers=1.
+        presorted=True skips sorting for a list already in event_sort_key order.
+        """
+        if presorted:
+            sorted_trades = trades_list
+        else:
+            sorted_trades = sorted(trades_list, key=event_sort_key)
+        if not sorted_trades:
+            return
 
-    def process_trades(self, trades_list: List[Dict[str, Any]]):
-        # Priority: SPLIT (process first if same day to adjust holdings) -> BUY -> SELL
-        type_priority = {
-            "SPLIT": 0,
-            "STOCK_DIV": 1,
-            "MERGER": 1,
-            "SPLIT_ADD": 1,
-            "BUY": 2,
-            "TRANSFER": 2,
-            "SELL": 3,
-        }
+        if self.as_of and sorted_trades[0]["date"] < self.as_of:
+            raise ValueError(
+                f"Event dated {sorted_trades[0]['date']} is older than the matcher "
+                f"state (as of {self.as_of}); replay from scratch instead."
+            )
 
-        sorted_trades = sorted(
-            trades_list, key=lambda x: (x["date"], type_priority.get(x["type"], 99))
-        )
+        if workers > 1 or self.per_ticker:
+            self._process_partitioned(sorted_trades, workers)
+        else:
+            for trade in sorted_trades:
+                self._process_event(trade)
+
+        self.as_of = sorted_trades[-1]["date"]
+        self.events_processed += len(sorted_trades)
+
+    def _process_event(self, trade):
+        ticker = trade["ticker"]
+        if ticker not in self.inventory:
+            self.inventory[ticker] = LotQueue()
+
+        t_type = trade["type"]
+        qty = trade.get("qty", Decimal(0))
 
-        for trade in sorted_trades:
-            ticker = trade["ticker"]
-            if ticker not in self.inventory:
-                self.inventory[ticker] = deque()
-
-            t_type = trade["type"]
-            qty = trade.get("qty", Decimal(0))
-
-            # --- SPECIAL HANDLING FOR SPLITS ---
-            if t_type == "SPLIT":
-                self._process_split(trade)
-                continue
-
-            # --- 1. POSITIVE QUANTITY (ADD TO INVENTORY) ---
-            if qty > 0:
-                # Includes: BUY, STOCK_DIV (Split add), MERGER (New shares), SPINOFF
-                if t_type == "BUY" or t_type == "TRANSFER":
-                    self._process_buy(trade)
-                else:
-                    # Corporate Action Additions (Zero Cost usually)
-                    # Force price to 0 if it's a Corp Action to avoid messing up cost basis
-                    trade["price"] = Decimal(0)
-                    self._process_buy(trade)
-
-            # --- 2. NEGATIVE QUANTITY (REMOVE FROM INVENTORY) ---
-            elif qty < 0:
-                # Includes: SELL, MERGER (Old shares removal), LIQUIDATION
-                if t_type == "SELL":
-                    self._process_sell(trade)
-                else:
-                    # Corporate Action Removals (Non-Taxable Transfer Out)
-                    self._process_transfer_out(trade)
+        # --- SPECIAL HANDLING FOR SPLITS ---
+        if t_type == "SPLIT":
+            self._process_split(trade)
+            return
+
+        # --- 1. POSITIVE QUANTITY (ADD TO INVENTORY) ---
+        if qty > 0:
+            # Includes: BUY, STOCK_DIV (Split add), MERGER (New shares), SPINOFF
+            if t_type == "BUY" or t_type == "TRANSFER":
+                self._process_buy(trade)
+            else:
+                # Corporate Action Additions (Zero Cost usually)
+                # Force price to 0 if it's a Corp Action to avoid messing up cost basis
+                trade["price"] = Decimal(0)
+                self._process_buy(trade)
+
+        # --- 2. NEGATIVE QUANTITY (REMOVE FROM INVENTORY) ---
+        elif qty < 0:
+            # Includes: SELL, MERGER (Old shares removal), LIQUIDATION
+            if t_type == "SELL":
+                self._process_sell(trade)
+            else:
+                # Corporate Action Removals (Non-Taxable Transfer Out)
+                self._process_transfer_out(trade)
+
+    def _match_ticker(self, ticker, events):
+        """
+        Runs one ticker's (seq, trade) events, the matcher holding only that
+        ticker. Returns [(seq, realized record), ...].
+        """
+        gains = []
+        for seq, trade in events:
+            self._process_event(trade)
+            while len(gains) < len(self.realized_pnl):
+                gains.append((seq, self.realized_pnl[len(gains)]))
+        return gains
+
+    def _process_partitioned(self, sorted_trades, workers):
+        # Partition by ticker, remembering each event's position in the global order
+        partitions = {}
+        for seq, trade in enumerate(sorted_trades):
+            partitions.setdefault(trade["ticker"], []).append((seq, trade))
+
+        options = {"keep_lot_detail": self.keep_lot_detail, "years": self.years}
+        jobs = [
+            (
+                type(self),
+                options,
+                ticker,
+                self.inventory.get(ticker),
+                self.splits.get(ticker),
+                events,
+            )
+            for ticker, events in partitions.items()
+        ]
+        if workers <= 1:
+            self._merge_partitions([_match_partition(job) for job in jobs])
+            return
+        chunksize = max(1, len(jobs) // (workers * 4))
+
+        # With fork the workers inherit the partitions, so only indexes travel
+        # through the pool; pickling Decimal-heavy events would dominate otherwise.
+        global _FORKED_JOBS
+        context = _fork_context()
+        payload = range(len(jobs)) if context else jobs
+        _FORKED_JOBS = jobs if context else None
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                results = list(pool.map(_match_partition, payload, chunksize=chunksize))
+        finally:
+            _FORKED_JOBS = None
+        self._merge_partitions(results)
+
+    def _merge_partitions(self, results):
+        # Dict order of partitions == order of each ticker's first event,
+        # which is exactly how the serial loop fills self.inventory.
+        for ticker, lots, splits, _ in results:
+            self.inventory[ticker] = lots
+            if splits:
+                self.splits[ticker] = splits
+
+        # Each partition's gains are already in global order: k-way merge by seq
+        merged = heapq.merge(*(r[3] for r in results), key=lambda g: g[0])
+        for _, record in merged:
+            self._emit(record)
 
     def _process_split(self, trade):
         ticker = trade["ticker"]
@@ -70,25 +595,40 @@ class TradeMatcher:
         if ticker not in self.inventory or not self.inventory[ticker]:
             return
 
-        # Apply split to all existing batches in inventory
-        # New Qty = Old Qty * Ratio
-        # New Price = Old Price / Ratio (Cost basis per batch stays same)
-        new_deque = deque()
-        while self.inventory[ticker]:
-            batch = self.inventory[ticker].popleft()
+        # Only record the ratio and scale the queue index. Lots existing now
+        # have a smaller epoch and get it applied when they are next read.
+        self.splits.setdefault(ticker, []).append(ratio)
+        self.inventory[ticker].split(ratio)
+
+    def _settle(self, ticker, lot):
+        """Applies pending splits to a lot, in order, exactly like an eager split."""
+        ratios = self.splits.get(ticker)
+        if not ratios or lot.epoch == len(ratios):
+            return lot
 
-            # Adjust Quantity
-            batch["qty"] = batch["qty"] * ratio
+        for ratio in ratios[lot.epoch :]:
+            # New Qty = Old Qty * Ratio
+            lot.qty = lot.qty * ratio
 
-            # Adjust Unit Price (Total Cost remains unchanged)
+            # New Price = Old Price / Ratio (Cost basis per lot stays same)
             if ratio != 0:
-                batch["price"] = batch["price"] / ratio
+                lot.price = lot.price / ratio
+        lot.epoch = len(ratios)
+        return lot
 
-            new_deque.append(batch)
+    def _settler(self, ticker) -> Callable[[Lot], Lot]:
+        """Callback settling the ticker's lots a LotQueue sale reads or returns."""
+        return lambda lot: self._settle(ticker, lot)
 
-        self.inventory[ticker] = new_deque
+    def _take(self, ticker, qty, with_detail):
+        return self.inventory[ticker].take(
+            qty, with_detail, settle=self._settler(ticker)
+        )
 
     def _process_buy(self, trade):
+        self.inventory[trade["ticker"]].append(self._new_lot(trade))
+
+    def _new_lot(self, trade) -> Lot:
         if "rate" in trade and trade["rate"]:
             rate = trade["rate"]
         else:
@@ -99,16 +639,15 @@ class TradeMatcher:
         # Cost is calculated here
         cost_pln = money((price * trade["qty"] * rate) + (abs(comm) * rate))
 
-        self.inventory[trade["ticker"]].append(
-            {
-                "date": trade["date"],
-                "qty": trade["qty"],
-                "price": price,
-                "rate": rate,
-                "cost_pln": cost_pln,
-                "currency": trade["currency"],
-                "source": trade.get("source", "UNKNOWN"),
-            }
+        return Lot(
+            trade["date"],
+            trade["qty"],
+            price,
+            rate,
+            cost_pln,
+            trade["currency"],
+            trade.get("source", "UNKNOWN"),
+            len(self.splits.get(trade["ticker"], ())),
         )
 
     def _process_sell(self, trade):
@@ -118,6 +657,18 @@ class TradeMatcher:
         self._consume_inventory(trade, is_taxable=False)
 
     def _consume_inventory(self, trade, is_taxable):
+        reported = is_taxable and self._is_reported(trade)
+        cost_basis_pln, matched_buys, _ = self._take(
+            trade["ticker"], abs(trade["qty"]), reported and self.keep_lot_detail
+        )
+        if reported:
+            # Transfers out and sales outside the reporting window build no record
+            self._record_sale(trade, cost_basis_pln, matched_buys)
+
+    def _is_reported(self, trade):
+        return self.years is None or int(trade["date"][:4]) in self.years
+
+    def _record_sale(self, trade, cost_basis_pln, matched_buys):
         ticker = trade["ticker"]
         qty_to_sell = abs(trade["qty"])
 
@@ -128,80 +679,223 @@ class TradeMatcher:
 
         price = trade.get("price", Decimal(0))
         comm = trade.get("commission", Decimal(0))
+        sell_revenue_pln, total_cost, profit_pln = _sale_totals(
+            qty_to_sell, price, sell_rate, comm, cost_basis_pln
+        )
 
-        sell_revenue_pln = money(price * qty_to_sell * sell_rate)
+        self._emit(
+            {
+                "ticker": ticker,
+                "sale_date": trade["date"],
+                "date_sell": trade["date"],
+                # DB TradeId of the SELL row, if the event came from the DB
+                "trade_id": trade.get("trade_id"),
+                "quantity": float(abs(trade["qty"])),
+                "sale_price": float(price),
+                "sale_rate": float(sell_rate),
+                "sale_amount": float(sell_revenue_pln),
+                "cost_basis": float(total_cost),
+                "profit_loss": float(profit_pln),
+                "currency": trade["currency"],
+                "matched_buys": matched_buys,
+            }
+        )
 
-        cost_basis_pln = Decimal("0.00")
-        matched_buys = []
+    def quote_sale(
+        self,
+        ticker: str,
+        qty: Optional[Decimal] = None,
+        price: Decimal = Decimal(0),
+        rate: Decimal = Decimal(1),
+        commission: Decimal = Decimal(0),
+    ) -> Dict[str, Any]:
+        """
+        Tax impact of selling `qty` shares (default: the whole position) now,
+        at `price` in the lot currency and NBP `rate`, without changing any
+        state. Uses the same rounding as a real SELL. Amounts are Decimal PLN.
+        Raises ValueError if `qty` is not positive or fewer shares are held.
+        """
+        if ticker not in self.inventory:
+            raise ValueError(f"No open position in {ticker}.")
+        queue = self.inventory[ticker]
+        held = queue.total_qty()
+        qty = held if qty is None else qty
+        if qty <= 0:
+            raise ValueError(f"Cannot quote a sale of {qty} shares of {ticker}.")
+
+        cost_basis_pln, unfilled = queue.quote(qty, settle=self._settler(ticker))
+        if unfilled > 0:
+            raise ValueError(f"Only {held} shares of {ticker} held, cannot sell {qty}.")
+
+        revenue_pln, total_cost, profit_pln = _sale_totals(
+            qty, price, rate, commission, cost_basis_pln
+        )
+        return {
+            "ticker": ticker,
+            "quantity": qty,
+            "held": held,
+            "proceeds_pln": revenue_pln,
+            "cost_basis_pln": total_cost,
+            "profit_pln": profit_pln,
+        }
 
-        while qty_to_sell > 0:
-            if not self.inventory.get(ticker):
-                break
+    def _emit(self, record):
+        if self.sink is None:
+            self.realized_pnl.append(record)
+        else:
+            self.sink(_output_record(record))
+
+    # --- Snapshots (warm start) ---
+
+    def dump_state(self, meta: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Serializable snapshot of the matcher: open lots per ticker, counters and
+        the realized gains of the as_of year (so that a warm-started run still
+        reports the whole current year). Decimals are stored as exact strings.
+        """
+        year_start = f"{self.as_of[:4]}-01-01" if self.as_of else ""
+        realized = [
+            dict(r, matched_buys=[lot.to_state() for lot in r["matched_buys"]])
+            for r in self.realized_pnl
+            if r["sale_date"] >= year_start
+        ]
+        return {
+            "format": STATE_FORMAT,
+            "version": STATE_VERSION,
+            "as_of": self.as_of,
+            "events_processed": self.events_processed,
+            "meta": meta or {},
+            "inventory": {
+                ticker: [self._settle(ticker, lot).to_state() for lot in lots]
+                for ticker, lots in self.inventory.items()
+            },
+            "realized": realized,
+        }
 
-            buy_batch = self.inventory[ticker][0]
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "TradeMatcher":
+        if state.get("format") != STATE_FORMAT:
+            raise ValueError("Not a FIFO matcher snapshot.")
+        if state.get("version") != STATE_VERSION:
+            raise ValueError(
+                f"Unsupported FIFO snapshot version {state.get('version')} "
+                f"(expected {STATE_VERSION})."
+            )
 
-            # Avoid precision issues with tiny leftovers
-            if buy_batch["qty"] <= qty_to_sell + Decimal("0.00000001"):
-                # Take whole batch
-                cost_basis_pln += buy_batch["cost_pln"]
-                taken_qty = buy_batch["qty"]
+        matcher = cls()
+        matcher.as_of = state["as_of"]
+        matcher.events_processed = state["events_processed"]
+        matcher.state_meta = state.get("meta", {})
+        for ticker, rows in state["inventory"].items():
+            matcher.inventory[ticker] = LotQueue(Lot.from_state(row) for row in rows)
+        for record in state["realized"]:
+            matcher.realized_pnl.append(
+                dict(
+                    record,
+                    matched_buys=[
+                        Lot.from_state(row) for row in record["matched_buys"]
+                    ],
+                )
+            )
+        return matcher
 
-                matched_buys.append(buy_batch.copy())
-                self.inventory[ticker].popleft()
+    def save_state(self, path: str, meta: Dict[str, Any] = None) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.dump_state(meta), f, separators=(",", ":"))
 
-                qty_to_sell -= taken_qty
-            else:
-                # Take partial batch
-                ratio = qty_to_sell / buy_batch["qty"]
-                part_cost = money(buy_batch["cost_pln"] * ratio)
-
-                partial_record = buy_batch.copy()
-                partial_record["qty"] = qty_to_sell
-                partial_record["cost_pln"] = part_cost
-                matched_buys.append(partial_record)
-
-                cost_basis_pln += part_cost
-
-                buy_batch["qty"] -= qty_to_sell
-                buy_batch["cost_pln"] -= part_cost
-                qty_to_sell = 0
-
-        if is_taxable:
-            sell_comm_pln = money(abs(comm) * sell_rate)
-            total_cost = cost_basis_pln + sell_comm_pln
-            profit_pln = sell_revenue_pln - total_cost
-
-            self.realized_pnl.append(
-                {
-                    "ticker": ticker,
-                    "sale_date": trade["date"],
-                    "date_sell": trade["date"],
-                    "quantity": float(abs(trade["qty"])),
-                    "sale_price": float(price),
-                    "sale_rate": float(sell_rate),
-                    "sale_amount": float(sell_revenue_pln),
-                    "cost_basis": float(total_cost),
-                    "profit_loss": float(profit_pln),
-                    "currency": trade["currency"],
-                    "matched_buys": matched_buys,
-                }
-            )
+    @classmethod
+    def load_state(cls, path: str) -> "TradeMatcher":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_state(json.load(f))
 
     def get_realized_gains(self):
-        return self.realized_pnl
+        # Lots are converted to plain dicts only here, at the output boundary
+        return [_output_record(r) for r in self.realized_pnl]
 
     def get_current_inventory(self):
         inventory_list = []
-        for ticker, batches in self.inventory.items():
-            for batch in batches:
+        for ticker, lots in self.inventory.items():
+            for lot in lots:
+                self._settle(ticker, lot)
                 inventory_list.append(
                     {
                         "ticker": ticker,
-                        "buy_date": batch["date"],
-                        "quantity": float(batch["qty"]),
-                        "cost_per_share": float(batch["price"]),
-                        "total_cost": float(batch["cost_pln"]),
-                        "currency": batch["currency"],
+                        "buy_date": lot.date,
+                        "quantity": float(lot.qty),
+                        "cost_per_share": float(lot.price),
+                        "total_cost": float(lot.cost_pln),
+                        "currency": lot.currency,
                     }
                 )
         return inventory_list
+
+
+class SequentialTradeMatcher(TradeMatcher):
+    """
+    Reference engine: consumes lots one by one instead of through the
+    LotQueue prefix-sum index. Slower on long queues; used by cross_check().
+    """
+
+    def _take(self, ticker, qty, with_detail):
+        return self.inventory[ticker].take_sequential(
+            qty, with_detail, settle=self._settler(ticker)
+        )
+
+
+class FifoMismatchError(Exception):
+    """The indexed and the reference FIFO engines disagree."""
+
+
+def _open_lots(matcher: TradeMatcher) -> Dict[str, List[Dict[str, Any]]]:
+    return {
+        ticker: [matcher._settle(ticker, lot).to_dict() for lot in lots]
+        for ticker, lots in matcher.inventory.items()
+    }
+
+
+def cross_check(
+    matcher: TradeMatcher, trades_list: List[Dict[str, Any]], workers: int = 1
+) -> TradeMatcher:
+    """
+    Verification mode: feeds the same events to `matcher` and to a
+    SequentialTradeMatcher started from a copy of its state, then compares
+    the new realized gains and the open lots exactly (Decimal values).
+    Returns `matcher`; raises FifoMismatchError on the first difference.
+    """
+    reference = SequentialTradeMatcher.from_state(matcher.dump_state())
+    reference.keep_lot_detail = matcher.keep_lot_detail
+    reference.years = matcher.years
+    reference.realized_pnl = []
+    known = len(matcher.realized_pnl)
+
+    reference.process_trades(copy.deepcopy(trades_list))
+    # Records for a sink are collected first and forwarded once verified
+    sink, matcher.sink = matcher.sink, None
+    try:
+        matcher.process_trades(trades_list, workers=workers)
+    finally:
+        matcher.sink = sink
+
+    actual = matcher.get_realized_gains()[known:]
+    expected = reference.get_realized_gains()
+    if len(actual) != len(expected):
+        raise FifoMismatchError(
+            f"{len(actual)} realized sales, reference engine has {len(expected)}."
+        )
+    for got, want in zip(actual, expected):
+        if got != want:
+            raise FifoMismatchError(
+                f"Sale of {got['ticker']} on {got['sale_date']} differs: "
+                f"cost basis {got['cost_basis']} vs {want['cost_basis']} (reference)."
+            )
+
+    lots, ref_lots = _open_lots(matcher), _open_lots(reference)
+    for ticker in sorted(lots.keys() | ref_lots.keys()):
+        if lots.get(ticker, []) != ref_lots.get(ticker, []):
+            raise FifoMismatchError(f"Open lots of {ticker} differ.")
+
+    if sink is not None:
+        del matcher.realized_pnl[known:]
+        for record in actual:
+            sink(record)
+    return matcher
@@ -0,0 +1,216 @@
+# src/fifo_vector.py
+
+"""
+Batch FIFO matching for one ticker with NumPy.
+
+A ticker whose events are only buys, sells and transfers (no corporate
+actions) needs no per-event queue: with quantities on one cumulative axis,
+sale k consumes the interval (S[k-1], S[k]] of the cumulative lot quantities
+Q, so the lot holding each cut is a searchsorted and the cost of all lots
+consumed whole is a difference of cumulative costs. Only the last lot of a
+sale can be cut, and that one partial cost is still rounded with Decimal,
+exactly as LotQueue.take() does, so results are identical to TradeMatcher.
+
+Tickers that do not fit (corporate actions, quantities finer than 1e-8,
+overselling, lots left within the 1e-8 tolerance) fall back to the regular
+event-by-event path.
+
+match_arrays() is the float64 variant for what-if analysis over arrays.
+"""
+
+from decimal import Decimal
+from typing import List, Optional
+
+import numpy as np
+
+from .fifo import LotQueue, TradeMatcher
+from .utils import money
+
+# Quantities are matched in units of 1e-8 shares (the FIFO epsilon)
+_QTY_SCALE = Decimal(10**8)
+_GROSZE = Decimal(100)
+
+_BUY_TYPES = {"BUY", "TRANSFER"}
+_SELL_TYPES = {"SELL", "TRANSFER"}
+
+
+def _to_int(value: Decimal, scale: Decimal) -> Optional[int]:
+    """Exact scaled integer, or None if value is finer than the scale."""
+    scaled = value * scale
+    units = int(scaled)
+    return units if units == scaled else None
+
+
+def match_cuts(lot_qty, sell_qty, available):
+    """
+    Vectorized lot consumption for one ticker, all in integer units.
+
+    lot_qty:   quantity of each lot, in FIFO order
+    sell_qty:  quantity of each sale (transfers out included), in order
+    available: number of lots that exist when each sale happens
+
+    Returns (cut, first, interior, cum_qty) or None if plain cumulative
+    matching would differ from LotQueue: a sale larger than the holdings,
+    or a cut leaving at most one unit in its lot (consumed whole there).
+    cut[k] is the lot holding the end of sale k, first[k] the first lot the
+    sale touches and interior[k] whether cut[k] is split rather than emptied.
+    """
+    cum_qty = np.cumsum(np.asarray(lot_qty, dtype=np.int64))
+    ends = np.cumsum(np.asarray(sell_qty, dtype=np.int64))
+    starts = ends - np.asarray(sell_qty, dtype=np.int64)
+
+    held = np.concatenate(([0], cum_qty))[np.asarray(available, dtype=np.int64)]
+    if np.any(ends > held):
+        return None
+
+    cut = np.searchsorted(cum_qty, ends, side="left")
+    interior = cum_qty[cut] > ends
+    if np.any(interior & (cum_qty[cut] - ends <= 1)):
+        return None
+
+    first = np.searchsorted(cum_qty, starts, side="right")
+    return cut, first, interior, cum_qty
+
+
+def match_arrays(qty, price, rate, commission):
+    """
+    What-if analysis: FIFO for one ticker given as float arrays in event
+    order (signed quantities, prices, rates, commissions), without any
+    Python loop. Lot costs are rounded to grosze; a lot consumed by several
+    sales is costed pro rata (interpolation along the cumulative axis)
+    instead of rounding each partial, so cost basis can differ from the
+    Decimal engines by a grosz per partially consumed lot.
+
+    Returns a dict of arrays for the sales: index (position in the input),
+    quantity, revenue_pln, cost_basis_pln (commission included), profit_pln.
+    Raises ValueError if a sale exceeds the holdings at that point.
+    """
+    qty, price, rate, commission = (
+        np.asarray(a, dtype=np.float64) for a in (qty, price, rate, commission)
+    )
+    is_buy = qty > 0
+    is_sell = qty < 0
+
+    lot_cost = np.floor(
+        (price[is_buy] * qty[is_buy] + np.abs(commission[is_buy])) * rate[is_buy] * 100
+        + 0.5
+    )
+    cum_qty = np.concatenate(([0.0], np.cumsum(qty[is_buy])))
+    cum_cost = np.concatenate(([0.0], np.cumsum(lot_cost) / 100))
+
+    sold = -qty[is_sell]
+    ends = np.cumsum(sold)
+    held = cum_qty[np.cumsum(is_buy)[is_sell]]
+    if np.any(ends > held + 1e-8):
+        raise ValueError("Sale exceeds the holdings; FIFO arrays need no overselling.")
+
+    consumed = np.interp(ends, cum_qty, cum_cost)
+    cost = np.diff(consumed, prepend=0.0)
+    sell_rate = rate[is_sell]
+    revenue = np.floor(price[is_sell] * sold * sell_rate * 100 + 0.5) / 100
+    commission_pln = np.floor(np.abs(commission[is_sell]) * sell_rate * 100 + 0.5) / 100
+    cost_basis = cost + commission_pln
+    return {
+        "index": np.flatnonzero(is_sell),
+        "quantity": sold,
+        "revenue_pln": revenue,
+        "cost_basis_pln": cost_basis,
+        "profit_pln": revenue - cost_basis,
+    }
+
+
+class VectorTradeMatcher(TradeMatcher):
+    """
+    TradeMatcher that matches tickers without corporate actions in one
+    vectorized pass (see match_cuts) and all other tickers event by event.
+    Output is identical to TradeMatcher.
+    """
+
+    per_ticker = True
+
+    def _match_ticker(self, ticker, events):
+        gains = self._match_vectorized(ticker, events)
+        if gains is None:
+            return super()._match_ticker(ticker, events)
+        return gains
+
+    def _match_vectorized(self, ticker, events) -> Optional[List]:
+        # Plan on quantities only, so that a fallback finds the state untouched
+        lots = [self._settle(ticker, lot) for lot in self.inventory[ticker]]
+        lot_qty = [_to_int(lot.qty, _QTY_SCALE) for lot in lots]
+        if None in lot_qty or any(
+            _to_int(lot.cost_pln, _GROSZE) is None for lot in lots
+        ):
+            return None
+
+        buys, sells, sell_qty, available = [], [], [], []
+        for seq, trade in events:
+            t_type, qty = trade["type"], trade.get("qty", Decimal(0))
+            if qty > 0 and t_type in _BUY_TYPES:
+                buys.append(trade)
+                lot_qty.append(_to_int(qty, _QTY_SCALE))
+            elif qty < 0 and t_type in _SELL_TYPES:
+                sells.append((seq, trade))
+                sell_qty.append(_to_int(-qty, _QTY_SCALE))
+                available.append(len(lot_qty))
+            elif qty != 0 or t_type not in _BUY_TYPES | _SELL_TYPES:
+                return None  # Corporate action or an unusual sign
+        if None in lot_qty or None in sell_qty:
+            return None
+
+        plan = match_cuts(lot_qty, sell_qty, available)
+        if plan is None:
+            return None
+        cut, first, interior, cum_qty = (a.tolist() for a in plan)
+
+        lots.extend(self._new_lot(trade) for trade in buys)
+        cum_cost = np.cumsum(
+            [int(lot.cost_pln * _GROSZE) for lot in lots], dtype=np.int64
+        ).tolist()
+
+        gains = []
+        end = 0  # Shares sold so far, in units along the cumulative axis
+        taken = 0  # Grosze consumed so far along the same axis
+        partial, partial_taken = -1, 0  # Lot currently split between sales
+        for k, (seq, trade) in enumerate(sells):
+            j, start = cut[k], end
+            end += sell_qty[k]
+            reported = trade["type"] == "SELL" and self._is_reported(trade)
+            with_detail = reported and self.keep_lot_detail
+            matched = lots[first[k] : j + (not interior[k])] if with_detail else []
+
+            if interior[k]:
+                # Take partial lot, rounded exactly like LotQueue.take()
+                lot = lots[j]
+                lot_start = cum_qty[j - 1] if j else 0
+                qty = Decimal(end - max(start, lot_start)) / _QTY_SCALE
+                part_cost = money(lot.cost_pln * (qty / lot.qty))
+
+                if with_detail:
+                    partial_record = lot.copy()
+                    partial_record.qty = qty
+                    partial_record.cost_pln = part_cost
+                    matched.append(partial_record)
+
+                lot.qty -= qty
+                lot.cost_pln -= part_cost
+                if j != partial:
+                    partial, partial_taken = j, 0
+                partial_taken += int(part_cost * _GROSZE)
+                consumed = (cum_cost[j - 1] if j else 0) + partial_taken
+            else:
+                partial = -1
+                consumed = cum_cost[j]
+
+            cost = Decimal(consumed - taken) / _GROSZE
+            taken = consumed
+            if reported:
+                self._record_sale(trade, cost, matched)
+                gains.append((seq, self.realized_pnl[-1]))
+
+        rest = 0
+        if sells:
+            rest = cut[-1] if interior[-1] else cut[-1] + 1
+        remaining = LotQueue(lots[rest:])
+        self.inventory[ticker] = remaining
+        return gains
@@ -2,22 +2,400 @@
 
 import requests
 import calendar
+import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, date
 from decimal import Decimal
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from decouple import config
 
-# Глобальный кэш: {(currency, year, month): {date_str: rate_decimal}}
-_MONTHLY_CACHE: Dict[tuple, Dict[str, Decimal]] = {}
+from .progress import ERROR, WARNING, reporter
 
+logger = logging.getLogger(__name__)
 
-def fetch_month_rates(currency: str, year: int, month: int) -> None:
+# Базовый адрес API (Table A). Можно подменить локальным стендом tools/nbp_stub_server.py
+API_URL = config("NBP_API_URL", default="http://api.nbp.pl/api/exchangerates/rates/a")
+
+# Максимум месяцев, которые держим в памяти (закреплённые записи не считаются)
+CACHE_MAX_ENTRIES = 512
+
+# Строгий офлайн-режим: никаких запросов к api.nbp.pl, только локальное хранилище
+OFFLINE_MODE = config("NBP_OFFLINE", default=False, cast=bool)
+
+# Защита от недоступности API:
+# - после FAILURE_THRESHOLD сетевых сбоев подряд цепь размыкается на BREAKER_COOLDOWN секунд;
+# - неудачный месяц не запрашивается повторно NEGATIVE_TTL секунд;
+# - FAIL_FAST: при разомкнутой цепи бросаем NBPUnavailableError вместо отката на 1.0.
+FAILURE_THRESHOLD = config("NBP_FAILURE_THRESHOLD", default=3, cast=int)
+BREAKER_COOLDOWN = config("NBP_BREAKER_COOLDOWN", default=60.0, cast=float)
+NEGATIVE_TTL = config("NBP_NEGATIVE_TTL", default=300.0, cast=float)
+FAIL_FAST = config("NBP_FAIL_FAST", default=False, cast=bool)
+
+
+class NBPUnavailableError(RuntimeError):
+    """API NBP недоступно (цепь разомкнута), а режим FAIL_FAST включён."""
+
+
+class CircuitBreaker:
+    """
+    Размыкается после threshold сетевых сбоев подряд.
+    Пока цепь разомкнута, запросы не выполняются; через cooldown секунд
+    пропускается одна пробная попытка (half-open).
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                # Half-open: пропускаем одну попытку, следующий сбой снова разомкнёт цепь
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> bool:
+        """Регистрирует сбой. Возвращает True, если цепь только что разомкнулась."""
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                just_opened = self._opened_at is None
+                self._opened_at = time.monotonic()
+                return just_opened
+            return False
+
+    def reset(self) -> None:
+        self.record_success()
+
+
+# Границы корзин гистограммы задержек HTTP (миллисекунды)
+LATENCY_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class NBPStats:
+    """
+    Потокобезопасные счётчики слоя NBP: HTTP-запросы, байты, задержки,
+    откаты на 1.0 и глубина поиска назад (сколько дней пришлось отмотать от T-1).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self.lookups = 0
+        self.http_requests = 0
+        self.http_errors = 0
+        self.bytes_received = 0
+        self.fallbacks = 0
+        self.latency_total_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.latency_hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.lookback_hist: Dict[int, int] = {}
+
+    def record_request(self, latency_ms: float, size: int, failed: bool) -> None:
+        with self._lock:
+            self.http_requests += 1
+            self.http_errors += int(failed)
+            self.bytes_received += size
+            self.latency_total_ms += latency_ms
+            self.latency_max_ms = max(self.latency_max_ms, latency_ms)
+            bucket = len(LATENCY_BUCKETS_MS)
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if latency_ms <= bound:
+                    bucket = i
+                    break
+            self.latency_hist[bucket] += 1
+
+    def record_lookup(self, depth: Optional[int]) -> None:
+        """depth — на сколько дней назад от T-1 найден курс; None — откат на 1.0."""
+        with self._lock:
+            self.lookups += 1
+            if depth is None:
+                self.fallbacks += 1
+            else:
+                self.lookback_hist[depth] = self.lookback_hist.get(depth, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [
+                f">{LATENCY_BUCKETS_MS[-1]}ms"
+            ]
+            return {
+                "lookups": self.lookups,
+                "fallbacks": self.fallbacks,
+                "http_requests": self.http_requests,
+                "http_errors": self.http_errors,
+                "bytes_received": self.bytes_received,
+                "latency_total_ms": round(self.latency_total_ms, 3),
+                "latency_avg_ms": (
+                    round(self.latency_total_ms / self.http_requests, 3)
+                    if self.http_requests
+                    else 0.0
+                ),
+                "latency_max_ms": round(self.latency_max_ms, 3),
+                "latency_histogram": {
+                    label: n for label, n in zip(labels, self.latency_hist) if n
+                },
+                "lookback_histogram": dict(sorted(self.lookback_hist.items())),
+            }
+
+
+class MonthlyRateCache:
+    """
+    Потокобезопасный кэш курсов: {(currency, year, month): {date_str: rate_decimal}}.
+
+    - Конкурентные запросы одного и того же ключа разделяют ОДНУ загрузку
+      (single-flight): первый поток качает, остальные ждут его результата.
+    - Обычные записи вытесняются по LRU при превышении max_entries.
+    - Закреплённые записи (pinned, например загруженные из локального хранилища)
+      никогда не вытесняются.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, Dict[str, Decimal]]" = OrderedDict()
+        self._pinned: set = set()
+        self._inflight: Dict[tuple, threading.Event] = {}
+        # Негативный кэш: {key: monotonic-время истечения}
+        self._negative: Dict[tuple, float] = {}
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.shared_waits = 0
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, rates: Dict[str, Decimal], pinned: bool = False) -> None:
+        with self._lock:
+            self._store(key, rates, pinned)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self._negative.clear()
+
+    def get_or_fetch(
+        self,
+        key,
+        loader: Callable[[], Optional[Dict[str, Decimal]]],
+        negative_ttl: float = 0.0,
+    ) -> Optional[Dict[str, Decimal]]:
+        """
+        Возвращает запись из кэша или загружает её через loader().
+        loader() возвращает None при сбое — такой результат не кэшируется,
+        но при negative_ttl > 0 ключ не загружается повторно в течение negative_ttl секунд.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            expires = self._negative.get(key)
+            if expires is not None:
+                if time.monotonic() < expires:
+                    self.negative_hits += 1
+                    return None
+                del self._negative[key]
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                self.misses += 1
+                event = threading.Event()
+                self._inflight[key] = event
+            else:
+                self.shared_waits += 1
+
+        if not owner:
+            # Кто-то уже качает этот месяц — ждём его результата
+            event.wait()
+            return self.get(key)
+
+        try:
+            rates = loader()
+            if rates is not None:
+                self.put(key, rates)
+            elif negative_ttl > 0:
+                with self._lock:
+                    self._negative[key] = time.monotonic() + negative_ttl
+            return rates
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def _store(self, key, rates, pinned) -> None:
+        self._entries[key] = rates
+        self._entries.move_to_end(key)
+        if pinned:
+            self._pinned.add(key)
+        self._evict()
+
+    def _evict(self) -> None:
+        unpinned = len(self._entries) - len(self._pinned)
+        if unpinned <= self.max_entries:
+            return
+        for key in list(self._entries):
+            if unpinned <= self.max_entries:
+                break
+            if key in self._pinned:
+                continue
+            del self._entries[key]
+            unpinned -= 1
+
+
+# Глобальный кэш курсов по месяцам
+_MONTHLY_CACHE = MonthlyRateCache()
+_BREAKER = CircuitBreaker(FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+_STATS = NBPStats()
+
+
+def get_nbp_stats() -> Dict[str, Any]:
+    """Снимок метрик слоя NBP (кэш, HTTP, задержки, откаты, глубина поиска)."""
+    stats = _STATS.snapshot()
+    stats.update(
+        {
+            "cache_hits": _MONTHLY_CACHE.hits,
+            "cache_misses": _MONTHLY_CACHE.misses,
+            "cache_negative_hits": _MONTHLY_CACHE.negative_hits,
+            "cache_shared_waits": _MONTHLY_CACHE.shared_waits,
+            "cache_entries": len(_MONTHLY_CACHE),
+            "circuit_open": _BREAKER.is_open,
+        }
+    )
+    return stats
+
+
+def reset_nbp_stats() -> None:
+    _STATS.reset()
+    _MONTHLY_CACHE.reset_counters()
+
+
+def format_nbp_stats(stats: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Человекочитаемая сводка метрик для вывода в конце запуска."""
+    s = stats if stats is not None else get_nbp_stats()
+    lines = [
+        f"Rate lookups: {s['lookups']} (fallbacks to 1.0: {s['fallbacks']})",
+        f"Month cache: {s['cache_hits']} hits, {s['cache_misses']} misses, "
+        f"{s['cache_negative_hits']} negative hits, {s['cache_entries']} entries",
+        f"HTTP: {s['http_requests']} requests ({s['http_errors']} failed), "
+        f"{s['bytes_received'] / 1024:.1f} KiB, avg {s['latency_avg_ms']:.1f} ms, "
+        f"max {s['latency_max_ms']:.1f} ms, total {s['latency_total_ms'] / 1000:.2f} s",
+    ]
+    if s["lookback_histogram"]:
+        depths = ", ".join(f"{d}d: {n}" for d, n in s["lookback_histogram"].items())
+        lines.append(f"Lookback depth: {depths}")
+    return lines
+
+
+def fetch_month_rates(
+    currency: str, year: int, month: int
+) -> Optional[Dict[str, Decimal]]:
     """
     Загружает курсы валют за ВЕСЬ месяц одним запросом и сохраняет в глобальный кэш.
+    Параллельные вызовы для одного месяца выполняют только один HTTP-запрос.
+    В офлайн-режиме сеть не используется: отсутствующий месяц просто пуст.
     """
-    cache_key = (currency, year, month)
-    if cache_key in _MONTHLY_CACHE:
-        return  # Уже загружено
+    if OFFLINE_MODE:
+        return _MONTHLY_CACHE.get((currency, year, month), {})
 
+    return _MONTHLY_CACHE.get_or_fetch(
+        (currency, year, month),
+        lambda: _download_month_rates(currency, year, month),
+        negative_ttl=NEGATIVE_TTL,
+    )
+
+
+def set_offline_mode(enabled: bool) -> None:
+    """Включает/выключает строгий офлайн-режим (без обращений к сети)."""
+    global OFFLINE_MODE
+    OFFLINE_MODE = enabled
+
+
+def set_fail_fast_mode(enabled: bool) -> None:
+    """FAIL_FAST: при недоступности API прерывать расчёт вместо отката на 1.0."""
+    global FAIL_FAST
+    FAIL_FAST = enabled
+
+
+def _unavailable_error() -> NBPUnavailableError:
+    return NBPUnavailableError(
+        f"NBP API unreachable after {_BREAKER.threshold} consecutive failures. "
+        "Retry later, import rate archives (--import-rates) or run with --offline."
+    )
+
+
+def preload_rates(rows: Iterable[Tuple[str, str, Decimal]]) -> int:
+    """
+    Загружает курсы из локального хранилища (строки currency, date_str, rate)
+    в кэш как закреплённые записи. Возвращает число загруженных месяцев.
+
+    Последний (возможно неполный) месяц каждой валюты загружается только
+    в офлайн-режиме — онлайн он будет докачан из API. Поэтому офлайн-режим
+    нужно включать ДО вызова preload_rates.
+    """
+    months: Dict[tuple, Dict[str, Decimal]] = {}
+    latest: Dict[str, str] = {}
+    for currency, date_str, rate in rows:
+        key = (currency, int(date_str[0:4]), int(date_str[5:7]))
+        months.setdefault(key, {})[date_str] = Decimal(str(rate))
+        if date_str > latest.get(currency, ""):
+            latest[currency] = date_str
+
+    loaded = 0
+    for (currency, year, month), rates_map in months.items():
+        month_end = date(year, month, calendar.monthrange(year, month)[1])
+        if not OFFLINE_MODE and month_end.strftime("%Y-%m-%d") > latest[currency]:
+            continue
+        _MONTHLY_CACHE.put((currency, year, month), rates_map, pinned=True)
+        loaded += 1
+    return loaded
+
+
+def _download_month_rates(
+    currency: str, year: int, month: int
+) -> Optional[Dict[str, Decimal]]:
+    """Один HTTP-запрос к NBP за месяц. None означает сетевую ошибку."""
     # Вычисляем первый и последний день месяца
     start_date = date(year, month, 1)
     last_day = calendar.monthrange(year, month)[1]
@@ -25,8 +403,7 @@ def fetch_month_rates(currency: str, year: int, month: int) -> None:
 
     # Если запрашиваем будущий месяц, данных нет, кэшируем пустоту и выходим
     if start_date > date.today():
-        _MONTHLY_CACHE[cache_key] = {}
-        return
+        return {}
 
     # Ограничиваем конец текущей датой (чтобы не просить курсы из будущего)
     if end_date > date.today():
@@ -35,11 +412,19 @@ def fetch_month_rates(currency: str, year: int, month: int) -> None:
     fmt_start = start_date.strftime("%Y-%m-%d")
     fmt_end = end_date.strftime("%Y-%m-%d")
 
+    # Цепь разомкнута — в сеть не идём вообще
+    if not _BREAKER.allow():
+        if FAIL_FAST:
+            raise _unavailable_error()
+        return None
+
     # Формируем запрос диапазона (Table A - средние курсы)
-    url = f"http://api.nbp.pl/api/exchangerates/rates/a/{currency}/{fmt_start}/{fmt_end}/?format=json"
+    url = f"{API_URL}/{currency}/{fmt_start}/{fmt_end}/?format=json"
 
+    started = time.perf_counter()
+    response = None
     try:
-        # print(f"🌐 NBP API Fetch: {currency} for {fmt_start}..{fmt_end}")
+        logger.debug(f"🌐 NBP API Fetch: {currency} for {fmt_start}..{fmt_end}")
         response = requests.get(url, timeout=10)
 
         rates_map = {}
@@ -54,16 +439,71 @@ def fetch_month_rates(currency: str, year: int, month: int) -> None:
             # 404 для диапазона значит, что в этом диапазоне нет курсов (например, одни праздники или начало месяца)
             # Это нормально, сохраняем пустой словарь
             pass
+        elif response.status_code >= 500 or response.status_code == 429:
+            # Сбой на стороне сервера — считаем как сетевую ошибку
+            raise requests.HTTPError(f"HTTP {response.status_code} for {url}")
         else:
-            print(f"⚠️ NBP API Warning: HTTP {response.status_code} for {url}")
+            reporter.message(
+                WARNING,
+                f"NBP API: HTTP {response.status_code} for {url}",
+                key="nbp_http",
+            )
 
-        _MONTHLY_CACHE[cache_key] = rates_map
+        _BREAKER.record_success()
+        _record_request(started, response, failed=False)
+        return rates_map
 
     except Exception as e:
-        print(f"❌ NBP Network Error for {fmt_start}: {e}")
-        # Не сохраняем в кэш, чтобы при следующем вызове попробовать снова?
-        # Или сохраняем пустоту, чтобы не ддосить? Лучше не сохранять, вдруг сеть моргнула.
-        pass
+        _record_request(started, response, failed=True)
+        reporter.message(
+            ERROR, f"NBP network error for {fmt_start}: {e}", key="nbp_network"
+        )
+        # Не сохраняем в кэш как пустоту (вдруг сеть моргнула), но помечаем месяц
+        # в негативном кэше на NEGATIVE_TTL секунд, чтобы не ждать таймаут снова.
+        if _BREAKER.record_failure():
+            reporter.message(
+                ERROR,
+                f"NBP API: {_BREAKER.threshold} consecutive failures, "
+                f"pausing requests for {_BREAKER.cooldown:.0f}s.",
+            )
+            if FAIL_FAST:
+                raise _unavailable_error()
+        return None
+
+
+def _record_request(started: float, response, failed: bool) -> None:
+    size = len(response.content or b"") if response is not None else 0
+    _STATS.record_request((time.perf_counter() - started) * 1000, size, failed)
+
+
+def _lookup_rate(
+    currency: str, event_date, month_rates: Callable[[int, int], Optional[Dict]]
+) -> Tuple[Optional[Decimal], Optional[int]]:
+    """
+    Ищет курс на день, ПРЕДШЕСТВУЮЩИЙ event_date (правило T-1), отматывая назад
+    до 10 дней. month_rates(year, month) возвращает курсы месяца или None,
+    если месяц недоступен (тогда поиск прерывается).
+    Возвращает (курс, глубина) или (None, None).
+    """
+    # Начинаем поиск с T-1
+    target_date = event_date - timedelta(days=1)
+
+    # Пытаемся найти курс, отматывая назад до 10 дней
+    # (обычно достаточно 3-4 дней для длинных выходных)
+    for depth in range(10):
+        # 1. Берём месяц (из кэша или загружаем его один раз)
+        month_data = month_rates(target_date.year, target_date.month)
+        if month_data is None:
+            return None, None
+
+        # 2. Ищем дату в месяце
+        t_str = target_date.strftime("%Y-%m-%d")
+        if t_str in month_data:
+            return month_data[t_str], depth
+
+        # Если не нашли, идем на день назад (и на следующей итерации проверим кэш)
+        target_date -= timedelta(days=1)
+    return None, None
 
 
 def get_nbp_rate(currency: str, date_str: str) -> Decimal:
@@ -78,36 +518,53 @@ def get_nbp_rate(currency: str, date_str: str) -> Decimal:
     try:
         event_date = datetime.strptime(date_str, "%Y-%m-%d").date()
     except ValueError:
-        print(f"⚠️ NBP: Invalid date format {date_str}, using 1.0")
+        reporter.message(
+            WARNING,
+            f"NBP: Invalid date format {date_str}, using 1.0",
+            key="nbp_invalid_date",
+        )
         return Decimal("1.0")
 
-    # Начинаем поиск с T-1
-    target_date = event_date - timedelta(days=1)
-
-    # Пытаемся найти курс, отматывая назад до 10 дней
-    # (обычно достаточно 3-4 дней для длинных выходных)
-    for _ in range(10):
-        t_year = target_date.year
-        t_month = target_date.month
-        t_str = target_date.strftime("%Y-%m-%d")
+    rate, depth = _lookup_rate(
+        currency,
+        event_date,
+        lambda year, month: fetch_month_rates(currency, year, month) or {},
+    )
+    _STATS.record_lookup(depth)
+    if rate is not None:
+        return rate
 
-        # 1. Проверяем, загружен ли этот месяц
-        if (currency, t_year, t_month) not in _MONTHLY_CACHE:
-            fetch_month_rates(currency, t_year, t_month)
+    # На каждое событие без курса: повторы только считаются (см. progress)
+    reporter.message(
+        ERROR,
+        f"NBP: Could not find rate for {currency} around {date_str}. Using 1.0 fallback.",
+        key="nbp_missing_rate",
+    )
+    return Decimal("1.0")
 
-        # 2. Ищем дату в кэше
-        month_data = _MONTHLY_CACHE.get((currency, t_year, t_month), {})
 
-        if t_str in month_data:
-            return month_data[t_str]
+def get_cached_nbp_rate(currency: str, date_str: str) -> Optional[Decimal]:
+    """
+    Как get_nbp_rate, но только из кэша (локальное хранилище и уже загруженные
+    месяцы), без обращения к API. None, если нужного месяца нет в кэше или
+    курс не найден: тогда решение остаётся за get_nbp_rate.
+    """
+    if currency == "PLN":
+        return Decimal("1.0")
 
-        # Если не нашли, идем на день назад (и на следующей итерации проверим кэш)
-        target_date -= timedelta(days=1)
+    try:
+        event_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        return None
 
-    print(
-        f"❌ NBP FATAL: Could not find rate for {currency} around {date_str}. Using 1.0 fallback."
+    rate, depth = _lookup_rate(
+        currency,
+        event_date,
+        lambda year, month: _MONTHLY_CACHE.get((currency, year, month)),
     )
-    return Decimal("1.0")
+    if rate is not None:
+        _STATS.record_lookup(depth)
+    return rate
 
 
 def get_rate_for_tax_date(currency, trade_date):
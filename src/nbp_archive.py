@@ -0,0 +1,127 @@
+# src/nbp_archive.py
+
+import csv
+import os
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Tuple
+
+import defusedxml.ElementTree as ET
+
+# Archive column headers look like "1USD", "100JPY", "10000IDR":
+# the numeric prefix is the quotation unit (the rate is given per N units).
+_CSV_CURRENCY_COLUMN = re.compile(r"^(\d+)([A-Z]{3})$")
+_DATE_PATTERNS = [
+    (re.compile(r"^\d{8}$"), lambda s: f"{s[0:4]}-{s[4:6]}-{s[6:8]}"),
+    (re.compile(r"^\d{4}-\d{2}-\d{2}$"), lambda s: s),
+]
+
+# Rows for the rate store: (currency, YYYY-MM-DD, rate per 1 unit)
+RateRow = Tuple[str, str, Decimal]
+
+
+def _parse_rate(value: str) -> Decimal:
+    """NBP archives use a comma as the decimal separator."""
+    return Decimal(value.strip().replace(",", "."))
+
+
+def _normalize_date(value: str):
+    value = value.strip()
+    for pattern, convert in _DATE_PATTERNS:
+        if pattern.match(value):
+            return convert(value)
+    return None
+
+
+def parse_archive_csv(filepath: str) -> List[RateRow]:
+    """
+    Parses a yearly Table A archive (archiwum_tab_a_YYYY.csv) published by NBP.
+
+    Layout: a header row starting with 'data' followed by unit+code columns
+    (1USD, 100JPY, ...), one row per table with a YYYYMMDD date, and a few
+    descriptive footer rows that are skipped.
+    """
+    rows: List[RateRow] = []
+    columns: Dict[int, Tuple[str, Decimal]] = {}
+
+    # Archives are published in cp1250; only ASCII columns are used here.
+    with open(filepath, "r", encoding="cp1250", errors="replace") as f:
+        for record in csv.reader(f, delimiter=";"):
+            if not record:
+                continue
+            first = record[0].strip().lower()
+
+            if first == "data":
+                columns = {}
+                for idx, name in enumerate(record):
+                    match = _CSV_CURRENCY_COLUMN.match(name.strip())
+                    if match:
+                        columns[idx] = (match.group(2), Decimal(match.group(1)))
+                continue
+
+            date_str = _normalize_date(record[0])
+            if not date_str or not columns:
+                continue
+
+            for idx, (currency, unit) in columns.items():
+                if idx >= len(record) or not record[idx].strip():
+                    continue
+                try:
+                    rows.append((currency, date_str, _parse_rate(record[idx]) / unit))
+                except InvalidOperation:
+                    continue
+    return rows
+
+
+def _text(node, *tags):
+    for tag in tags:
+        child = node.find(tag)
+        if child is not None and child.text:
+            return child.text.strip()
+    return None
+
+
+def parse_archive_xml(filepath: str) -> List[RateRow]:
+    """
+    Parses Table A rates stored as XML. Supported layouts:
+    - API tables: ArrayOfExchangeRatesTable/ExchangeRatesTable (EffectiveDate, Rates/Rate)
+    - API series: ExchangeRatesSeries (Code, Rates/Rate/EffectiveDate+Mid)
+    - Daily archive files: tabela_kursow (data_publikacji, pozycja)
+    """
+    root = ET.parse(filepath).getroot()
+    rows: List[RateRow] = []
+
+    for table in root.iter("ExchangeRatesTable"):
+        date_str = _text(table, "EffectiveDate")
+        for rate in table.iter("Rate"):
+            code, mid = _text(rate, "Code"), _text(rate, "Mid")
+            if date_str and code and mid:
+                rows.append((code.upper(), date_str, _parse_rate(mid)))
+
+    for series in root.iter("ExchangeRatesSeries"):
+        code = _text(series, "Code")
+        for rate in series.iter("Rate"):
+            date_str, mid = _text(rate, "EffectiveDate"), _text(rate, "Mid")
+            if code and date_str and mid:
+                rows.append((code.upper(), date_str, _parse_rate(mid)))
+
+    for table in root.iter("tabela_kursow"):
+        date_str = _text(table, "data_publikacji")
+        for item in table.iter("pozycja"):
+            code = _text(item, "kod_waluty")
+            mid = _text(item, "kurs_sredni")
+            unit = _text(item, "przelicznik") or "1"
+            if date_str and code and mid:
+                rows.append((code.upper(), date_str, _parse_rate(mid) / Decimal(unit)))
+
+    return rows
+
+
+def parse_archive_file(filepath: str) -> List[RateRow]:
+    """Dispatches by extension: .csv or .xml NBP Table A archives."""
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == ".csv":
+        return parse_archive_csv(filepath)
+    if ext == ".xml":
+        return parse_archive_xml(filepath)
+    raise ValueError(f"Unsupported NBP archive format: {filepath}")
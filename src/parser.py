@@ -9,11 +9,14 @@ from datetime import datetime
 from decimal import Decimal
 from typing import List, Dict, Optional
 from src.db_connector import DBConnector
+from src.progress import ERROR, INFO, WARNING, reporter
 
 # --- CONFIGURATION ---
 # Leave empty to parse everything. Deduplication will handle overlaps.
 FILE_DATE_LIMITS = {}
 MANUAL_FIXES_FILE = "manual_fixes.csv"
+# Rows per INSERT batch on import; progress is reported after each batch
+SAVE_BATCH_SIZE = 5000
 
 
 def parse_decimal(value: str) -> Decimal:
@@ -132,7 +135,7 @@ def load_manual_fixes(filepath: str) -> List[Dict]:
     if not os.path.exists(filepath):
         return fixes
 
-    print(f"🔧 Loading manual fixes from {filepath}...")
+    reporter.message(INFO, f"🔧 Loading manual fixes from {filepath}...")
     try:
         with open(filepath, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
@@ -156,7 +159,7 @@ def load_manual_fixes(filepath: str) -> List[Dict]:
                     }
                 )
     except Exception as e:
-        print(f"❌ Error loading manual fixes: {e}")
+        reporter.message(ERROR, f"Could not load manual fixes: {e}")
     return fixes
 
 
@@ -165,12 +168,12 @@ def parse_csv(filepath: str) -> Dict[str, List]:
     data = {"trades": [], "dividends": [], "taxes": [], "corp_actions": []}
     section_headers = {}
     filename = os.path.basename(filepath)
-    print(f"📂 Parsing file: {filename}")
+    reporter.message(INFO, f"📂 Parsing file: {filename}")
 
     try:
-        with open(filepath, "r", encoding="utf-8-sig") as f:
+        with open(filepath, "r", encoding="utf-8-sig") as f, reporter.stage(filename):
             reader = csv.reader(f)
-            for row in reader:
+            for row in reporter.track(reader, every=1000):
                 if len(row) < 2:
                     continue
                 section, row_type = row[0], row[1]
@@ -339,7 +342,7 @@ def parse_csv(filepath: str) -> Dict[str, List]:
                     )
 
     except Exception as e:
-        print(f"❌ Error parsing {filename}: {e}")
+        reporter.message(ERROR, f"Could not parse {filename}: {e}")
     return data
 
 
@@ -429,23 +432,33 @@ def save_to_database(all_data):
     process_list(all_data["taxes"], "TAX")
 
     if duplicates_count > 0:
-        print(
-            f"🧹 Deduplication: Skipped {duplicates_count} duplicate records across files."
+        reporter.message(
+            INFO,
+            f"🧹 Deduplication: Skipped {duplicates_count} duplicate records across files.",
         )
 
     if not unique_records:
-        print("WARNING: No valid records to save.")
+        reporter.message(WARNING, "No valid records to save.")
         return
 
-    with DBConnector() as db:
+    with reporter.stage("save", total=len(unique_records)), DBConnector() as db:
         db.initialize_schema()
         db.conn.execute("DELETE FROM transactions")
-        db.conn.executemany(
-            "INSERT INTO transactions (Date, EventType, Ticker, Quantity, Price, Currency, Amount, Fee, Description) VALUES (?,?,?,?,?,?,?,?,?)",
-            unique_records,
-        )
+        # Canonical symbol stored next to the raw one (see ticker_aliases)
+        aliases = db.get_ticker_aliases()
+        for start in range(0, len(unique_records), SAVE_BATCH_SIZE):
+            batch = unique_records[start : start + SAVE_BATCH_SIZE]
+            db.conn.executemany(
+                "INSERT INTO transactions "
+                "(Date, EventType, Ticker, Quantity, Price, Currency, Amount, Fee, "
+                "Description, CanonicalTicker) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?)",
+                [(*r, aliases.get(r[2], r[2])) for r in batch],
+            )
+            reporter.advance(len(batch))
+        db.bump_data_version("transactions")
         db.conn.commit()
-    print(f"✅ Imported {len(unique_records)} unique records.")
+    reporter.message(INFO, f"✅ Imported {len(unique_records)} unique records.")
 
 
 if __name__ == "__main__":
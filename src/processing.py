@@ -1,145 +1,482 @@
 # src/processing.py
 
-from typing import List, Dict, Any, Tuple
+import time
 from decimal import Decimal
-from collections import defaultdict
-import logging
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
 
 # Project imports
-from src.nbp import get_nbp_rate
-from src.fifo import TradeMatcher
+from src.nbp import get_cached_nbp_rate, get_nbp_rate, NBPUnavailableError
+from src.fifo import TradeMatcher, cross_check, event_sort_key
+from src.progress import DEBUG, INFO, WARNING, reporter
+from src.withholding import WithholdingIndex
 
+# Pipeline stages in order; wall time of each in the last run (get_stage_timings)
+STAGES = ("load", "normalize", "route", "rates", "match", "output")
+_STAGE_TIMINGS: Dict[str, float] = {}
 
-def process_yearly_data(
-    raw_trades: List[Dict[str, Any]], target_year: int
-) -> Tuple[List[Dict], List[Dict], List[Dict]]:
-    # Ticker Aliases Mapping (Normalization)
-    TICKER_MAP = {
-        "TOT": "TTE",  # TotalEnergies old ticker
-        "FB": "META",  # Facebook old ticker
-    }
-
-    """
-    Main Processing Pipeline:
-    1. Fetches raw data from DB.
-    2. Maps Withholding Taxes to Dividends.
-    3. Feeds all events (Trades, Corp Actions, Dividends) into the FIFO engine.
-    4. Returns calculated Realized Gains, Dividends, and Inventory.
-    """
-
-    matcher = TradeMatcher()
-
-    dividends = []
-    fifo_input_list = []
-
-    print(f"INFO: Processing {len(raw_trades)} trades via FIFO engine...")
-
-    # --- 1. Pre-process Taxes ---
-    # IBKR stores Withholding Tax as separate rows.
-    # We aggregate them into a map: (Date, Ticker) -> Total Tax Amount
-    tax_map = defaultdict(Decimal)
-
-    for t in raw_trades:
-        if t["EventType"] == "TAX":
-            # Tax amount in DB is usually negative. We store the absolute magnitude.
-            amt = Decimal(str(t["Amount"])) if t["Amount"] else Decimal(0)
-            key = (t["Date"], t["Ticker"])
-            tax_map[key] += abs(amt)
-
-    # Sort trades chronologically to ensure correct processing order
-    sorted_trades = sorted(raw_trades, key=lambda x: (x["Date"], x["TradeId"]))
-
-    for trade in sorted_trades:
-        # Extract fields
-        date_str = trade["Date"]
-        ticker = trade["Ticker"]
-        # Apply normalization (e.g., TOT -> TTE)
-        ticker = TICKER_MAP.get(ticker, ticker)
-        event_type = trade[
-            "EventType"
-        ]  # BUY, SELL, SPLIT, DIVIDEND, STOCK_DIV, MERGER, etc.
-        currency = trade["Currency"]
-
-        # Convert to Decimal for precision
-        quantity = Decimal(str(trade["Quantity"])) if trade["Quantity"] else Decimal(0)
-        price = Decimal(str(trade["Price"])) if trade["Price"] else Decimal(0)
-        amount_currency = (
-            Decimal(str(trade["Amount"])) if trade["Amount"] else Decimal(0)
-        )
-        fee = Decimal(str(trade["Fee"])) if trade["Fee"] else Decimal(0)
+# Rate of lots consumed before the reporting window: their cost never reaches
+# the report, so no NBP rate is looked up for them (see resolve_rates)
+_UNUSED_RATE = Decimal("1.0")
 
-        description = trade.get("Description", "")
 
-        # --- 2. Get Exchange Rate (NBP) ---
-        rate = Decimal("1.0")
-        if currency != "PLN":
-            try:
-                rate = get_nbp_rate(currency, date_str)
-            except Exception as e:
-                print(
-                    f"WARNING: Could not fetch NBP rate for {currency} on {date_str}. Using 1.0. Error: {e}"
-                )
-                rate = Decimal("1.0")
+def _to_decimal(value) -> Decimal:
+    """DB value (REAL, TEXT or INTEGER) to Decimal; empty values become 0."""
+    if not value:
+        return Decimal(0)
+    if isinstance(value, float):
+        # Shortest repr, not the binary expansion (same as Decimal(str(value)))
+        return Decimal(repr(value))
+    return Decimal(value)
 
-        # --- 3. Event Routing ---
 
-        if event_type == "DIVIDEND":
-            # --- Handle Cash Dividends ---
-            gross_pln = amount_currency * rate
-
-            # Find matching tax
-            tax_in_original_currency = tax_map.get((date_str, ticker), Decimal(0))
-            tax_pln = tax_in_original_currency * rate
-
-            div_record = {
-                "ex_date": date_str,
-                "ticker": ticker,
-                "gross_amount_pln": float(gross_pln),
-                "tax_withheld_pln": float(tax_pln),
-                "currency": currency,
-                "rate": float(rate),
-            }
-            # Only include dividends from the target year in the report
-            if date_str.startswith(str(target_year)):
-                dividends.append(div_record)
+# --- Stages ---
+# load, normalize and route are generators over the previous stage, so rows
+# stream through them and only the FIFO input is materialized.
 
-        elif event_type == "TAX":
-            # Already handled in Pre-process step
-            pass
 
-        else:
-            # --- Handle FIFO Events (Trades & Corp Actions) ---
-            # BUY, SELL, SPLIT, TRANSFER, STOCK_DIV, MERGER, SPINOFF
-            matcher_type = event_type
+def load_rows(raw_trades: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Stage 1: DB rows in (Date, TradeId) order. get_trades_for_calculation()
+    already returns them so (ORDER BY Date, rowid); any other input is sorted
+    here, the only full sort of the pipeline.
+    """
+    rows = raw_trades if isinstance(raw_trades, list) else list(raw_trades)
+    keys = [(row["Date"], row["TradeId"]) for row in rows]
+    if any(a > b for a, b in zip(keys, keys[1:])):
+        rows = sorted(rows, key=lambda x: (x["Date"], x["TradeId"]))
+    return iter(rows)
 
+
+def normalize_rows(rows: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Stage 2: PascalCase DB row -> event dict with Decimals. Ticker is the
+    canonical symbol already (CanonicalTicker, see ticker_aliases in the DB).
+    The TradeId is kept on sales and dividends, for merging per-group results
+    in DB order (process_ticker_groups).
+    """
+    for row in rows:
+        yield {
+            "trade_id": row["TradeId"],
+            "date": row["Date"],
+            "type": row["EventType"],
+            "ticker": row["Ticker"],
+            "currency": row["Currency"],
+            "qty": _to_decimal(row["Quantity"]),
+            "price": _to_decimal(row["Price"]),
+            "amount": _to_decimal(row["Amount"]),
+            "fee": _to_decimal(row["Fee"]),
+        }
+
+
+def route_events(
+    rows: Iterable[Dict[str, Any]],
+    years: Collection[int],
+    dividends: List[Dict[str, Any]],
+    resume_after: str = "",
+    tax_window: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stage 3: FIFO events are yielded in TradeMatcher order, without rates
+    yet (see resolve_rates); rows are buffered one date at a time for the
+    same-day order. Once the rows are exhausted, the cash dividends of the
+    reported years go to `dividends`, each with its net withholding tax as
+    "tax": IBKR books the tax as separate rows, matched to the nearest
+    dividend of the ticker within `tax_window` days (see WithholdingIndex).
+    Events up to `resume_after` (a warm-started matcher's as_of) are skipped.
+    """
+    reported = {str(year) for year in years}
+    index = WithholdingIndex(tax_window)
+    cash_dividends = []
+    taxes = []
+    current_date = None
+    day_events = []
+
+    def flush():
+        # Same-day order: SPLIT -> corporate actions -> BUY -> SELL (stable)
+        day_events.sort(key=event_sort_key)
+        events = list(day_events)
+        day_events.clear()
+        return events
+
+    for row in rows:
+        if row["date"] != current_date:
+            yield from flush()
+            current_date = row["date"]
+
+        event_type = row["type"]
+        if event_type == "DIVIDEND":
+            # All years are indexed: a tax row may belong to an earlier dividend
+            index.add_dividend(row)
+            if row["date"][:4] in reported:
+                cash_dividends.append(row)
+        elif event_type == "TAX":
+            taxes.append(row)
+        elif row["date"] > resume_after:
+            # BUY, SELL, SPLIT, TRANSFER, STOCK_DIV, MERGER, SPINOFF
             trade_record = {
-                "type": matcher_type,
-                "date": date_str,
-                "ticker": ticker,
-                "qty": quantity,
-                "price": price,
-                "commission": fee,
-                "currency": currency,
-                "rate": rate,
+                "type": event_type,
+                "date": row["date"],
+                "ticker": row["ticker"],
+                "qty": row["qty"],
+                "price": row["price"],
+                "commission": row["fee"],
+                "currency": row["currency"],
+                "rate": None,
                 "source": "DB",
+                "trade_id": row["trade_id"],
             }
-
-            if matcher_type == "SPLIT":
+            if event_type == "SPLIT":
                 trade_record["ratio"] = Decimal("1")
+            day_events.append(trade_record)
+
+    yield from flush()
+
+    for row in taxes:
+        index.add_tax(row)
+    unmatched = [row for row in index.unmatched if row["date"][:4] in reported]
+    if unmatched:
+        reporter.message(
+            WARNING,
+            f"{len(unmatched)} withholding tax rows matched no dividend "
+            f"within {index.window_days} days and are not reported.",
+        )
+
+    # Only include dividends from the reported years
+    for row in cash_dividends:
+        row["tax"] = index.tax_for(row)
+        dividends.append(row)
+
+
+def _fetch_rate(currency: str, date_str: str) -> Decimal:
+    if currency == "PLN":
+        return Decimal("1.0")
+    try:
+        return get_nbp_rate(currency, date_str)
+    except NBPUnavailableError:
+        # Fail-fast mode: abort instead of reporting taxes at rate 1.0
+        raise
+    except Exception as e:
+        # One per event: repeats are counted, not printed (see progress)
+        reporter.message(
+            WARNING,
+            f"Could not fetch NBP rate for {currency} on {date_str}. Using 1.0. Error: {e}",
+            key="nbp_rate_fallback",
+        )
+        return Decimal("1.0")
+
 
-            fifo_input_list.append(trade_record)
+def _lots_open_at(
+    events: List[Dict[str, Any]], window_start: str, matcher: TradeMatcher, workers
+) -> set:
+    """
+    Positions (in `events`) of the lots opened before window_start that are
+    still held then. Quantities do not depend on rates, so a replay with
+    placeholder rates from the matcher's current state finds them.
+    """
+    before = [
+        dict(event, rate=_UNUSED_RATE, source=i)
+        for i, event in enumerate(events)
+        if event["date"] < window_start
+    ]
+    replay = TradeMatcher.from_state(matcher.dump_state())
+    replay.keep_lot_detail = False
+    replay.years = set()
+    replay.process_trades(before, workers=workers, presorted=True)
+    return {lot.source for lots in replay.inventory.values() for lot in lots}
 
-    # --- 4. Execute FIFO Engine ---
-    matcher.process_trades(fifo_input_list)
 
-    # --- 5. Extract Final Results ---
-    all_realized = matcher.get_realized_gains()
+def resolve_rates(
+    events: List[Dict[str, Any]],
+    dividends: List[Dict[str, Any]],
+    matcher: TradeMatcher,
+    workers: int = 1,
+) -> List[Dict[str, Any]]:
+    """
+    Stage 4: NBP rates, only where they reach the report (matcher.years):
+    - dividends (route_events keeps the reported years only) and sales;
+    - lots opened since the first reported year started;
+    - older lots still held when it starts. Finding those takes a replay of
+      the older events (see _lots_open_at), so it is only done when some of
+      their rates are not already stored locally.
+    Splits, transfers out and sales outside the window need no rate; lots
+    consumed before the window get _UNUSED_RATE. Returns the dividend records.
+    """
+    window_start = f"{min(matcher.years)}-01-01" if matcher.years else ""
 
-    # Filter P&L for the requested tax year
-    target_realized = [
-        r for r in all_realized if r["sale_date"].startswith(str(target_year))
+    older = []
+    for i, event in enumerate(events):
+        opens_lot = event["qty"] > 0 and event["type"] != "SPLIT"
+        reported_sale = (
+            event["type"] == "SELL"
+            and event["qty"] < 0
+            and (matcher.years is None or int(event["date"][:4]) in matcher.years)
+        )
+        if opens_lot and event["date"] < window_start:
+            older.append(i)
+        elif opens_lot or reported_sale:
+            event["rate"] = _fetch_rate(event["currency"], event["date"])
+        else:
+            event["rate"] = _UNUSED_RATE
+
+    stored = [
+        get_cached_nbp_rate(events[i]["currency"], events[i]["date"]) for i in older
     ]
+    needed = set(older)
+    if None in stored:
+        needed = _lots_open_at(events, window_start, matcher, workers)
+    for i, rate in zip(older, stored):
+        event = events[i]
+        if rate is not None:
+            event["rate"] = rate
+        elif i in needed:
+            event["rate"] = _fetch_rate(event["currency"], event["date"])
+        else:
+            event["rate"] = _UNUSED_RATE
+
+    records = []
+    for row in dividends:
+        rate = _fetch_rate(row["currency"], row["date"])
+        records.append(
+            {
+                "ex_date": row["date"],
+                "trade_id": row["trade_id"],
+                "ticker": row["ticker"],
+                "gross_amount_pln": float(row["amount"] * rate),
+                "tax_withheld_pln": float(row["tax"] * rate),
+                "currency": row["currency"],
+                "rate": float(rate),
+            }
+        )
+    return records
+
+
+def match_events(
+    matcher: TradeMatcher,
+    fifo_input_list: List[Dict[str, Any]],
+    years: Collection[int],
+    workers: int = 1,
+    verify: bool = False,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Stage 5: feeds the (already ordered) FIFO events to the matcher, one
+    reported year at a time, and returns the open lots at the end of each of
+    `years` (same form as get_current_inventory()).
+    """
+
+    def feed(chunk):
+        if verify:
+            cross_check(matcher, chunk, workers=workers)
+        else:
+            matcher.process_trades(chunk, workers=workers, presorted=True)
+
+    inventories = {}
+    start = 0
+    for year in sorted(years):
+        year_end = f"{year}-12-31"
+        end = start
+        while end < len(fifo_input_list) and fifo_input_list[end]["date"] <= year_end:
+            end += 1
+        feed(fifo_input_list[start:end])
+        inventories[year] = matcher.get_current_inventory()
+        start = end
+    # Events after the last reported year still move the matcher's as_of
+    feed(fifo_input_list[start:])
+
+    if verify:
+        reporter.message(INFO, "FIFO results verified against the reference engine.")
+    return inventories
+
+
+def _timed(name: str, stage: Iterable, timings: Dict[str, float]) -> Iterator:
+    """Adds the time spent producing each item to timings[name] (inclusive)."""
+    iterator = iter(stage)
+    timings.setdefault(name, 0.0)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[name] += time.perf_counter() - start
+            return
+        timings[name] += time.perf_counter() - start
+        yield item
+
+
+def get_stage_timings() -> Dict[str, float]:
+    """Wall time in seconds per stage of the last process_yearly_data() run."""
+    return {name: _STAGE_TIMINGS[name] for name in STAGES if name in _STAGE_TIMINGS}
+
+
+def format_stage_timings(timings: Dict[str, float]) -> str:
+    return " | ".join(f"{name} {timings.get(name, 0.0):.3f}s" for name in STAGES)
+
+
+def process_yearly_data(
+    raw_trades: List[Dict[str, Any]],
+    target_year: int,
+    workers: int = 1,
+    matcher: Optional[TradeMatcher] = None,
+    verify: bool = False,
+    tax_window: Optional[int] = None,
+) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """
+    Main Processing Pipeline for one tax year (see process_multi_year_data).
+    Returns calculated Realized Gains, Dividends, and Inventory at year end.
+    """
+    return process_multi_year_data(
+        raw_trades,
+        [target_year],
+        workers=workers,
+        matcher=matcher,
+        verify=verify,
+        tax_window=tax_window,
+    )[target_year]
+
+
+def process_multi_year_data(
+    raw_trades: List[Dict[str, Any]],
+    years: Collection[int],
+    workers: int = 1,
+    matcher: Optional[TradeMatcher] = None,
+    verify: bool = False,
+    tax_window: Optional[int] = None,
+    snapshot: bool = False,
+) -> Dict[int, Tuple[List[Dict], List[Dict], List[Dict]]]:
+    """
+    Main Processing Pipeline, one streaming pass over the DB rows:
+    1. load      - rows in DB order (Date, rowid);
+    2. normalize - PascalCase rows to event dicts with Decimals;
+    3. route     - Withholding Taxes mapped to Dividends, FIFO events ordered;
+    4. rates     - NBP exchange rates, only those that reach the report;
+    5. match     - FIFO engine over Trades and Corp Actions.
+    Returns {year: (Realized Gains, Dividends, Inventory at year end)} for
+    every requested year, all from the same single FIFO replay.
+
+    workers > 1 runs the FIFO engine per ticker in a process pool.
+    A matcher restored from a snapshot (TradeMatcher.load_state) can be passed
+    in: FIFO events up to its as_of date are then skipped as already applied.
+    verify=True also replays the events through the lot-by-lot reference
+    engine and raises FifoMismatchError if the results differ.
+    tax_window: max days between a withholding tax row and its dividend
+    (default TAX_WINDOW_DAYS).
+    snapshot=True keeps the sales of the last event's year as well, for a
+    snapshot of the matcher to be saved afterwards (dump_state).
+    """
+    years = sorted(set(years))
+    if matcher is None:
+        matcher = TradeMatcher()
+
+    total = len(raw_trades) if hasattr(raw_trades, "__len__") else None
+    reporter.message(DEBUG, f"Processing {total} trades via FIFO engine...")
+
+    timings: Dict[str, float] = {}
+    dividend_rows: List[Dict[str, Any]] = []
+
+    with reporter.stage("route", total=total):
+        rows = _timed("load", reporter.track(load_rows(raw_trades), total), timings)
+        rows = _timed("normalize", normalize_rows(rows), timings)
+        events = list(
+            _timed(
+                "route",
+                route_events(
+                    rows, years, dividend_rows, matcher.as_of or "", tax_window
+                ),
+                timings,
+            )
+        )
+
+    # Only the reported years are kept; for a snapshot the year of the last
+    # event is kept too, so that it still holds its as_of year's sales.
+    if matcher.years is None:
+        matcher.years = set(years)
+        if snapshot and events:
+            matcher.years.add(int(events[-1]["date"][:4]))
+
+    with reporter.stage("rates"):
+        start = time.perf_counter()
+        dividends = resolve_rates(events, dividend_rows, matcher, workers=workers)
+        timings["rates"] = time.perf_counter() - start
+
+    with reporter.stage("match"):
+        start = time.perf_counter()
+        inventories = match_events(
+            matcher, events, years, workers=workers, verify=verify
+        )
+        timings["match"] = time.perf_counter() - start
+
+    # --- Split Final Results by tax year ---
+    start = time.perf_counter()
+    results = {year: ([], [], inventories[year]) for year in years}
+    for record in matcher.get_realized_gains():
+        year = int(record["sale_date"][:4])
+        if year in results:
+            results[year][0].append(record)
+    for dividend in dividends:
+        results[int(dividend["ex_date"][:4])][1].append(dividend)
+    timings["output"] = time.perf_counter() - start
+
+    # Generator stages nest, so inclusive times are turned into per-stage ones
+    inclusive = [timings[name] for name in STAGES[:3]]
+    for i, name in enumerate(STAGES[1:3], start=1):
+        timings[name] = inclusive[i] - inclusive[i - 1]
+
+    _STAGE_TIMINGS.clear()
+    _STAGE_TIMINGS.update(timings)
+
+    return results
+
+
+def process_ticker_groups(
+    row_groups: Iterable[List[Dict[str, Any]]],
+    years: Collection[int],
+    verify: bool = False,
+    tax_window: Optional[int] = None,
+    total: Optional[int] = None,
+    engine: Type[TradeMatcher] = TradeMatcher,
+) -> Dict[int, Tuple[List[Dict], List[Dict], List[Dict]]]:
+    """
+    Low-memory variant of process_multi_year_data: the history comes as
+    groups of rows that share no positions (a ticker closure each, see
+    ticker_deps), and every group is replayed on its own matcher, which is
+    dropped with the group's rows before the next one is read. This bounds
+    the history and the open lots held at once by the largest group; the
+    output (realized gains and dividends of the reported years) is still
+    collected for the whole account, since the exporters take whole years.
+    Realized gains and dividends are merged in (date, TradeId) order, the
+    order of a single replay of the whole history; stage timings
+    are summed over the groups; `total` is the number of groups, if known
+    (for the progress ETA). `engine` is the TradeMatcher class of the
+    per-group matchers.
+    """
+    results = {year: ([], [], []) for year in years}
+    totals = dict.fromkeys(STAGES, 0.0)
+    with reporter.stage("ticker groups", total=total):
+        for rows in reporter.track(row_groups, total, every=1):
+            if not rows:
+                continue
+            group = process_multi_year_data(
+                rows, years, matcher=engine(), verify=verify, tax_window=tax_window
+            )
+            for year, parts in group.items():
+                for merged, part in zip(results[year], parts):
+                    merged.extend(part)
+            for name, seconds in get_stage_timings().items():
+                totals[name] += seconds
 
-    inventory = matcher.get_current_inventory()
+    for realized, dividends, _ in results.values():
+        realized.sort(key=lambda r: (r["sale_date"], r["trade_id"]))
+        dividends.sort(key=lambda d: (d["ex_date"], d["trade_id"]))
+    _STAGE_TIMINGS.clear()
+    _STAGE_TIMINGS.update(totals)
 
-    return target_realized, dividends, inventory
+    return results
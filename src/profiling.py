@@ -0,0 +1,136 @@
+# src/profiling.py
+
+"""
+Per-stage profiling of main.py runs (--profile).
+
+Profiler.stage(name) records wall time, CPU time and peak traced memory of
+a block. Stages may nest: a parent's peak includes its children's. Peak
+memory comes from tracemalloc, which slows allocation-heavy stages down,
+so compare wall times of profiled runs with each other only.
+
+The report can also be written as JSON (write_json) for tracking between
+releases, and a cProfile dump of the whole run can be saved for pstats.
+"""
+
+import cProfile
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+REPORT_VERSION = 1
+
+
+class Profiler:
+    """
+    Collects stage timings between start() and finish(). A disabled
+    profiler records nothing and its stage() costs next to nothing, so
+    call sites need no checks.
+    """
+
+    def __init__(self, enabled: bool = False, pstats_path: Optional[str] = None):
+        self.enabled = enabled or bool(pstats_path)
+        self.pstats_path = pstats_path
+        self.stages: List[Dict[str, Any]] = []
+        self.total: Dict[str, float] = {}
+        self._stack: List[Dict[str, Any]] = []
+        self._cprofile = None
+        self._started = None
+        self._traced = False
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._traced = True
+        if self.pstats_path:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._started = (time.perf_counter(), time.process_time())
+
+    def finish(self) -> None:
+        if not self.enabled or self._started is None:
+            return
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.pstats_path)
+            self._cprofile = None
+        wall, cpu = self._started
+        self.total = {
+            "wall_s": time.perf_counter() - wall,
+            "cpu_s": time.process_time() - cpu,
+            "peak_mb": tracemalloc.get_traced_memory()[1] / 1e6,
+        }
+        if self._traced:
+            tracemalloc.stop()
+            self._traced = False
+        self._started = None
+
+    @contextmanager
+    def stage(self, name: str, **info: Any):
+        """Times the block as stage `name`; info is stored with it (e.g. year)."""
+        if not self.enabled or self._started is None:
+            yield
+            return
+
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._stack:
+            # The parent keeps the peak reached so far before it is reset
+            self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        entry = {"name": name, "depth": len(self._stack), "peak": 0, **info}
+        self.stages.append(entry)
+        self._stack.append(entry)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            entry["wall_s"] = time.perf_counter() - wall
+            entry["cpu_s"] = time.process_time() - cpu
+            entry["peak"] = max(entry["peak"], tracemalloc.get_traced_memory()[1])
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], entry["peak"])
+
+    def report(self, **extra: Any) -> Dict[str, Any]:
+        """Machine-readable report; extra keys (e.g. pipeline timings) are added."""
+        stages = []
+        for entry in self.stages:
+            stage = {k: v for k, v in entry.items() if k != "peak"}
+            stage["peak_mb"] = entry["peak"] / 1e6
+            stages.append(stage)
+        return {
+            "version": REPORT_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "argv": sys.argv[1:],
+            "python": platform.python_version(),
+            "total": self.total,
+            "stages": stages,
+            **extra,
+        }
+
+    def write_json(self, path: str, **extra: Any) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2, default=str)
+
+    def format_lines(self) -> List[str]:
+        lines = [f"{'Stage':<32} {'Wall s':>9} {'CPU s':>9} {'Peak MB':>9}"]
+        for entry in self.stages:
+            label = "  " * entry["depth"] + entry["name"]
+            if "year" in entry:
+                label += f" ({entry['year']})"
+            lines.append(
+                f"{label:<32} {entry['wall_s']:>9.3f} {entry['cpu_s']:>9.3f} "
+                f"{entry['peak'] / 1e6:>9.1f}"
+            )
+        if self.total:
+            lines.append(
+                f"{'total':<32} {self.total['wall_s']:>9.3f} "
+                f"{self.total['cpu_s']:>9.3f} {self.total['peak_mb']:>9.1f}"
+            )
+        return lines
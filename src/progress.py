@@ -0,0 +1,329 @@
+# src/progress.py
+
+"""
+Progress and event reporting for imports, calculations and exports.
+
+Long-running code reports to a Reporter instead of printing: stage
+transitions (stage), rows processed (track / progress) and messages with a
+level (message). Subscribers are callbacks receiving Event objects; the CLI
+subscribes a ConsoleRenderer, which draws a progress line, and a GUI/API
+layer can subscribe its own callback instead of scraping stdout.
+
+Progress events are rate limited (one per `min_interval` seconds per stage)
+so per-row calls are cheap. Messages sent with a `key` are per-row by
+nature (e.g. one per NBP fallback): only the first `repeat_limit` of each
+key are delivered, the rest are counted and summarized when the outermost
+stage ends (or on flush()).
+
+Without subscribers, messages of INFO and above are printed as the
+ConsoleRenderer would print them, so library use outside the CLI (e.g.
+calling an exporter directly) keeps the output it had before the
+reporter existed.
+"""
+
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# Message levels (the logging module's values)
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+_LEVEL_PREFIX = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# Event kinds
+STAGE_START = "stage_start"
+PROGRESS = "progress"
+STAGE_END = "stage_end"
+MESSAGE = "message"
+
+
+class Event:
+    """One report: a stage transition, a progress update or a message."""
+
+    __slots__ = (
+        "kind",
+        "stage",
+        "depth",
+        "level",
+        "text",
+        "done",
+        "total",
+        "elapsed",
+        "eta",
+    )
+
+    def __init__(
+        self,
+        kind: str,
+        stage: Optional[str] = None,
+        depth: int = 0,
+        level: int = INFO,
+        text: str = "",
+        done: int = 0,
+        total: Optional[int] = None,
+        elapsed: float = 0.0,
+        eta: Optional[float] = None,
+    ):
+        self.kind = kind
+        self.stage = stage
+        self.depth = depth
+        self.level = level
+        self.text = text
+        self.done = done
+        self.total = total
+        self.elapsed = elapsed
+        self.eta = eta
+
+    def __repr__(self):
+        return f"Event({self.kind!r}, {self.stage!r}, done={self.done}, text={self.text!r})"
+
+
+class _Stage:
+    __slots__ = ("name", "total", "done", "started", "last_emit")
+
+    def __init__(self, name: str, total: Optional[int], started: float):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = started
+        self.last_emit = started
+
+
+class Reporter:
+    """Dispatches stage, progress and message events to the subscribers."""
+
+    def __init__(
+        self,
+        min_interval: float = 0.2,
+        repeat_limit: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_interval = min_interval
+        self.repeat_limit = repeat_limit
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._subscribers: List[Callable[[Event], Any]] = []
+        self._stages: List[_Stage] = []
+        self._repeats: Counter = Counter()
+        self._samples: Dict[str, Event] = {}
+
+    def subscribe(self, callback: Callable[[Event], Any]) -> Callable[[], None]:
+        """Adds a callback; returns a function that removes it again."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def _emit(self, event: Event) -> None:
+        subscribers = list(self._subscribers)
+        if subscribers:
+            for callback in subscribers:
+                callback(event)
+        elif event.kind == MESSAGE and event.level >= INFO:
+            print(_format_message(event))
+
+    # --- Stages ---
+
+    @contextmanager
+    def stage(self, name: str, total: Optional[int] = None):
+        """Brackets a stage with start/end events; `total` units, if known."""
+        with self._lock:
+            entry = _Stage(name, total, self._clock())
+            self._stages.append(entry)
+            depth = len(self._stages) - 1
+            self._emit(Event(STAGE_START, name, depth, total=total))
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                self._stages.remove(entry)
+                self._emit(
+                    Event(
+                        STAGE_END,
+                        name,
+                        depth,
+                        done=entry.done,
+                        total=entry.total,
+                        elapsed=self._clock() - entry.started,
+                    )
+                )
+                if not self._stages:
+                    self.flush()
+
+    def progress(self, done: int, total: Optional[int] = None, force: bool = False):
+        """Sets the units done in the innermost stage; rate limited."""
+        with self._lock:
+            if not self._stages:
+                return
+            entry = self._stages[-1]
+            entry.done = done
+            if total is not None:
+                entry.total = total
+            now = self._clock()
+            if not force and now - entry.last_emit < self.min_interval:
+                return
+            entry.last_emit = now
+            elapsed = now - entry.started
+            eta = None
+            if entry.total and done:
+                eta = elapsed * (entry.total - done) / done
+            self._emit(
+                Event(
+                    PROGRESS,
+                    entry.name,
+                    len(self._stages) - 1,
+                    done=done,
+                    total=entry.total,
+                    elapsed=elapsed,
+                    eta=eta,
+                )
+            )
+
+    def advance(self, units: int = 1) -> None:
+        """Adds units to the innermost stage's count."""
+        with self._lock:
+            done = self._stages[-1].done + units if self._stages else 0
+        self.progress(done)
+
+    def track(
+        self, items: Iterable, total: Optional[int] = None, every: int = 100
+    ) -> Iterator:
+        """
+        Yields `items`, counting them as progress of the innermost stage
+        (reported every `every` items, so per-row loops stay cheap).
+        """
+        if total is None and hasattr(items, "__len__"):
+            total = len(items)
+        done = 0
+        self.progress(0, total)
+        for item in items:
+            yield item
+            done += 1
+            if done % every == 0:
+                self.progress(done)
+        self.progress(done, force=True)
+
+    # --- Messages ---
+
+    def message(self, level: int, text: str, key: Optional[str] = None) -> None:
+        """
+        Reports `text` at `level`. Messages of one `key` past repeat_limit
+        are only counted (see flush).
+        """
+        with self._lock:
+            stage = self._stages[-1].name if self._stages else None
+            event = Event(MESSAGE, stage, max(len(self._stages) - 1, 0), level, text)
+            if key is not None:
+                self._repeats[key] += 1
+                self._samples.setdefault(key, event)
+                if self._repeats[key] > self.repeat_limit:
+                    return
+            self._emit(event)
+
+    def flush(self) -> None:
+        """Reports how many keyed messages were held back, and resets the counts."""
+        with self._lock:
+            for key, count in self._repeats.items():
+                held = count - self.repeat_limit
+                if held > 0:
+                    sample = self._samples[key]
+                    self._emit(
+                        Event(
+                            MESSAGE,
+                            sample.stage,
+                            level=sample.level,
+                            text=f"... {held} more like this ({count} in total).",
+                        )
+                    )
+            self._repeats.clear()
+            self._samples.clear()
+
+    def counts(self) -> Dict[str, int]:
+        """Keyed messages reported since the last flush, by key."""
+        with self._lock:
+            return dict(self._repeats)
+
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def _format_message(event: Event) -> str:
+    """Message text, prefixed with its level unless it is INFO."""
+    if event.level == INFO:
+        return event.text
+    return f"{_LEVEL_PREFIX.get(event.level, 'ERROR')}: {event.text}"
+
+
+class ConsoleRenderer:
+    """
+    CLI subscriber: messages at or above `level` as lines, and active stages
+    as one progress line ("import 3/12 25% ETA 40s > parse 1200") redrawn in
+    place. The progress line is only drawn on a terminal.
+    """
+
+    def __init__(self, level: int = INFO, stream=None):
+        self.level = level
+        self.stream = stream or sys.stdout
+        self.live = self.stream.isatty()
+        self._active: Dict[int, Event] = {}
+        self._drawn = 0
+
+    def __call__(self, event: Event) -> None:
+        if event.kind == MESSAGE:
+            if event.level >= self.level:
+                self._clear()
+                self.stream.write(f"{_format_message(event)}\n")
+                self._draw()
+            return
+        if event.kind == STAGE_END:
+            for depth in [d for d in self._active if d >= event.depth]:
+                del self._active[depth]
+        else:
+            self._active[event.depth] = event
+        self._draw()
+
+    def _clear(self) -> None:
+        if self._drawn:
+            self.stream.write("\r" + " " * self._drawn + "\r")
+            self._drawn = 0
+
+    def _draw(self) -> None:
+        if not self.live:
+            return
+        parts = []
+        for depth in sorted(self._active):
+            event = self._active[depth]
+            part = f"{event.stage} {event.done}"
+            if event.total:
+                part += f"/{event.total} {100 * event.done // event.total}%"
+            if event.eta is not None:
+                part += f" ETA {_format_seconds(event.eta)}"
+            parts.append(part)
+        line = " > ".join(parts)
+        self._clear()
+        if line:
+            self.stream.write(line)
+            self._drawn = len(line)
+        self.stream.flush()
+
+
+# Process-wide reporter used by the pipeline, the parser and the exporters
+reporter = Reporter()
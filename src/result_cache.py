@@ -0,0 +1,175 @@
+# src/result_cache.py
+
+"""
+Calculation result cache.
+
+A calculation is a pure function of the DB contents (transactions and the
+local NBP rate store), the requested years, the ticker filter, the tax
+window and the calculation code itself. cache_key() hashes all of them:
+the DB part is the db_meta change counters (DBConnector.get_data_version),
+bumped once per write operation (an import, a rate import, an alias), and
+the code part is a hash of the calculation modules' source
+(engine_version). A matching entry can be exported directly, without
+loading the history or replaying FIFO.
+
+Entries live in their own SQLCipher database next to the main one,
+encrypted with the same key, as zlib-compressed JSON (Decimals, tuples and
+non-string dict keys are tagged so they round-trip). The total payload
+size is bounded; the least recently used entries are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import time
+import zlib
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from decouple import config
+
+from .db_connector import DB_PATH, DBConnector
+
+CACHE_PATH = config(
+    "RESULT_CACHE_PATH",
+    default=os.path.join(os.path.dirname(DB_PATH), "result_cache.db.enc"),
+)
+CACHE_MAX_BYTES = config("RESULT_CACHE_MAX_MB", default=64, cast=int) * 2**20
+
+# Modules whose code determines the results (or their stored form)
+_ENGINE_MODULES = (
+    "processing.py",
+    "fifo.py",
+    "fifo_vector.py",
+    "withholding.py",
+    "nbp.py",
+    "utils.py",
+    "db_connector.py",
+    "result_cache.py",
+)
+_ENGINE_VERSION = None
+
+
+def engine_version() -> str:
+    """Hash of the calculation modules' source: any code change is a miss."""
+    global _ENGINE_VERSION
+    if _ENGINE_VERSION is None:
+        digest = hashlib.sha256()
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in _ENGINE_MODULES:
+            with open(os.path.join(src_dir, name), "rb") as f:
+                digest.update(name.encode() + b"\0" + f.read())
+        _ENGINE_VERSION = digest.hexdigest()
+    return _ENGINE_VERSION
+
+
+def cache_key(
+    data_version: Dict[str, Any],
+    years: Iterable[int],
+    ticker: Union[str, List[str], None] = None,
+    **options: Any,
+) -> str:
+    """Content address of one calculation; options are extra result inputs."""
+    material = {
+        "data": data_version,
+        "years": sorted(years),
+        "ticker": ticker,
+        "options": options,
+        "engine": engine_version(),
+    }
+    encoded = json.dumps(material, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _pack(value: Any) -> Any:
+    """value as plain JSON types; what JSON would lose is tagged."""
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, tuple):
+        return {"$tuple": [_pack(v) for v in value]}
+    if isinstance(value, list):
+        return [_pack(v) for v in value]
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return {k: _pack(v) for k, v in value.items()}
+        return {"$items": [[_pack(k), _pack(v)] for k, v in value.items()]}
+    return value
+
+
+def _unpack(obj: Dict[str, Any]) -> Any:
+    """json.loads object_hook undoing _pack."""
+    if len(obj) == 1:
+        if "$decimal" in obj:
+            return Decimal(obj["$decimal"])
+        if "$tuple" in obj:
+            return tuple(obj["$tuple"])
+        if "$items" in obj:
+            return {k: v for k, v in obj["$items"]}
+    return obj
+
+
+class ResultCache:
+    """Size-bounded LRU store of JSON results in an encrypted database."""
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.db = DBConnector(path or CACHE_PATH)
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    def __enter__(self):
+        self.db.connect()
+        self.db.conn.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                Key TEXT PRIMARY KEY,
+                Payload BLOB,
+                Size INTEGER,
+                LastUsed REAL
+            );
+            """)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.db.close()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self.db.conn.execute(
+            "SELECT Payload FROM result_cache WHERE Key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.conn.execute(
+            "UPDATE result_cache SET LastUsed = ? WHERE Key = ?", (time.time(), key)
+        )
+        self.db.conn.commit()
+        return json.loads(zlib.decompress(row[0]), object_hook=_unpack)
+
+    def put(self, key: str, value: Any) -> bool:
+        """Stores value under key; False if it alone exceeds the size bound."""
+        payload = zlib.compress(json.dumps(_pack(value)).encode())
+        if len(payload) > self.max_bytes:
+            return False
+        self.db.conn.execute(
+            "INSERT OR REPLACE INTO result_cache VALUES (?, ?, ?, ?)",
+            (key, payload, len(payload), time.time()),
+        )
+        self._evict()
+        self.db.conn.commit()
+        return True
+
+    def total_bytes(self) -> int:
+        row = self.db.conn.execute("SELECT SUM(Size) FROM result_cache").fetchone()
+        return row[0] or 0
+
+    def _evict(self) -> None:
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        cursor = self.db.conn.execute(
+            "SELECT Key, Size FROM result_cache ORDER BY LastUsed ASC"
+        )
+        stale = []
+        for key, size in cursor.fetchall():
+            if excess <= 0:
+                break
+            stale.append((key,))
+            excess -= size
+        self.db.conn.executemany("DELETE FROM result_cache WHERE Key = ?", stale)
@@ -0,0 +1,83 @@
+# src/ticker_deps.py
+
+"""
+Ticker dependency graph for single-ticker and low-memory runs.
+
+Positions move between tickers: a merger removes the old shares and adds
+new ones, and a spinoff adds shares of a new company to holders of the
+parent. A run filtered to one ticker therefore loads the connected
+component of that ticker in the graph whose edges are these links, instead
+of the ticker's rows alone; the low-memory mode replays the history one
+such closure at a time (ticker_groups). Nodes are canonical symbols:
+renamed tickers are one node already (ticker_aliases in the DB).
+
+Links are read from the corporate action descriptions, which name both
+sides the way IBKR writes them, e.g.
+    "FNF(US31620R3030) Spinoff 1 for 10 (FG, F&G ANNUITIES, US30190A1043)"
+    "ABC(US0000000001) Merged(Acquisition) WITH ... (XYZ, XYZ CORP, US0000000002)"
+"""
+
+import re
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+# Event types whose rows can name other tickers
+LINKING_EVENTS = ("MERGER", "SPINOFF", "STOCK_DIV")
+
+# Same patterns as parser.extract_ticker: leading "TICKER(" and "(TICKER, name, ISIN)"
+_LEADING = re.compile(r"^([A-Za-z0-9\.]+)\s*\(")
+_EMBEDDED = re.compile(r"\(([A-Za-z0-9\.]+),\s+[^,]+,\s+[A-Za-z0-9]{9,}\)")
+
+
+def build_ticker_graph(
+    corp_actions: Iterable[Tuple[str, str]],
+    aliases: Mapping[str, str],
+) -> Dict[str, Set[str]]:
+    """
+    Undirected graph {ticker: linked tickers} from (canonical Ticker,
+    Description) rows of corporate actions; symbols named in a description
+    are mapped through `aliases` ({alias: canonical ticker}).
+    """
+    graph = defaultdict(set)
+
+    def link(tickers):
+        tickers = set(tickers)
+        for ticker in tickers:
+            graph[ticker] |= tickers - {ticker}
+
+    for ticker, description in corp_actions:
+        description = description or ""
+        named = [m.group(1) for m in (_LEADING.search(description),) if m]
+        named += _EMBEDDED.findall(description)
+        link([ticker, *(aliases.get(name, name) for name in named)])
+    return graph
+
+
+def ticker_closure(graph: Mapping[str, Set[str]], ticker: str) -> List[str]:
+    """All tickers connected to `ticker` (itself included), sorted."""
+    seen = {ticker}
+    queue = deque([ticker])
+    while queue:
+        for linked in graph.get(queue.popleft(), ()):
+            if linked not in seen:
+                seen.add(linked)
+                queue.append(linked)
+    return sorted(seen)
+
+
+def ticker_groups(
+    graph: Mapping[str, Set[str]], tickers: Iterable[str]
+) -> List[List[str]]:
+    """
+    Partition of `tickers` into closures, each sorted, in the order of their
+    smallest ticker: the units of the low-memory mode, which never splits a
+    position between two groups.
+    """
+    groups = []
+    seen = set()
+    for ticker in sorted(tickers):
+        if ticker not in seen:
+            group = ticker_closure(graph, ticker)
+            seen.update(group)
+            groups.append(group)
+    return groups
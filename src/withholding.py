@@ -0,0 +1,92 @@
+# src/withholding.py
+
+"""
+Withholding tax to dividend matching.
+
+IBKR books withholding tax as separate rows: usually on the dividend date,
+but adjustments (a reversal of the original tax plus a re-accrual at the
+corrected amount) come days later. WithholdingIndex keeps the dividends of
+each ticker sorted by date and attaches every tax row to the nearest
+dividend of its ticker within `window_days`, with a bisect per lookup.
+Amounts are summed with their signs, so a reversal cancels the tax it
+reverses and only the net withholding is reported.
+"""
+
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from decouple import config
+
+# Max distance in days between a tax row and its dividend
+TAX_WINDOW_DAYS = config("TAX_WINDOW_DAYS", default=10, cast=int)
+
+
+def _day(date_str: str) -> int:
+    return date.fromisoformat(date_str[:10]).toordinal()
+
+
+class WithholdingIndex:
+    """
+    Per-ticker, date-sorted dividend index.
+
+    add_dividend() takes the dividends in date order (the DB order); then
+    add_tax() attaches tax rows in any order, and tax_for() returns the net
+    withholding of a dividend as a positive amount.
+    """
+
+    def __init__(self, window_days: Optional[int] = None):
+        self.window_days = TAX_WINDOW_DAYS if window_days is None else window_days
+        self._days: Dict[str, List[int]] = {}
+        self._dividends: Dict[str, List[Dict[str, Any]]] = {}
+        # Signed tax sum per dividend, by id() of its row
+        self._tax: Dict[int, Decimal] = {}
+        # Tax rows with no dividend of their ticker within the window
+        self.unmatched: List[Dict[str, Any]] = []
+
+    def add_dividend(self, row: Dict[str, Any]) -> None:
+        day = _day(row["date"])
+        days = self._days.setdefault(row["ticker"], [])
+        if days and day < days[-1]:
+            raise ValueError(
+                f"Dividend of {row['ticker']} on {row['date']} is out of date order."
+            )
+        days.append(day)
+        self._dividends.setdefault(row["ticker"], []).append(row)
+
+    def find(self, ticker: str, date_str: str) -> Optional[Dict[str, Any]]:
+        """
+        The dividend a tax row of `ticker` dated `date_str` belongs to: the
+        nearest one within the window, the earlier one on a tie (adjustments
+        follow their dividend). Several dividends on the chosen day: the last
+        one, whether the tax row is dated before or after them.
+        """
+        days = self._days.get(ticker)
+        if not days:
+            return None
+        day = _day(date_str)
+        i = bisect_right(days, day)
+        before = day - days[i - 1] if i else None
+        after = days[i] - day if i < len(days) else None
+
+        if before is not None and before <= self.window_days:
+            if after is None or before <= after:
+                return self._dividends[ticker][i - 1]
+        if after is not None and after <= self.window_days:
+            return self._dividends[ticker][bisect_right(days, days[i]) - 1]
+        return None
+
+    def add_tax(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Attaches a tax row (signed "amount") to its dividend and returns it."""
+        dividend = self.find(row["ticker"], row["date"])
+        if dividend is None:
+            self.unmatched.append(row)
+            return None
+        key = id(dividend)
+        self._tax[key] = self._tax.get(key, Decimal(0)) + row["amount"]
+        return dividend
+
+    def tax_for(self, dividend: Dict[str, Any]) -> Decimal:
+        # Tax amount in DB is usually negative. We use the absolute magnitude.
+        return abs(self._tax.get(id(dividend), Decimal(0)))
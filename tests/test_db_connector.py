@@ -50,4 +50,90 @@ def test_get_trades_with_ticker_filter(mock_db_connection):
             db.get_trades_for_calculation(2024, "AAPL")
             call_args = mock_conn.execute.call_args
             query = call_args[0][0]
-            assert "AND Ticker = ?" in query
+            assert "AND CanonicalTicker = ?" in query
+
+
+def test_get_trades_with_ticker_closure(mock_db_connection):
+    mock_connect, mock_conn = mock_db_connection
+
+    with patch("src.db_connector.DB_PATH", DB_PATH), patch(
+        "src.db_connector.DB_KEY", DB_KEY
+    ):
+
+        with DBConnector() as db:
+            db.get_trades_for_calculation(2024, ["FB", "META"])
+            query, params = mock_conn.execute.call_args[0]
+            assert "AND CanonicalTicker IN (?, ?)" in query
+            assert params == ["FB", "META", "2024-12-31"]
+
+
+def test_canonical_ticker_is_stored_and_remapped(tmp_path):
+    row = {
+        "date": "2021-01-04",
+        "type": "BUY",
+        "qty": 1.0,
+        "price": 10.0,
+        "currency": "USD",
+        "fee": 0.0,
+        "desc": "",
+    }
+    with patch("src.db_connector.DB_KEY", DB_KEY), DBConnector(
+        str(tmp_path / "history.db")
+    ) as db:
+        db.initialize_schema()
+        db.save_transaction(dict(row, ticker="FB"))
+        db.save_transaction(dict(row, ticker="META"))
+        db.save_transaction(dict(row, ticker="ABC"))
+
+        def tickers(ticker):
+            trades = db.get_trades_for_calculation(2021, ticker)
+            return [t["Ticker"] for t in trades]
+
+        assert tickers("META") == ["META", "META"]
+        assert tickers(None) == ["META", "META", "ABC"]
+
+        # ABC renamed to XYZ, then XYZ to NEW: ABC rows follow both renames
+        assert db.set_ticker_alias("ABC", "XYZ") == 1
+        assert db.set_ticker_alias("XYZ", "NEW") == 1
+        assert tickers("NEW") == ["NEW"]
+        assert db.get_ticker_aliases()["ABC"] == "NEW"
+        with pytest.raises(ValueError):
+            db.set_ticker_alias("NEW", "ABC")
+
+
+def test_existing_database_gets_canonical_column(tmp_path):
+    with patch("src.db_connector.DB_KEY", DB_KEY), DBConnector(
+        str(tmp_path / "history.db")
+    ) as db:
+        db.conn.execute(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "Date TEXT, EventType TEXT, Ticker TEXT, Quantity REAL, Price REAL, "
+            "Currency TEXT, Amount REAL, Fee REAL, Description TEXT)"
+        )
+        db.conn.execute(
+            "INSERT INTO transactions (Date, EventType, Ticker) "
+            "VALUES ('2021-01-04', 'BUY', 'TOT')"
+        )
+        db.initialize_schema()
+
+        trades = db.get_trades_for_calculation(2021, "TTE")
+        assert [t["Ticker"] for t in trades] == ["TTE"]
+
+
+def test_get_corporate_actions_filters_on_event_types(tmp_path):
+    with patch("src.db_connector.DB_KEY", DB_KEY), DBConnector(
+        str(tmp_path / "history.db")
+    ) as db:
+        db.initialize_schema()
+        db.conn.executemany(
+            "INSERT INTO transactions (Date, EventType, Ticker, CanonicalTicker, "
+            "Description) VALUES ('2021-01-04', ?, ?, ?, ?)",
+            [
+                ("MERGER", "ABC", "ABC", "ABC merged"),
+                ("SPINOFF", "XYZ", "XYZ", "XYZ spun off"),
+                ("BUY", "ABC", "ABC", ""),
+            ],
+        )
+
+        assert db.get_corporate_actions(["MERGER"]) == [("ABC", "ABC merged")]
+        assert len(db.get_corporate_actions(("MERGER", "SPINOFF", "STOCK_DIV"))) == 2
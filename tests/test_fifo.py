@@ -1,8 +1,10 @@
 # tests/test_fifo.py
 
+import copy
 import pytest
+import random
 from decimal import Decimal
-from src.fifo import TradeMatcher
+from src.fifo import TradeMatcher, Lot, LotQueue, FifoMismatchError, cross_check
 
 
 @pytest.fixture
@@ -101,3 +103,300 @@ def test_fifo_multiple_buys(matcher):
 
     # Profit: 4500 - 2000 = 2500
     assert res["profit_loss"] == 2500.0
+
+
+def test_matched_lots_are_plain_dicts_at_output(matcher):
+    """Lots are slotted objects internally but exported as dicts."""
+    trades = [
+        {
+            "type": "BUY",
+            "date": "2024-01-01",
+            "ticker": "AAPL",
+            "qty": Decimal(10),
+            "price": Decimal(100),
+            "commission": Decimal(0),
+            "currency": "USD",
+            "rate": Decimal(1.0),
+        },
+        {
+            "type": "SELL",
+            "date": "2024-01-02",
+            "ticker": "AAPL",
+            "qty": Decimal(-4),
+            "price": Decimal(120),
+            "commission": Decimal(0),
+            "currency": "USD",
+            "rate": Decimal(1.0),
+        },
+    ]
+    matcher.process_trades(trades)
+
+    assert isinstance(matcher.inventory["AAPL"][0], Lot)
+    assert matcher.inventory["AAPL"][0].qty == Decimal(6)
+
+    matched = matcher.get_realized_gains()[0]["matched_buys"]
+    assert matched == [
+        {
+            "date": "2024-01-01",
+            "qty": Decimal(4),
+            "price": Decimal(100),
+            "rate": Decimal(1.0),
+            "cost_pln": Decimal("400.00"),
+            "currency": "USD",
+            "source": "UNKNOWN",
+        }
+    ]
+
+
+def _random_portfolio(seed, tickers=12, events_per_ticker=40):
+    rng = random.Random(seed)
+    trades = []
+    for t in range(tickers):
+        ticker = f"T{t:02d}"
+        held = Decimal(0)
+        for i in range(events_per_ticker):
+            date = f"2023-{1 + i % 12:02d}-{1 + (i * 7 + t) % 28:02d}"
+            if held > 0 and rng.random() < 0.4:
+                qty = -min(held, Decimal(rng.randint(1, 30)))
+                t_type = "SELL"
+            elif rng.random() < 0.05:
+                qty, t_type = Decimal(0), "SPLIT"
+            else:
+                qty, t_type = Decimal(rng.randint(1, 20)), "BUY"
+            held += qty
+            trades.append(
+                {
+                    "type": t_type,
+                    "date": date,
+                    "ticker": ticker,
+                    "qty": qty,
+                    "price": Decimal(rng.randint(1000, 9000)) / 100,
+                    "commission": Decimal(rng.randint(0, 200)) / 100,
+                    "currency": "USD",
+                    "rate": Decimal("3.9") + Decimal(rng.randint(0, 50)) / 100,
+                    "ratio": Decimal(2),
+                }
+            )
+    return trades
+
+
+def test_parallel_matching_is_identical_to_serial():
+    serial, parallel = TradeMatcher(), TradeMatcher()
+    serial.process_trades(_random_portfolio(7))
+    parallel.process_trades(_random_portfolio(7), workers=2)
+
+    assert parallel.get_realized_gains() == serial.get_realized_gains()
+    assert parallel.get_current_inventory() == serial.get_current_inventory()
+    assert list(parallel.inventory) == list(serial.inventory)
+
+
+def test_snapshot_warm_start_matches_full_replay(tmp_path):
+    trades = _random_portfolio(11, tickers=5)
+    cutoff = "2023-06-30"
+    old = [t for t in trades if t["date"] <= cutoff]
+    new = [t for t in trades if t["date"] > cutoff]
+
+    full = TradeMatcher()
+    full.process_trades(_random_portfolio(11, tickers=5))
+
+    first = TradeMatcher()
+    first.process_trades(old)
+    path = tmp_path / "fifo_state.json"
+    first.save_state(str(path), meta={"ticker": None})
+
+    resumed = TradeMatcher.load_state(str(path))
+    assert resumed.as_of == first.as_of
+    assert resumed.state_meta == {"ticker": None}
+    resumed.process_trades(new)
+
+    assert resumed.get_realized_gains() == full.get_realized_gains()
+    assert resumed.get_current_inventory() == full.get_current_inventory()
+
+
+def test_snapshot_round_trips_exact_decimals():
+    matcher = TradeMatcher()
+    matcher.process_trades(
+        [
+            {
+                "type": "BUY",
+                "date": "2024-01-01",
+                "ticker": "DRIP",
+                "qty": Decimal("0.123456789"),
+                "price": Decimal("101.25"),
+                "commission": Decimal("0.35"),
+                "currency": "USD",
+                "rate": Decimal("3.9432"),
+            }
+        ]
+    )
+    restored = TradeMatcher.from_state(matcher.dump_state())
+    lot = restored.inventory["DRIP"][0]
+
+    assert lot.qty == Decimal("0.123456789")
+    assert str(lot.cost_pln) == str(matcher.inventory["DRIP"][0].cost_pln)
+    assert restored.events_processed == 1
+
+
+def test_snapshot_rejects_older_events_and_unknown_versions():
+    matcher = TradeMatcher()
+    matcher.process_trades(_random_portfolio(3, tickers=1))
+    state = matcher.dump_state()
+
+    with pytest.raises(ValueError):
+        TradeMatcher.from_state(dict(state, version=99))
+
+    resumed = TradeMatcher.from_state(state)
+    with pytest.raises(ValueError):
+        resumed.process_trades(_random_portfolio(3, tickers=1))
+
+
+def test_sale_across_many_lots_uses_index_consistently(monkeypatch):
+    trades = _random_portfolio(3, tickers=3, events_per_ticker=300)
+    reference = TradeMatcher()
+    reference.process_trades(_random_portfolio(3, tickers=3, events_per_ticker=300))
+
+    # Compacting after every sale must not change any result
+    monkeypatch.setattr(LotQueue, "COMPACT_MIN", 2)
+    compacted = TradeMatcher()
+    compacted.process_trades(trades)
+    assert compacted.get_realized_gains() == reference.get_realized_gains()
+    assert compacted.get_current_inventory() == reference.get_current_inventory()
+
+    lean = TradeMatcher(keep_lot_detail=False)
+    lean.process_trades(_random_portfolio(3, tickers=3, events_per_ticker=300))
+    expected = reference.get_realized_gains()
+    for got, want in zip(lean.get_realized_gains(), expected):
+        assert got["matched_buys"] == []
+        assert got["cost_basis"] == want["cost_basis"]
+        assert got["profit_loss"] == want["profit_loss"]
+
+
+def test_one_sale_consumes_many_small_lots():
+    m = TradeMatcher()
+    for i in range(500):
+        m.process_trades(
+            [
+                {
+                    "type": "BUY",
+                    "date": "2023-01-02",
+                    "ticker": "X",
+                    "qty": Decimal("0.1"),
+                    "price": Decimal(10 + i % 7),
+                    "commission": Decimal(0),
+                    "currency": "USD",
+                    "rate": Decimal(4),
+                }
+            ]
+        )
+    m.process_trades(
+        [
+            {
+                "type": "SELL",
+                "date": "2023-02-01",
+                "ticker": "X",
+                "qty": Decimal("-30.05"),
+                "price": Decimal(20),
+                "commission": Decimal(0),
+                "currency": "USD",
+                "rate": Decimal(4),
+            }
+        ]
+    )
+
+    gain = m.get_realized_gains()[0]
+    assert len(gain["matched_buys"]) == 301
+    assert gain["matched_buys"][-1]["qty"] == Decimal("0.05")
+    assert sum(b["qty"] for b in gain["matched_buys"]) == Decimal("30.05")
+    assert gain["cost_basis"] == sum(b["cost_pln"] for b in gain["matched_buys"])
+    assert sum(lot.qty for lot in m.inventory["X"]) == Decimal("19.95")
+
+
+def test_cross_check_agrees_with_reference_engine():
+    trades = _random_portfolio(21, tickers=4, events_per_ticker=120)
+    warm = TradeMatcher()
+    warm.process_trades([t for t in trades if t["date"] <= "2023-06-30"])
+
+    matcher = cross_check(warm, [t for t in trades if t["date"] > "2023-06-30"])
+
+    full = TradeMatcher()
+    full.process_trades(_random_portfolio(21, tickers=4, events_per_ticker=120))
+    assert matcher.get_realized_gains() == full.get_realized_gains()
+
+
+def test_cross_check_reports_engine_mismatch(monkeypatch):
+    original = LotQueue.take
+
+    def off_by_a_grosz(self, qty, with_detail=True, **kwargs):
+        cost, matched, rest = original(self, qty, with_detail, **kwargs)
+        return cost + Decimal("0.01"), matched, rest
+
+    monkeypatch.setattr(LotQueue, "take", off_by_a_grosz)
+    with pytest.raises(FifoMismatchError):
+        cross_check(TradeMatcher(), _random_portfolio(2, tickers=2))
+
+
+def test_sink_and_year_window_stream_only_reported_sales():
+    trades = _random_portfolio(9, tickers=6, events_per_ticker=60)
+    for i, t in enumerate(trades):
+        t["date"] = f"{2021 + i % 3}{t['date'][4:]}"
+
+    full = TradeMatcher()
+    full.process_trades(copy.deepcopy(trades))
+    expected = [r for r in full.get_realized_gains() if r["sale_date"][:4] == "2022"]
+
+    for workers in (1, 2):
+        streamed = []
+        m = TradeMatcher(sink=streamed.append, years={2022})
+        m.process_trades(copy.deepcopy(trades), workers=workers)
+        assert m.realized_pnl == []
+        assert streamed == expected
+        assert m.get_current_inventory() == full.get_current_inventory()
+
+
+def test_quote_sale_matches_a_real_sale_without_changing_state():
+    trades = _random_portfolio(13, tickers=4, events_per_ticker=80)
+    matcher = TradeMatcher()
+    matcher.process_trades(trades)
+    before = matcher.dump_state()
+
+    for ticker in matcher.inventory:
+        held = sum(lot.qty for lot in matcher.inventory[ticker])
+        if not held:
+            continue
+        qty = held / 3
+        quote = matcher.quote_sale(ticker, qty, Decimal("55.55"), Decimal("4.0123"))
+
+        seller = TradeMatcher.from_state(before)
+        seller.process_trades(
+            [
+                {
+                    "type": "SELL",
+                    "date": "2024-01-02",
+                    "ticker": ticker,
+                    "qty": -qty,
+                    "price": Decimal("55.55"),
+                    "commission": Decimal(0),
+                    "currency": "USD",
+                    "rate": Decimal("4.0123"),
+                }
+            ]
+        )
+        sale = seller.get_realized_gains()[-1]
+        assert float(quote["cost_basis_pln"]) == sale["cost_basis"]
+        assert float(quote["profit_pln"]) == sale["profit_loss"]
+        assert matcher.quote_sale(ticker)["quantity"] == held
+
+    assert matcher.dump_state() == before
+    with pytest.raises(ValueError):
+        matcher.quote_sale("T00", Decimal(10**6), Decimal(1), Decimal(1))
+
+
+def test_quote_sale_rejects_non_positive_quantities():
+    matcher = TradeMatcher()
+    matcher.process_trades(_random_portfolio(13, tickers=1, events_per_ticker=20))
+    before = matcher.dump_state()
+
+    for qty in (Decimal(0), Decimal(-5)):
+        with pytest.raises(ValueError):
+            matcher.quote_sale("T00", qty, Decimal(10), Decimal(4))
+    assert matcher.dump_state() == before
@@ -0,0 +1,81 @@
+# tests/test_fifo_differential.py
+
+import copy
+import os
+
+import pytest
+
+from src.fifo import TradeMatcher
+from tools.fifo_harness import (
+    ENGINES,
+    ReferenceMatcher,
+    compare,
+    generate_events,
+    run_scale,
+)
+
+# Opt-in: FIFO_SCALE_TEST=1 python -m pytest -s tests/test_fifo_differential.py
+SCALE_TEST = os.environ.get("FIFO_SCALE_TEST")
+
+
+def _reference(events):
+    reference = ReferenceMatcher()
+    reference.process_trades(copy.deepcopy(events))
+    return reference
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_engine_matches_reference_lot_by_lot(engine, seed):
+    events = generate_events(seed, 4000, tickers=8)
+    matcher = ENGINES[engine]()
+    matcher.process_trades(copy.deepcopy(events))
+
+    assert compare(_reference(events), matcher) > 0
+
+
+def test_parallel_and_lean_runs_match_reference():
+    events = generate_events(42, 3000, tickers=6)
+    reference = _reference(events)
+
+    parallel = TradeMatcher()
+    parallel.process_trades(copy.deepcopy(events), workers=2)
+    compare(reference, parallel)
+
+    lean = TradeMatcher(keep_lot_detail=False)
+    lean.process_trades(copy.deepcopy(events))
+    compare(reference, lean)
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_warm_start_from_snapshot_matches_reference(engine, tmp_path):
+    events = generate_events(7, 3000, tickers=6)
+    path = str(tmp_path / "fifo_state.json")
+
+    first = ENGINES[engine]()
+    first.process_trades(copy.deepcopy([e for e in events if e["date"] < "2020"]))
+    first.save_state(path)
+
+    resumed = ENGINES[engine].load_state(path)
+    resumed.process_trades(copy.deepcopy([e for e in events if e["date"] >= "2020"]))
+
+    reference = _reference(events)
+    reference.realized_pnl = [
+        r for r in reference.realized_pnl if r["sale_date"] >= "2019"
+    ]
+    compare(reference, resumed)
+
+
+@pytest.mark.skipif(not SCALE_TEST, reason="set FIFO_SCALE_TEST=1 to run")
+@pytest.mark.parametrize("n_events", [100_000, 1_000_000])
+@pytest.mark.parametrize("engine", ["standard", "vector"])
+def test_scale_run_matches_reference(engine, n_events, capsys):
+    matcher, rate, peak = run_scale(engine, n_events)
+    events = generate_events(0, n_events, tickers=max(20, n_events // 5000))
+    sales = compare(_reference(events), matcher)
+
+    with capsys.disabled():
+        print(
+            f"\n{engine} {n_events:,} events: {rate:,.0f} events/s, "
+            f"peak {peak:.1f} MB, {sales:,} sales identical"
+        )
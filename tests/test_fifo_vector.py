@@ -0,0 +1,114 @@
+# tests/test_fifo_vector.py
+
+import copy
+import random
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from src.fifo import TradeMatcher
+from src.fifo_vector import VectorTradeMatcher, match_arrays, match_cuts
+from tests.test_fifo import _random_portfolio
+
+
+def _buy_sell_history(seed, tickers=5, events_per_ticker=200):
+    """Plain buys, sells and transfers with fractional quantities, no oversells."""
+    rng = random.Random(seed)
+    trades = []
+    for t in range(tickers):
+        held = Decimal(0)
+        for i in range(events_per_ticker):
+            year, month = divmod(i * 48 // events_per_ticker, 12)
+            date = f"{2020 + year}-{1 + month:02d}-15"
+            if held > 0 and rng.random() < 0.35:
+                qty = -min(held, Decimal(rng.randint(1, 4000)) / 1000)
+                t_type = "SELL" if rng.random() < 0.9 else "TRANSFER"
+            else:
+                qty = Decimal(rng.randint(1, 3000)) / 1000
+                t_type = "BUY" if rng.random() < 0.9 else "TRANSFER"
+            held += qty
+            trades.append(
+                {
+                    "type": t_type,
+                    "date": date,
+                    "ticker": f"V{t}",
+                    "qty": qty,
+                    "price": Decimal(rng.randint(1000, 90000)) / 100,
+                    "commission": Decimal(rng.randint(0, 200)) / 100,
+                    "currency": "USD",
+                    "rate": Decimal("3.5") + Decimal(rng.randint(0, 9000)) / 10000,
+                }
+            )
+    return trades
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vector_matcher_is_identical_to_trade_matcher(seed):
+    trades = _buy_sell_history(seed)
+    # Mix in tickers with corporate actions, which take the regular path
+    trades += _random_portfolio(seed, tickers=2)
+
+    expected = TradeMatcher()
+    expected.process_trades(copy.deepcopy(trades))
+    vector = VectorTradeMatcher()
+    vector.process_trades(copy.deepcopy(trades))
+
+    assert vector.get_realized_gains() == expected.get_realized_gains()
+    assert vector.get_current_inventory() == expected.get_current_inventory()
+    assert list(vector.inventory) == list(expected.inventory)
+
+
+def test_vector_matcher_warm_start_and_year_window():
+    trades = _buy_sell_history(7)
+    old = [t for t in trades if t["date"] < "2022-01-01"]
+    new = [t for t in trades if t["date"] >= "2022-01-01"]
+
+    expected = TradeMatcher(years={2022})
+    vector = VectorTradeMatcher(years={2022})
+    for batch in (old, new):
+        expected.process_trades(copy.deepcopy(batch))
+        vector.process_trades(copy.deepcopy(batch))
+
+    assert vector.get_realized_gains() == expected.get_realized_gains()
+    assert vector.get_current_inventory() == expected.get_current_inventory()
+
+
+def test_match_cuts_rejects_what_cumulative_matching_cannot_express():
+    # Lots 5 and 5; sales 3 then 4: cuts inside lot 0, then inside lot 1
+    cut, first, interior, _ = match_cuts([5, 5], [3, 4], [2, 2])
+    assert cut.tolist() == [0, 1]
+    assert first.tolist() == [0, 0]
+    assert interior.tolist() == [True, True]
+
+    # Sale before the second lot exists exceeds the holdings
+    assert match_cuts([5, 5], [7], [1]) is None
+    # One unit (1e-8 shares) left in the lot: LotQueue consumes it whole
+    assert match_cuts([5, 5], [4], [2]) is None
+
+
+def test_match_arrays_tracks_the_decimal_engine():
+    trades = [t for t in _buy_sell_history(3, tickers=1) if t["type"] != "TRANSFER"]
+    trades.sort(key=lambda t: (t["date"], t["qty"] < 0))
+    matcher = TradeMatcher()
+    matcher.process_trades(copy.deepcopy(trades))
+    gains = matcher.get_realized_gains()
+
+    result = match_arrays(
+        *(
+            [float(t[key]) for t in trades]
+            for key in ("qty", "price", "rate", "commission")
+        )
+    )
+
+    assert len(result["index"]) == len(gains)
+    np.testing.assert_allclose(
+        result["revenue_pln"], [g["sale_amount"] for g in gains], atol=0.005
+    )
+    # Pro-rata costing may differ from per-partial rounding by grosze
+    np.testing.assert_allclose(
+        result["cost_basis_pln"], [g["cost_basis"] for g in gains], atol=0.03
+    )
+
+    with pytest.raises(ValueError):
+        match_arrays([1, -2], [10, 10], [4, 4], [0, 0])
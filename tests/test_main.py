@@ -0,0 +1,147 @@
+# tests/test_main.py
+
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+
+import main
+from main import load_fifo_state
+from src.db_connector import DBConnector
+from src.fifo import TradeMatcher
+from src.progress import reporter
+
+
+@pytest.fixture(autouse=True)
+def console_subscribers():
+    """main() subscribes a ConsoleRenderer on this test's stdout: drop it after."""
+    with patch.object(reporter, "_subscribers", []):
+        yield
+
+
+def _row(date, ticker="AAPL", trade_id=1):
+    return {
+        "TradeId": trade_id,
+        "Date": date,
+        "EventType": "BUY",
+        "Ticker": ticker,
+        "Quantity": 1.0,
+        "Price": 10.0,
+        "Currency": "PLN",
+        "Amount": 0.0,
+        "Fee": 0.0,
+        "Description": "",
+    }
+
+
+def _save_rows(db_path, rows):
+    with DBConnector(db_path) as db:
+        db.initialize_schema()
+        for date, t_type, ticker, qty, price, amount, desc in rows:
+            db.save_transaction(
+                {
+                    "date": date,
+                    "type": t_type,
+                    "ticker": ticker,
+                    "qty": qty,
+                    "price": price,
+                    "currency": "PLN",
+                    "amount": amount,
+                    "fee": 0.0,
+                    "desc": desc,
+                }
+            )
+
+
+def test_fifo_state_is_stale_only_if_rows_up_to_as_of_change(tmp_path):
+    path = str(tmp_path / "fifo_state.json")
+    rows = [_row("2023-05-02")]
+    matcher = TradeMatcher()
+    matcher.process_trades(
+        [
+            {
+                "type": "BUY",
+                "date": "2023-05-02",
+                "ticker": "AAPL",
+                "qty": Decimal(1),
+                "price": Decimal(10),
+                "commission": Decimal(0),
+                "currency": "PLN",
+                "rate": Decimal(1),
+            }
+        ]
+    )
+    history = main.history_digest(rows, matcher.as_of)
+    matcher.save_state(path, meta={"ticker": None, "history": history})
+
+    assert load_fifo_state(path, rows, 2024, None).as_of == "2023-05-02"
+    # A re-import renumbers the rows and appends newer ones: still valid
+    reimported = [_row("2023-05-02", trade_id=7), _row("2023-06-01", trade_id=8)]
+    assert load_fifo_state(path, reimported, 2024, None) is not None
+    # An edit at or before as_of keeps the row count but changes the content
+    assert load_fifo_state(path, [_row("2023-05-02", "MSFT")], 2024, None) is None
+    assert load_fifo_state(path, [_row("2023-01-02")] + rows, 2024, None) is None
+    assert load_fifo_state(path, rows, 2024, "AAPL") is None
+    assert load_fifo_state(path, rows, 2022, None) is None
+
+
+def test_fifo_state_warm_starts_after_rows_are_appended(tmp_path, capsys):
+    db_path = str(tmp_path / "history.db")
+    state_path = str(tmp_path / "fifo_state.json")
+    argv = ["main.py", "--no-cache", "--fifo-state", state_path, "--target-year"]
+    with patch("src.db_connector.DB_KEY", "test_key"), patch(
+        "src.db_connector.DB_PATH", db_path
+    ), patch("src.result_cache.CACHE_PATH", str(tmp_path / "cache.db")), patch(
+        "main.report_year"
+    ):
+        _save_rows(
+            db_path,
+            [
+                ("2022-03-01", "BUY", "AAPL", 10, 20.0, 0, ""),
+                ("2022-12-27", "SELL", "AAPL", -4, 25.0, 0, ""),
+            ],
+        )
+        with patch("sys.argv", argv + ["2022"]):
+            main.main()
+        _save_rows(db_path, [("2023-12-30", "BUY", "AAPL", 1, 30.0, 0, "")])
+        capsys.readouterr()
+        with patch("sys.argv", argv + ["2023"]):
+            main.main()
+
+    out = capsys.readouterr().out
+    assert "Warm start from FIFO state as of 2022-12-27" in out
+    assert "is stale" not in out
+
+
+def test_ticker_filter_reports_only_the_requested_ticker_of_a_merged_pair(tmp_path):
+    merger = (
+        "ABC(US0000000001) Merged(Acquisition) WITH US0000000002 1 FOR 2 "
+        "(XYZ, XYZ CORP, US0000000002)"
+    )
+    rows = [
+        ("2020-03-02", "BUY", "ABC", 10, 20.0, 0, ""),
+        ("2021-02-01", "DIVIDEND", "ABC", 0, 0, 5.0, "ABC Cash Dividend"),
+        ("2021-06-01", "MERGER", "ABC", -10, 0, 0, merger),
+        ("2021-06-01", "MERGER", "XYZ", 5, 0, 0, merger),
+        ("2021-09-01", "SELL", "XYZ", -5, 50.0, 0, ""),
+        ("2021-10-01", "DIVIDEND", "XYZ", 0, 0, 3.0, "XYZ Cash Dividend"),
+    ]
+    db_path = str(tmp_path / "history.db")
+    with patch("src.db_connector.DB_KEY", "test_key"):
+        _save_rows(db_path, rows)
+
+        argv = ["main.py", "--ticker", "XYZ", "--years", "2021", "--no-cache"]
+        with patch("src.db_connector.DB_PATH", db_path), patch(
+            "src.result_cache.CACHE_PATH", str(tmp_path / "cache.db")
+        ), patch("sys.argv", argv), patch("main.report_year") as report_year:
+            main.main()
+
+    args, year, raw_trades, _, realized, dividends, inventory = (
+        report_year.call_args.args
+    )
+    assert year == 2021
+    # ABC is replayed for XYZ's history but none of its rows are reported
+    assert {t["Ticker"] for t in raw_trades} == {"XYZ"}
+    assert [r["ticker"] for r in realized] == ["XYZ"]
+    assert [d["ticker"] for d in dividends] == ["XYZ"]
+    assert inventory == []
@@ -2,15 +2,34 @@
 
 import pytest
 import requests
+import threading
+import time
 from decimal import Decimal
 from unittest.mock import patch, MagicMock
-from src.nbp import get_nbp_rate, _MONTHLY_CACHE
+from src.nbp import (
+    get_cached_nbp_rate,
+    get_nbp_rate,
+    preload_rates,
+    set_offline_mode,
+    set_fail_fast_mode,
+    NBPUnavailableError,
+    get_nbp_stats,
+    reset_nbp_stats,
+    _BREAKER,
+    _MONTHLY_CACHE,
+    MonthlyRateCache,
+)
 
 
 @pytest.fixture(autouse=True)
 def clear_cache():
     # Clear cache before every test to ensure isolation
     _MONTHLY_CACHE.clear()
+    _BREAKER.reset()
+    reset_nbp_stats()
+    yield
+    set_offline_mode(False)
+    set_fail_fast_mode(False)
 
 
 @patch("src.nbp.requests.get")
@@ -55,3 +74,175 @@ def test_weekend_lookback(mock_get):
 
 def test_pln_is_always_one():
     assert get_nbp_rate("PLN", "2025-01-01") == Decimal("1.0")
+
+
+@patch("src.nbp.requests.get")
+def test_concurrent_lookups_share_one_fetch(mock_get):
+    # Slow response so that all threads miss the cache at the same time
+    def slow_response(*args, **kwargs):
+        time.sleep(0.05)
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = {
+            "rates": [{"effectiveDate": "2025-01-02", "mid": 4.10}]
+        }
+        return response
+
+    mock_get.side_effect = slow_response
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(get_nbp_rate("USD", "2025-01-03"))
+        )
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [Decimal("4.10")] * 8
+    assert mock_get.call_count == 1  # Single-flight: one HTTP request for all threads
+
+
+def test_cache_evicts_only_unpinned_entries():
+    cache = MonthlyRateCache(max_entries=2)
+    cache.put(("USD", 2020, 1), {"2020-01-02": Decimal("3.8")}, pinned=True)
+    cache.put(("USD", 2024, 1), {})
+    cache.put(("USD", 2024, 2), {})
+    cache.put(("USD", 2024, 3), {})
+
+    assert ("USD", 2020, 1) in cache  # Pinned entry survives
+    assert ("USD", 2024, 1) not in cache  # Least recently used is evicted
+    assert ("USD", 2024, 3) in cache
+    assert len(cache) == 3
+
+
+def test_failed_fetch_is_not_cached():
+    cache = MonthlyRateCache()
+    assert cache.get_or_fetch(("USD", 2024, 1), lambda: None) is None
+    assert ("USD", 2024, 1) not in cache
+
+
+@patch("src.nbp.requests.get")
+def test_offline_mode_uses_preloaded_rates_only(mock_get):
+    set_offline_mode(True)
+    preload_rates(
+        [
+            ("USD", "2024-12-30", Decimal("4.1")),
+            ("USD", "2024-12-31", Decimal("4.1012")),
+        ]
+    )
+
+    assert get_nbp_rate("USD", "2025-01-02") == Decimal("4.1012")
+    # Missing currency: falls back without touching the network
+    assert get_nbp_rate("EUR", "2025-01-02") == Decimal("1.0")
+    mock_get.assert_not_called()
+
+
+@patch("src.nbp.requests.get")
+def test_cached_rate_never_fetches(mock_get):
+    _MONTHLY_CACHE.put(("USD", 2024, 12), {"2024-12-27": Decimal("4.1012")})
+
+    assert get_cached_nbp_rate("USD", "2024-12-30") == Decimal("4.1012")
+    # The lookback stops at a month that is not in the cache
+    assert get_cached_nbp_rate("USD", "2025-01-02") is None
+    assert get_cached_nbp_rate("EUR", "2025-01-02") is None
+    assert get_cached_nbp_rate("PLN", "2025-01-02") == Decimal("1.0")
+    mock_get.assert_not_called()
+
+
+@patch("src.nbp.requests.get")
+def test_online_preload_skips_trailing_incomplete_month(mock_get):
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {
+        "rates": [{"effectiveDate": "2024-02-14", "mid": 4.05}]
+    }
+    mock_get.return_value = mock_response
+
+    loaded = preload_rates(
+        [
+            ("USD", "2024-01-31", Decimal("4.00")),
+            ("USD", "2024-02-13", Decimal("4.02")),
+        ]
+    )
+
+    assert loaded == 1  # Only January is complete
+    assert get_nbp_rate("USD", "2024-02-01") == Decimal("4.00")
+    assert mock_get.call_count == 0
+    # February is fetched online rather than served from the partial bundle
+    assert get_nbp_rate("USD", "2024-02-15") == Decimal("4.05")
+    assert mock_get.call_count == 1
+
+
+@patch("src.nbp.requests.get")
+def test_failed_month_is_negatively_cached(mock_get):
+    mock_get.side_effect = requests.ConnectionError("network down")
+
+    # Lookback walks 10 days of the same month: only the first one hits the network
+    assert get_nbp_rate("USD", "2025-01-20") == Decimal("1.0")
+    assert mock_get.call_count == 1
+
+    assert get_nbp_rate("USD", "2025-01-21") == Decimal("1.0")
+    assert mock_get.call_count == 1
+
+
+@patch("src.nbp.requests.get")
+def test_circuit_breaker_stops_requests_after_threshold(mock_get):
+    mock_get.side_effect = requests.Timeout("timed out")
+
+    for month in range(2, 12):
+        get_nbp_rate("USD", f"2024-{month:02d}-15")
+
+    assert mock_get.call_count == _BREAKER.threshold
+    assert _BREAKER.is_open
+
+
+@patch("src.nbp.requests.get")
+def test_server_errors_count_as_failures(mock_get):
+    mock_response = MagicMock()
+    mock_response.status_code = 503
+    mock_get.return_value = mock_response
+
+    assert get_nbp_rate("USD", "2024-03-15") == Decimal("1.0")
+    assert ("USD", 2024, 3) not in _MONTHLY_CACHE
+
+
+@patch("src.nbp.requests.get")
+def test_fail_fast_raises_clear_error(mock_get):
+    mock_get.side_effect = requests.ConnectionError("network down")
+    set_fail_fast_mode(True)
+
+    with pytest.raises(NBPUnavailableError):
+        for month in range(1, 13):
+            get_nbp_rate("USD", f"2023-{month:02d}-15")
+
+    assert mock_get.call_count == _BREAKER.threshold
+
+
+@patch("src.nbp.requests.get")
+def test_stats_count_hits_misses_lookback_and_fallbacks(mock_get):
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.content = b"x" * 100
+    mock_response.json.return_value = {
+        "rates": [{"effectiveDate": "2025-01-03", "mid": 4.20}]
+    }
+    mock_get.return_value = mock_response
+
+    get_nbp_rate("USD", "2025-01-04")  # Found at T-1
+    get_nbp_rate("USD", "2025-01-06")  # Mon -> Sun, Sat, Fri: depth 2
+    set_offline_mode(True)
+    get_nbp_rate("EUR", "2025-01-06")  # Nothing offline: fallback
+
+    stats = get_nbp_stats()
+    assert stats["lookups"] == 3
+    assert stats["fallbacks"] == 1
+    assert stats["http_requests"] == 1
+    assert stats["bytes_received"] == 100
+    assert stats["cache_misses"] == 1
+    assert stats["cache_hits"] == 3
+    assert stats["lookback_histogram"] == {0: 1, 2: 1}
+    assert sum(stats["latency_histogram"].values()) == 1
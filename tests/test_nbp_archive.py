@@ -0,0 +1,78 @@
+# tests/test_nbp_archive.py
+
+import pytest
+from decimal import Decimal
+from src.nbp_archive import parse_archive_file
+
+ARCHIVE_CSV = (
+    "data;1USD;100JPY;1EUR;nr tabeli;pełny numer tabeli\n"
+    ";dolar amerykański;jen (Japonia);euro;;\n"
+    "20240102;3,9432;2,7850;4,3434;1;001/A/NBP/2024\n"
+    "20240103;3,9909;2,7987;4,3646;2;002/A/NBP/2024\n"
+    "kod ISO;USD;JPY;EUR;;\n"
+)
+
+API_XML = """<?xml version="1.0" encoding="utf-8"?>
+<ArrayOfExchangeRatesTable>
+  <ExchangeRatesTable>
+    <Table>A</Table>
+    <No>001/A/NBP/2024</No>
+    <EffectiveDate>2024-01-02</EffectiveDate>
+    <Rates>
+      <Rate><Currency>dolar amerykański</Currency><Code>USD</Code><Mid>3.9432</Mid></Rate>
+      <Rate><Currency>euro</Currency><Code>EUR</Code><Mid>4.3434</Mid></Rate>
+    </Rates>
+  </ExchangeRatesTable>
+</ArrayOfExchangeRatesTable>
+"""
+
+DAILY_XML = """<?xml version="1.0" encoding="ISO-8859-2"?>
+<tabela_kursow typ="A">
+  <numer_tabeli>001/A/NBP/2024</numer_tabeli>
+  <data_publikacji>2024-01-02</data_publikacji>
+  <pozycja>
+    <nazwa_waluty>jen (Japonia)</nazwa_waluty>
+    <przelicznik>100</przelicznik>
+    <kod_waluty>JPY</kod_waluty>
+    <kurs_sredni>2,7850</kurs_sredni>
+  </pozycja>
+</tabela_kursow>
+"""
+
+
+def test_parse_yearly_csv_archive(tmp_path):
+    path = tmp_path / "archiwum_tab_a_2024.csv"
+    path.write_text(ARCHIVE_CSV, encoding="cp1250")
+
+    rows = parse_archive_file(str(path))
+
+    assert len(rows) == 6
+    assert ("USD", "2024-01-02", Decimal("3.9432")) in rows
+    # Rates quoted per 100 units are normalized to a single unit
+    assert ("JPY", "2024-01-03", Decimal("0.027987")) in rows
+
+
+def test_parse_api_xml(tmp_path):
+    path = tmp_path / "tables_2024.xml"
+    path.write_text(API_XML, encoding="utf-8")
+
+    rows = parse_archive_file(str(path))
+
+    assert rows == [
+        ("USD", "2024-01-02", Decimal("3.9432")),
+        ("EUR", "2024-01-02", Decimal("4.3434")),
+    ]
+
+
+def test_parse_daily_archive_xml(tmp_path):
+    path = tmp_path / "a001z240102.xml"
+    path.write_bytes(DAILY_XML.encode("iso-8859-2"))
+
+    assert parse_archive_file(str(path)) == [("JPY", "2024-01-02", Decimal("0.02785"))]
+
+
+def test_unsupported_extension(tmp_path):
+    path = tmp_path / "rates.json"
+    path.write_text("{}")
+    with pytest.raises(ValueError):
+        parse_archive_file(str(path))
@@ -0,0 +1,87 @@
+# tests/test_nbp_stub.py
+
+import threading
+import pytest
+from decimal import Decimal
+from src import nbp
+from tools.nbp_stub_server import NBPStubServer, generate_fixture_rates
+
+RATES = {
+    "USD": {
+        "2024-12-30": 4.1,
+        "2024-12-31": 4.1012,
+        "2025-01-02": 4.1219,
+        "2025-01-03": 4.1512,
+    }
+}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    nbp._MONTHLY_CACHE.clear()
+    nbp._BREAKER.reset()
+    with NBPStubServer(rates=RATES) as server:
+        monkeypatch.setattr(nbp, "API_URL", server.base_url)
+        yield server
+    nbp._MONTHLY_CACHE.clear()
+    nbp._BREAKER.reset()
+
+
+def test_rates_served_over_http(stub):
+    assert nbp.get_nbp_rate("USD", "2025-01-03") == Decimal("4.1219")
+    # Jan 2025 is fetched once, then served from the cache
+    assert nbp.get_nbp_rate("USD", "2025-01-04") == Decimal("4.1512")
+    assert stub.request_count == 1
+
+
+def test_holiday_range_returns_404_and_lookback_crosses_month(stub):
+    # T-1 = Jan 1st (holiday): lookback reaches Dec 31st of the previous month
+    assert nbp.get_nbp_rate("USD", "2025-01-02") == Decimal("4.1012")
+    assert stub.status_counts == {200: 2}
+
+    # A month with no quotations at all answers 404, like api.nbp.pl
+    assert nbp.fetch_month_rates("USD", 2023, 6) == {}
+    assert stub.status_counts[404] == 1
+
+
+def test_injected_errors_trip_circuit_breaker(stub):
+    stub.inject_errors(10, status=500)
+
+    for month in range(1, 13):
+        nbp.get_nbp_rate("USD", f"2022-{month:02d}-15")
+
+    assert stub.request_count == nbp._BREAKER.threshold
+    assert nbp._BREAKER.is_open
+
+
+def test_dropped_connection_is_a_network_failure(stub):
+    stub.inject_errors(1, status=None)
+
+    assert nbp.fetch_month_rates("USD", 2025, 1) is None
+    assert ("USD", 2025, 1) not in nbp._MONTHLY_CACHE
+
+
+def test_concurrent_clients_single_flight_over_http(monkeypatch):
+    nbp._MONTHLY_CACHE.clear()
+    with NBPStubServer(rates=RATES, latency=0.05) as server:
+        monkeypatch.setattr(nbp, "API_URL", server.base_url)
+        threads = [
+            threading.Thread(target=nbp.get_nbp_rate, args=("USD", "2025-01-03"))
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert server.request_count == 1
+    nbp._MONTHLY_CACHE.clear()
+
+
+def test_fixture_generator_skips_weekends_and_holidays():
+    rates = generate_fixture_rates(("USD",), "2024-12-23", "2024-12-31")
+    assert sorted(rates["USD"]) == [
+        "2024-12-23",
+        "2024-12-27",
+        "2024-12-30",
+        "2024-12-31",
+    ]
@@ -1,7 +1,22 @@
+import random
+
 import pytest
 from decimal import Decimal
 from unittest.mock import patch
-from src.processing import process_yearly_data
+from src.fifo import TradeMatcher
+from src.fifo_vector import VectorTradeMatcher
+from src.nbp import NBPUnavailableError
+from src.processing import (
+    STAGES,
+    get_stage_timings,
+    load_rows,
+    normalize_rows,
+    process_multi_year_data,
+    process_ticker_groups,
+    process_yearly_data,
+    resolve_rates,
+    route_events,
+)
 
 
 @pytest.fixture
@@ -65,3 +80,255 @@ def test_processing_flow(mock_rate, mock_trades_db):
     # 2. Check Inventory
     assert len(inventory) == 1
     assert inventory[0]["ticker"] == "AAPL"
+
+
+@patch("src.processing.get_nbp_rate")
+def test_processing_aborts_when_nbp_unavailable(mock_rate, mock_trades_db):
+    mock_rate.side_effect = NBPUnavailableError("NBP API unreachable")
+
+    with pytest.raises(NBPUnavailableError):
+        process_yearly_data(mock_trades_db, 2025)
+
+
+@patch("src.processing.get_nbp_rate")
+def test_tax_before_dividend_is_matched(mock_rate, mock_trades_db):
+    mock_rate.return_value = Decimal("4.0")
+    # DB order puts the tax first on that date
+    dividend, tax = mock_trades_db[0], mock_trades_db[1]
+    rows = [
+        dict(tax, TradeId=1, Ticker="META"),
+        dict(dividend, TradeId=2, Ticker="META"),
+        dict(dividend, TradeId=3, Ticker="AAPL"),
+        dict(tax, TradeId=4, Ticker="AAPL", Amount=-0.5),
+    ]
+
+    dividend_rows = []
+    events = list(route_events(normalize_rows(rows), [2025], dividend_rows))
+    dividends = resolve_rates(events, dividend_rows, TradeMatcher(years=[2025]))
+
+    assert events == []
+    assert [(d["ticker"], d["tax_withheld_pln"]) for d in dividends] == [
+        ("META", 6.0),
+        ("AAPL", 2.0),
+    ]
+    # No NBP lookups for TAX rows
+    assert mock_rate.call_count == 2
+
+
+def test_load_rows_sorts_only_out_of_order_input(mock_trades_db):
+    assert list(load_rows(mock_trades_db)) == mock_trades_db
+
+    shuffled = [mock_trades_db[2], mock_trades_db[0], mock_trades_db[1]]
+    assert list(load_rows(shuffled)) == mock_trades_db
+
+
+def test_route_events_orders_same_day_events_and_skips_resumed_dates(
+    mock_trades_db,
+):
+    buy = dict(mock_trades_db[2], Currency="PLN")
+    rows = [
+        dict(buy, TradeId=1, Date="2025-01-04"),
+        dict(buy, TradeId=2, EventType="SELL", Quantity=-1),
+        dict(buy, TradeId=3),
+        dict(buy, TradeId=4, EventType="SPLIT", Quantity=0),
+    ]
+
+    events = list(route_events(normalize_rows(rows), [2025], []))
+    assert [e["type"] for e in events] == ["BUY", "SPLIT", "BUY", "SELL"]
+    assert events[1]["ratio"] == Decimal("1")
+    assert events[3]["qty"] == Decimal(-1)
+
+    resumed = route_events(normalize_rows(rows), [2025], [], resume_after="2025-01-04")
+    assert [e["date"] for e in resumed] == ["2025-01-05"] * 3
+
+
+@patch("src.processing.get_nbp_rate")
+def test_stage_timings_cover_every_stage(mock_rate, mock_trades_db):
+    mock_rate.return_value = Decimal("4.0")
+
+    process_yearly_data(mock_trades_db, 2025)
+
+    timings = get_stage_timings()
+    assert set(timings) == set(STAGES)
+    assert all(t >= 0 for t in timings.values())
+
+
+@patch("src.processing.get_nbp_rate")
+def test_multi_year_run_matches_separate_yearly_runs(mock_rate):
+    mock_rate.side_effect = lambda currency, date: Decimal(f"4.{date[3]}")
+    rng = random.Random(7)
+    rows = []
+    held = {"AAA": 0, "BBB": 0}
+    for i in range(300):
+        date = f"{2020 + i // 100}-{1 + i % 100 // 9:02d}-{1 + i % 9:02d}"
+        ticker = rng.choice(sorted(held))
+        row = {
+            "TradeId": i,
+            "Date": date,
+            "Ticker": ticker,
+            "Price": float(rng.randint(100, 9000)) / 100,
+            "Fee": -1.0,
+            "Currency": "USD",
+        }
+        if held[ticker] and rng.random() < 0.4:
+            qty = -rng.randint(1, held[ticker])
+            row.update(EventType="SELL", Quantity=float(qty), Amount=0)
+        elif rng.random() < 0.2:
+            qty = 0
+            row.update(EventType="DIVIDEND", Quantity=0, Amount=1.25)
+        else:
+            qty = rng.randint(1, 50)
+            row.update(EventType="BUY", Quantity=float(qty), Amount=0)
+        held[ticker] += qty
+        rows.append(row)
+
+    results = process_multi_year_data(rows, [2020, 2021, 2022])
+
+    for year in (2020, 2021, 2022):
+        upto = [r for r in rows if r["Date"] <= f"{year}-12-31"]
+        assert results[year] == process_yearly_data(upto, year)
+    assert results[2021][0] and results[2021][1] and results[2021][2]
+
+    # Low-memory mode: one ticker at a time, same records
+    groups = [[r for r in rows if r["Ticker"] == t] for t in ("AAA", "BBB")]
+    grouped = process_ticker_groups(iter(groups), [2020, 2021, 2022])
+    for year in (2020, 2021, 2022):
+        for merged, single in zip(grouped[year], results[year]):
+            key = lambda record: record["ticker"]  # noqa: E731
+            assert sorted(merged, key=key) == sorted(single, key=key)
+
+    # The vector engine, whole history and per group: same records
+    assert process_multi_year_data(rows, [2021], matcher=VectorTradeMatcher()) == {
+        2021: results[2021]
+    }
+    vector = process_ticker_groups(iter(groups), [2021], engine=VectorTradeMatcher)
+    assert vector == {2021: grouped[2021]}
+
+
+@patch("src.processing.get_cached_nbp_rate", return_value=None)
+@patch("src.processing.get_nbp_rate")
+def test_rates_are_fetched_only_where_they_reach_the_report(mock_rate, _cached):
+    mock_rate.side_effect = lambda currency, date: Decimal(f"4.{date[3]}")
+
+    def row(trade_id, date, event_type, qty, price=10.0, amount=0.0):
+        return {
+            "TradeId": trade_id,
+            "Date": date,
+            "EventType": event_type,
+            "Ticker": "AAPL",
+            "Quantity": qty,
+            "Price": price,
+            "Amount": amount,
+            "Fee": -1.0,
+            "Currency": "USD",
+        }
+
+    rows = [
+        row(1, "2020-03-02", "BUY", 5.0),  # sold out in 2021
+        row(2, "2021-03-02", "BUY", 5.0),  # partly held into 2024
+        row(3, "2021-06-01", "SELL", -7.0),
+        row(4, "2021-07-01", "DIVIDEND", 0, 0, 3.0),
+        row(5, "2024-02-01", "SELL", -2.0, 20.0),
+        row(6, "2024-03-01", "BUY", 4.0),
+    ]
+
+    realized, dividends, inventory = process_yearly_data(rows, 2024)
+
+    fetched = sorted(call.args[1] for call in mock_rate.call_args_list)
+    assert fetched == ["2021-03-02", "2024-02-01", "2024-03-01"]
+    # 2021 lot: 209.10 PLN, 83.64 sold in 2021; 2/3 of the rest + commission
+    assert realized[0]["cost_basis"] == 83.64 + 4.40
+    assert dividends == []
+    assert [lot["buy_date"] for lot in inventory] == ["2021-03-02", "2024-03-01"]
+
+
+@patch("src.processing.get_nbp_rate")
+def test_late_withholding_adjustments_are_matched_within_window(
+    mock_rate, mock_trades_db
+):
+    mock_rate.return_value = Decimal("4.0")
+    dividend, tax = mock_trades_db[0], mock_trades_db[1]
+    rows = [
+        dict(dividend, TradeId=1, Date="2024-12-30"),
+        # Tax of the 2024 dividend, posted the next day
+        dict(tax, TradeId=2, Date="2024-12-31", Amount=-3.0),
+        dict(dividend, TradeId=3, Date="2025-01-02"),
+        dict(tax, TradeId=4, Date="2025-01-02"),
+        # Reversal and re-accrual of the 2025 dividend's tax a week later
+        dict(tax, TradeId=5, Date="2025-01-09", Amount=1.5),
+        dict(tax, TradeId=6, Date="2025-01-09", Amount=-1.0),
+    ]
+
+    _, dividends, _ = process_yearly_data(rows, 2025, tax_window=10)
+    assert [d["tax_withheld_pln"] for d in dividends] == [4.0]
+
+    # Exact-date matching only: the adjustments are left out
+    _, dividends, _ = process_yearly_data(rows, 2025, tax_window=0)
+    assert [d["tax_withheld_pln"] for d in dividends] == [6.0]
+
+
+@patch("src.processing.get_cached_nbp_rate", return_value=None)
+@patch("src.processing.get_nbp_rate")
+def test_closed_ticker_needs_no_rates_unless_a_snapshot_is_saved(mock_rate, _cached):
+    mock_rate.return_value = Decimal("4.0")
+    rows = [
+        {
+            "TradeId": i,
+            "Date": date,
+            "EventType": event_type,
+            "Ticker": "AAPL",
+            "Quantity": qty,
+            "Price": 10.0,
+            "Amount": 0.0,
+            "Fee": -1.0,
+            "Currency": "USD",
+        }
+        for i, (date, event_type, qty) in enumerate(
+            [("2017-03-02", "BUY", 5.0), ("2018-06-01", "SELL", -5.0)], start=1
+        )
+    ]
+
+    results = process_multi_year_data(rows, [2023])
+    assert results == {2023: ([], [], [])}
+    assert mock_rate.call_count == 0
+
+    # A snapshot keeps its as_of year's sales, so they are converted
+    matcher = TradeMatcher()
+    process_multi_year_data(rows, [2023], matcher=matcher, snapshot=True)
+    assert matcher.years == {2018, 2023}
+    assert [r["sale_date"] for r in matcher.get_realized_gains()] == ["2018-06-01"]
+
+
+@patch("src.processing.get_nbp_rate")
+def test_ticker_groups_keep_db_order_of_same_day_sales_and_dividends(mock_rate):
+    mock_rate.return_value = Decimal("4.0")
+
+    def row(trade_id, date, event_type, ticker, qty, amount=0.0):
+        return {
+            "TradeId": trade_id,
+            "Date": date,
+            "EventType": event_type,
+            "Ticker": ticker,
+            "Quantity": qty,
+            "Price": 10.0,
+            "Amount": amount,
+            "Fee": -1.0,
+            "Currency": "USD",
+        }
+
+    # Same-day rows of BBB come before those of AAA in the DB
+    rows = [
+        row(1, "2024-01-02", "BUY", "BBB", 5.0),
+        row(2, "2024-01-02", "BUY", "AAA", 5.0),
+        row(3, "2024-03-01", "SELL", "BBB", -5.0),
+        row(4, "2024-03-01", "SELL", "AAA", -5.0),
+        row(5, "2024-04-01", "DIVIDEND", "BBB", 0, 2.0),
+        row(6, "2024-04-01", "DIVIDEND", "AAA", 0, 1.0),
+    ]
+    single = process_multi_year_data(rows, [2024])
+    groups = [[r for r in rows if r["Ticker"] == t] for t in ("AAA", "BBB")]
+    grouped = process_ticker_groups(iter(groups), [2024])
+
+    assert grouped == single
+    assert [r["ticker"] for r in grouped[2024][0]] == ["BBB", "AAA"]
+    assert [d["ticker"] for d in grouped[2024][1]] == ["BBB", "AAA"]
@@ -0,0 +1,44 @@
+# tests/test_profiling.py
+
+import json
+import pstats
+
+from src.profiling import Profiler
+
+
+def test_stages_record_time_and_nested_peak_memory(tmp_path):
+    profiler = Profiler(enabled=True, pstats_path=str(tmp_path / "run.pstats"))
+    profiler.start()
+    with profiler.stage("outer"):
+        with profiler.stage("inner", year=2024):
+            block = bytearray(5 * 10**6)
+        del block
+        with profiler.stage("small"):
+            sum(range(1000))
+    profiler.finish()
+
+    outer, inner, small = profiler.stages
+    assert [s["depth"] for s in profiler.stages] == [0, 1, 1]
+    assert inner["year"] == 2024
+    assert inner["peak"] >= 5 * 10**6
+    assert outer["peak"] >= inner["peak"] > small["peak"]
+    assert all(s["wall_s"] >= 0 and s["cpu_s"] >= 0 for s in profiler.stages)
+    assert profiler.total["wall_s"] >= outer["wall_s"]
+
+    path = tmp_path / "report.json"
+    profiler.write_json(str(path), pipeline={"match": 0.5})
+    report = json.loads(path.read_text())
+    assert [s["name"] for s in report["stages"]] == ["outer", "inner", "small"]
+    assert report["stages"][1]["peak_mb"] >= 5
+    assert report["pipeline"] == {"match": 0.5}
+    assert pstats.Stats(str(tmp_path / "run.pstats")).total_calls > 0
+    assert profiler.format_lines()[2].startswith("  inner (2024)")
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler()
+    profiler.start()
+    with profiler.stage("db"):
+        pass
+    profiler.finish()
+    assert profiler.stages == [] and profiler.total == {}
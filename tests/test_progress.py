@@ -0,0 +1,160 @@
+# tests/test_progress.py
+
+import io
+from decimal import Decimal
+from unittest.mock import patch
+
+from src.parser import save_to_database
+from src.processing import process_yearly_data
+from src.progress import (
+    DEBUG,
+    ERROR,
+    INFO,
+    MESSAGE,
+    PROGRESS,
+    STAGE_END,
+    STAGE_START,
+    WARNING,
+    ConsoleRenderer,
+    Reporter,
+    reporter,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_progress_is_rate_limited_and_estimates_eta():
+    clock = FakeClock()
+    rep = Reporter(min_interval=1.0, clock=clock)
+    events = []
+    rep.subscribe(events.append)
+
+    with rep.stage("import", total=100):
+        for done in range(1, 101):
+            clock.now = done * 0.1
+            rep.progress(done)
+
+    kinds = [e.kind for e in events]
+    assert kinds[0] == STAGE_START and kinds[-1] == STAGE_END
+    updates = [e for e in events if e.kind == PROGRESS]
+    # 10 s of work, one update per second
+    assert len(updates) == 10
+    assert updates[0].done == 10 and updates[0].eta == 9.0
+    assert events[-1].done == 100 and events[-1].elapsed == 10.0
+
+
+def test_repeated_messages_are_counted_and_summarized():
+    rep = Reporter(repeat_limit=2)
+    events = []
+    unsubscribe = rep.subscribe(events.append)
+
+    with rep.stage("rates"):
+        for i in range(5):
+            rep.message(WARNING, f"fallback {i}", key="fallback")
+        rep.message(ERROR, "other")
+        assert rep.counts() == {"fallback": 5}
+
+    texts = [e.text for e in events if e.kind == MESSAGE]
+    assert texts == [
+        "fallback 0",
+        "fallback 1",
+        "other",
+        "... 3 more like this (5 in total).",
+    ]
+    assert rep.counts() == {}
+
+    unsubscribe()
+    rep.message(WARNING, "after")
+    assert len([e for e in events if e.kind == MESSAGE]) == 4
+
+
+def test_without_subscribers_info_and_above_are_printed(capsys):
+    rep = Reporter()
+    rep.message(DEBUG, "quiet")
+    rep.message(INFO, "Data exported")
+    rep.message(WARNING, "loud")
+    assert capsys.readouterr().out == "Data exported\nWARNING: loud\n"
+
+
+def test_console_renderer_draws_progress_line_on_terminal():
+    stream = io.StringIO()
+    stream.isatty = lambda: True
+    clock = FakeClock()
+    rep = Reporter(min_interval=0, clock=clock)
+    rep.subscribe(ConsoleRenderer(stream=stream))
+
+    with rep.stage("import", total=4):
+        clock.now = 2.0
+        rep.progress(1)
+        assert stream.getvalue().endswith("import 1/4 25% ETA 6s")
+        rep.message(INFO, "Parsing file")
+    # The line is cleared before messages and when the stage ends
+    assert "\nimport 1/4 25% ETA 6s" in stream.getvalue()
+    assert "Parsing file\n" in stream.getvalue()
+    assert stream.getvalue().endswith("\r")
+
+
+@patch("src.processing.get_nbp_rate", side_effect=ValueError("no rate"))
+def test_per_row_rate_fallbacks_are_reported_once_per_kind(_rate):
+    rows = [
+        {
+            "TradeId": i,
+            "Date": f"2025-01-{i + 1:02d}",
+            "EventType": "BUY",
+            "Ticker": "AAPL",
+            "Quantity": 1,
+            "Price": 10,
+            "Amount": -10,
+            "Fee": 0,
+            "Currency": "USD",
+        }
+        for i in range(20)
+    ]
+    events = []
+    unsubscribe = reporter.subscribe(events.append)
+    try:
+        _, _, inventory = process_yearly_data(rows, 2025)
+    finally:
+        unsubscribe()
+
+    assert inventory[0]["total_cost"] == 10.0
+    warnings = [e.text for e in events if e.kind == MESSAGE and e.level >= WARNING]
+    assert len(warnings) == reporter.repeat_limit + 1
+    assert warnings[-1].startswith("... 17 more")
+    assert {e.stage for e in events if e.kind == STAGE_START} >= {"route", "match"}
+
+
+def test_import_save_reports_progress_per_batch(tmp_path):
+    dividends = [
+        {
+            "date": f"2024-01-{day:02d}",
+            "ticker": "AAPL",
+            "currency": "USD",
+            "amount": Decimal("1.5"),
+        }
+        for day in range(1, 6)
+    ]
+    data = {"trades": [], "corp_actions": [], "dividends": dividends, "taxes": []}
+    events = []
+    unsubscribe = reporter.subscribe(events.append)
+    try:
+        with patch("src.db_connector.DB_KEY", "test_key"), patch(
+            "src.db_connector.DB_PATH", str(tmp_path / "history.db")
+        ), patch("src.parser.MANUAL_FIXES_FILE", str(tmp_path / "none.csv")), patch(
+            "src.parser.SAVE_BATCH_SIZE", 2
+        ), patch.object(
+            reporter, "advance", wraps=reporter.advance
+        ) as advance:
+            save_to_database(data)
+    finally:
+        unsubscribe()
+
+    assert [c.args[0] for c in advance.call_args_list] == [2, 2, 1]
+    end = [e for e in events if e.kind == STAGE_END and e.stage == "save"][0]
+    assert end.done == end.total == 5
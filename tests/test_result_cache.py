@@ -0,0 +1,93 @@
+# tests/test_result_cache.py
+
+import os
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+
+from src.db_connector import DBConnector
+from src.parser import save_to_database
+from src.result_cache import ResultCache, cache_key
+
+
+@pytest.fixture(autouse=True)
+def db_key():
+    with patch("src.db_connector.DB_KEY", "test_key"):
+        yield
+
+
+def test_entries_round_trip_and_evict_least_recently_used(tmp_path):
+    path = str(tmp_path / "cache.db")
+    payload = {"results": {2024: ([{"cost": Decimal("1.10")}], [], [])}}
+
+    with ResultCache(path, max_bytes=10**6) as cache:
+        assert cache.get("a") is None
+        assert cache.put("a", payload)
+        assert cache.get("a") == payload
+
+    # Random hex strings compressing to ~400 bytes, room for two of them
+    blob = os.urandom(350).hex()
+    with ResultCache(path, max_bytes=900) as cache:
+        cache.put("a", blob)
+        cache.put("b", blob)
+        cache.get("a")
+        cache.put("c", blob)
+        assert cache.get("b") is None
+        assert cache.get("a") == blob and cache.get("c") == blob
+        assert cache.total_bytes() <= 900
+        assert not cache.put("huge", os.urandom(1000).hex())
+
+
+def test_any_db_write_changes_the_key(tmp_path):
+    with DBConnector(str(tmp_path / "history.db")) as db:
+        db.initialize_schema()
+        version = db.get_data_version()
+        key = cache_key(version, [2024], None, tax_window=10)
+
+        assert cache_key(dict(version), [2024], None, tax_window=10) == key
+        assert cache_key(version, [2023, 2024], None, tax_window=10) != key
+        assert cache_key(version, [2024], "AAPL", tax_window=10) != key
+        assert cache_key(version, [2024], None, tax_window=0) != key
+
+        db.save_nbp_rates([("USD", "2024-01-02", Decimal("4.0"))])
+        assert cache_key(db.get_data_version(), [2024], None, tax_window=10) != key
+        key = cache_key(db.get_data_version(), [2024], None, tax_window=10)
+
+        db.save_transaction(
+            {
+                "date": "2024-01-02",
+                "type": "BUY",
+                "ticker": "FB",
+                "qty": 1,
+                "price": 10.0,
+                "currency": "USD",
+                "fee": 0.0,
+                "desc": "",
+            }
+        )
+        assert cache_key(db.get_data_version(), [2024], None, tax_window=10) != key
+        key = cache_key(db.get_data_version(), [2024], None, tax_window=10)
+
+        db.set_ticker_alias("ABC", "XYZ")
+        assert cache_key(db.get_data_version(), [2024], None, tax_window=10) != key
+
+
+def test_an_import_bumps_the_version_once(tmp_path):
+    db_path = str(tmp_path / "history.db")
+    dividends = [
+        {"date": f"2024-01-{day:02d}", "ticker": "AAPL", "currency": "USD", "amount": 1}
+        for day in range(1, 11)
+    ]
+    data = {"trades": [], "corp_actions": [], "dividends": dividends, "taxes": []}
+    with DBConnector(db_path) as db:
+        db.initialize_schema()
+        before = db.get_data_version()["transactions_version"]
+
+    with patch("src.db_connector.DB_PATH", db_path), patch(
+        "src.parser.MANUAL_FIXES_FILE", str(tmp_path / "none.csv")
+    ):
+        save_to_database(data)
+
+    with DBConnector(db_path) as db:
+        assert db.get_data_version()["transactions_version"] == before + 1
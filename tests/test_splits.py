@@ -1,8 +1,11 @@
 # tests/test_splits.py
 
+import copy
+import random
+
 import pytest
 from decimal import Decimal
-from src.fifo import TradeMatcher
+from src.fifo import LotQueue, SequentialTradeMatcher, TradeMatcher
 
 
 @pytest.fixture
@@ -104,3 +107,116 @@ def test_reverse_split_1_to_10(matcher):
     # Profit: 20.
 
     assert results[0]["profit_loss"] == 20.0
+
+
+def test_split_is_lazy_and_matches_eager_adjustment(matcher):
+    """Splits only record the ratio; lots are adjusted when read or consumed."""
+    buys = [
+        {
+            "type": "BUY",
+            "date": "2024-01-01",
+            "ticker": "LAZY",
+            "qty": Decimal(3),
+            "price": Decimal(10),
+            "commission": Decimal(0),
+            "currency": "USD",
+            "rate": Decimal(1),
+        }
+        for _ in range(3)
+    ]
+    splits = [
+        {
+            "type": "SPLIT",
+            "date": f"2024-02-0{day}",
+            "ticker": "LAZY",
+            "ratio": ratio,
+            "qty": Decimal(0),
+            "currency": "USD",
+        }
+        for day, ratio in [(1, Decimal(3)), (2, Decimal("0.5"))]
+    ]
+    matcher.process_trades(buys + splits)
+
+    # Nothing has been rewritten yet
+    assert [lot.qty for lot in matcher.inventory["LAZY"]] == [Decimal(3)] * 3
+
+    inventory = matcher.get_current_inventory()
+    expected_qty = Decimal(3) * Decimal(3) * Decimal("0.5")
+    expected_price = Decimal(10) / Decimal(3) / Decimal("0.5")
+    assert [i["quantity"] for i in inventory] == [float(expected_qty)] * 3
+    assert [i["cost_per_share"] for i in inventory] == [float(expected_price)] * 3
+    assert matcher.inventory["LAZY"][0].price == expected_price
+
+
+def test_split_scales_the_index_without_settling_untouched_lots(matcher):
+    """Sales after splits read the scaled index and settle only the lots they touch."""
+
+    def trade(t_type, date, qty, ratio=Decimal(1)):
+        return {
+            "type": t_type,
+            "date": date,
+            "ticker": "SEG",
+            "qty": qty,
+            "price": Decimal(7),
+            "commission": Decimal(0),
+            "currency": "USD",
+            "rate": Decimal(1),
+            "ratio": ratio,
+        }
+
+    matcher.process_trades(
+        [trade("BUY", "2024-01-02", Decimal(5)) for _ in range(4)]
+        + [trade("SPLIT", "2024-02-01", Decimal(0), Decimal(3))]
+        + [trade("BUY", "2024-02-02", Decimal(2))]
+        + [trade("SELL", "2024-02-03", Decimal(-20))]
+    )
+
+    queue = matcher.inventory["SEG"]
+    # The sale took the first lot (15 post-split shares) and 5 of the second
+    assert [lot.epoch for lot in queue] == [1, 0, 0, 1]
+    assert queue[0].qty == Decimal(10)
+    assert queue.total_qty() == Decimal(10 + 15 + 15 + 2)
+
+    quote = matcher.quote_sale("SEG", Decimal(26))
+    assert quote["cost_basis_pln"] == Decimal("60.66")
+    assert [lot.epoch for lot in queue] == [1, 0, 1, 1]
+
+
+def test_indexed_sales_across_split_segments_match_reference_engine(monkeypatch):
+    """Buys, sells and splits interleaved: the indexed engine stays exact."""
+    rng = random.Random(5)
+    trades = []
+    for i in range(400):
+        date = f"2024-{1 + i // 40:02d}-{1 + i % 28:02d}"
+        roll = rng.random()
+        if roll < 0.08:
+            ratio = rng.choice([Decimal(3), Decimal("0.5"), Decimal(2)])
+            trades.append(
+                {"type": "SPLIT", "date": date, "ticker": "MIX", "ratio": ratio}
+            )
+            continue
+        qty = Decimal(rng.randint(1, 400)) / 100
+        trades.append(
+            {
+                "type": "BUY" if roll < 0.6 else "SELL",
+                "date": date,
+                "ticker": "MIX",
+                "qty": qty if roll < 0.6 else -qty,
+                "price": Decimal(rng.randint(100, 900)) / 10,
+                "commission": Decimal(0),
+                "currency": "USD",
+                "rate": Decimal("4.1"),
+            }
+        )
+
+    monkeypatch.setattr(LotQueue, "COMPACT_MIN", 4)
+    indexed = TradeMatcher()
+    indexed.process_trades(copy.deepcopy(trades))
+    reference = SequentialTradeMatcher()
+    reference.process_trades(copy.deepcopy(trades))
+
+    assert indexed.get_realized_gains() == reference.get_realized_gains()
+    assert indexed.get_current_inventory() == reference.get_current_inventory()
+    assert indexed.inventory["MIX"].total_qty() == sum(
+        lot.qty for lot in reference.inventory["MIX"]
+    )
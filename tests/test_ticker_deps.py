@@ -0,0 +1,50 @@
+# tests/test_ticker_deps.py
+
+from src.ticker_deps import build_ticker_graph, ticker_closure, ticker_groups
+
+CORP_ACTIONS = [
+    # Spinoff: the new shares are booked under the spun-off ticker
+    ("FG", "FNF(US31620R3030) Spinoff  1 for 10 (FG, F&G ANNUITIES, US30190A1043)"),
+    # Merger: removal of the old shares and addition of the new ones
+    (
+        "ABC",
+        "ABC(US0000000001) Merged(Acquisition) WITH US0000000002 1 for 2 "
+        "(XYZ, XYZ CORP, US0000000002)",
+    ),
+    (
+        "XYZ",
+        "ABC(US0000000001) Merged(Acquisition) WITH US0000000002 1 for 2 "
+        "(XYZ, XYZ CORP, US0000000002)",
+    ),
+    # XYZ later spins off QQQ
+    ("QQQ", "XYZ(US0000000002) Spinoff  1 for 5 (QQQ, QQQ INC, US0000000003)"),
+    ("AAPL", None),
+]
+
+
+def test_closure_follows_corporate_actions_transitively():
+    graph = build_ticker_graph(CORP_ACTIONS, {})
+
+    assert ticker_closure(graph, "ABC") == ["ABC", "QQQ", "XYZ"]
+    assert ticker_closure(graph, "QQQ") == ["ABC", "QQQ", "XYZ"]
+    assert ticker_closure(graph, "FG") == ["FG", "FNF"]
+    assert ticker_closure(graph, "AAPL") == ["AAPL"]
+    assert ticker_closure(graph, "MSFT") == ["MSFT"]
+
+
+def test_symbols_in_descriptions_are_mapped_to_canonical_tickers():
+    graph = build_ticker_graph(CORP_ACTIONS, aliases={"FNF": "FNF2"})
+
+    assert ticker_closure(graph, "FG") == ["FG", "FNF2"]
+    assert "FNF" not in graph
+
+
+def test_groups_partition_tickers_into_closures():
+    graph = build_ticker_graph(CORP_ACTIONS, {})
+
+    assert ticker_groups(graph, ["XYZ", "AAPL", "ABC", "MSFT", "FG"]) == [
+        ["AAPL"],
+        ["ABC", "QQQ", "XYZ"],
+        ["FG", "FNF"],
+        ["MSFT"],
+    ]
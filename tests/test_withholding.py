@@ -0,0 +1,68 @@
+# tests/test_withholding.py
+
+from decimal import Decimal
+
+import pytest
+
+from src.withholding import WithholdingIndex
+
+
+def _row(date, amount, ticker="AAPL"):
+    return {"date": date, "ticker": ticker, "amount": Decimal(amount)}
+
+
+def test_tax_goes_to_nearest_dividend_of_its_ticker_within_window():
+    index = WithholdingIndex(window_days=10)
+    march, june = _row("2024-03-01", "10"), _row("2024-06-01", "10")
+    other = _row("2024-03-05", "10", ticker="MSFT")
+    for dividend in (march, other, june):
+        index.add_dividend(dividend)
+
+    assert index.find("AAPL", "2024-03-01") is march
+    assert index.find("AAPL", "2024-03-08") is march  # adjustment a week later
+    assert index.find("AAPL", "2024-05-25") is june  # booked ahead of it
+    assert index.find("AAPL", "2024-04-15") is None
+    assert index.find("MSFT", "2024-03-01") is other
+    assert index.find("TSLA", "2024-03-01") is None
+
+
+def test_tie_goes_to_the_earlier_dividend():
+    index = WithholdingIndex(window_days=10)
+    first, second = _row("2024-03-01", "1"), _row("2024-03-09", "1")
+    index.add_dividend(first)
+    index.add_dividend(second)
+
+    assert index.find("AAPL", "2024-03-05") is first
+    assert index.find("AAPL", "2024-03-06") is second
+
+
+def test_same_day_dividends_take_tax_on_the_last_of_them_from_either_side():
+    index = WithholdingIndex(window_days=10)
+    first, last = _row("2024-03-05", "1"), _row("2024-03-05", "2")
+    index.add_dividend(first)
+    index.add_dividend(last)
+
+    assert index.find("AAPL", "2024-03-03") is last
+    assert index.find("AAPL", "2024-03-05") is last
+    assert index.find("AAPL", "2024-03-07") is last
+
+
+def test_reversal_and_reaccrual_leave_the_net_tax():
+    index = WithholdingIndex(window_days=10)
+    dividend = _row("2024-03-01", "10")
+    index.add_dividend(dividend)
+
+    index.add_tax(_row("2024-03-01", "-1.5"))
+    index.add_tax(_row("2024-03-06", "1.5"))  # reversal
+    index.add_tax(_row("2024-03-06", "-1.2"))  # re-accrual at the treaty rate
+    index.add_tax(_row("2024-05-01", "-9"))
+
+    assert index.tax_for(dividend) == Decimal("1.2")
+    assert [row["date"] for row in index.unmatched] == ["2024-05-01"]
+
+
+def test_dividends_must_come_in_date_order():
+    index = WithholdingIndex()
+    index.add_dividend(_row("2024-03-01", "1"))
+    with pytest.raises(ValueError):
+        index.add_dividend(_row("2024-02-01", "1"))
@@ -0,0 +1,61 @@
+# tools/bench_nbp.py
+
+"""
+Benchmarks the NBP client against the local stand-in server.
+
+Example:
+    python tools/bench_nbp.py --lookups 5000 --threads 8 --latency 0.05
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add root directory to path to import src modules
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src import nbp  # noqa: E402
+from tools.nbp_stub_server import NBPStubServer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NBP client benchmark")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--currencies", default="USD,EUR")
+    parser.add_argument("--years", default="2020-2024")
+    args = parser.parse_args()
+
+    first, last = (int(y) for y in args.years.split("-"))
+    currencies = args.currencies.split(",")
+    rng = random.Random(1)
+    lookups = [
+        (
+            rng.choice(currencies),
+            f"{rng.randint(first, last)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        )
+        for _ in range(args.lookups)
+    ]
+
+    with NBPStubServer(latency=args.latency, error_rate=args.error_rate) as stub:
+        nbp.API_URL = stub.base_url
+        nbp._MONTHLY_CACHE.clear()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(lambda x: nbp.get_nbp_rate(*x), lookups))
+        elapsed = time.perf_counter() - start
+
+        print(f"Lookups:        {len(lookups)} ({args.threads} threads)")
+        print(f"HTTP requests:  {stub.request_count} {stub.status_counts}")
+        print(f"Elapsed:        {elapsed:.3f}s")
+        print(f"Throughput:     {len(lookups) / elapsed:,.0f} lookups/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# tools/fifo_harness.py
+
+"""
+Differential and scale harness for the FIFO engine.
+
+- generate_events(): long random event streams per ticker with BUY, SELL,
+  SPLIT, STOCK_DIV, MERGER and TRANSFER rows, fractional quantities and the
+  occasional oversell;
+- ReferenceMatcher: the original dict-per-lot FIFO (eager splits, one lot at
+  a time), kept deliberately simple and independent of src/fifo.py;
+- compare(): checks a matcher against the reference sale by sale and lot by
+  lot, with exact Decimal values;
+- run_scale(): throughput and peak memory of an engine on a large stream.
+
+Usage:
+    python tools/fifo_harness.py --events 1000000 --engine vector --check
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import deque
+from decimal import Decimal
+from typing import Any, Dict, List
+
+# Add root directory to path to import src modules
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.fifo import SequentialTradeMatcher, TradeMatcher  # noqa: E402
+from src.fifo_vector import VectorTradeMatcher  # noqa: E402
+from src.utils import money  # noqa: E402
+
+ENGINES = {
+    "standard": TradeMatcher,
+    "sequential": SequentialTradeMatcher,
+    "vector": VectorTradeMatcher,
+}
+
+_TYPE_PRIORITY = {
+    "SPLIT": 0,
+    "STOCK_DIV": 1,
+    "MERGER": 1,
+    "SPLIT_ADD": 1,
+    "BUY": 2,
+    "TRANSFER": 2,
+    "SELL": 3,
+}
+_RATIOS = [Decimal(2), Decimal(3), Decimal(10), Decimal("0.5"), Decimal("1.5")]
+
+
+def generate_events(
+    seed: int, n_events: int, tickers: int = 20, plain_share: float = 0.5
+) -> List[Dict[str, Any]]:
+    """
+    Deterministic event stream over 2015-2024. Roughly `plain_share` of the
+    tickers only buy and sell (the common case); the rest also get corporate
+    actions and transfers.
+    """
+    rng = random.Random(seed)
+    per_ticker = max(1, n_events // tickers)
+    events = []
+    for t in range(tickers):
+        ticker = f"T{t:03d}"
+        plain = t < tickers * plain_share
+        held = Decimal(0)
+        for i in range(per_ticker):
+            # Dates increase with i, so that `held` follows the sorted order
+            year, day = divmod(i * 3650 // per_ticker, 365)
+            date = f"{2015 + year}-{1 + day // 31:02d}-{1 + min(day % 31, 27):02d}"
+            roll = rng.random()
+            ratio = None
+            if held > 0 and roll < 0.35:
+                qty = -min(held, Decimal(rng.randint(1, 5000)) / 100)
+                if not plain and rng.random() < 0.01:
+                    qty -= 1  # Oversell: more than the holdings
+                t_type = "SELL"
+                if not plain and rng.random() < 0.1:
+                    t_type = rng.choice(["TRANSFER", "MERGER"])
+            elif plain or roll < 0.97:
+                qty = Decimal(rng.randint(1, 400000)) / 10000
+                t_type = "BUY" if plain or rng.random() < 0.9 else "TRANSFER"
+            elif roll < 0.995:
+                qty = Decimal(rng.randint(1, 1000)) / 100
+                t_type = rng.choice(["STOCK_DIV", "MERGER"])
+            else:
+                qty, t_type = Decimal(0), "SPLIT"
+                ratio = rng.choice(_RATIOS)
+
+            if t_type == "SPLIT":
+                held *= ratio
+            else:
+                held = max(held + qty, Decimal(0))
+            event = {
+                "type": t_type,
+                "date": date,
+                "ticker": ticker,
+                "qty": qty,
+                "price": Decimal(rng.randint(100, 900000)) / 100,
+                "commission": Decimal(rng.randint(0, 500)) / 100,
+                "currency": "USD",
+                "rate": Decimal(rng.randint(35000, 45000)) / 10000,
+            }
+            if ratio is not None:
+                event["ratio"] = ratio
+            events.append(event)
+    return events
+
+
+class ReferenceMatcher:
+    """The original lot-by-lot FIFO: plain dicts, eager splits, no indexes."""
+
+    def __init__(self):
+        self.inventory = {}
+        self.realized_pnl = []
+
+    def process_trades(self, trades_list):
+        trades = sorted(
+            trades_list, key=lambda x: (x["date"], _TYPE_PRIORITY.get(x["type"], 99))
+        )
+        for trade in trades:
+            lots = self.inventory.setdefault(trade["ticker"], deque())
+            qty = trade.get("qty", Decimal(0))
+            if trade["type"] == "SPLIT":
+                ratio = trade.get("ratio", Decimal(1))
+                for lot in lots:
+                    lot["qty"] = lot["qty"] * ratio
+                    if ratio != 0:
+                        lot["price"] = lot["price"] / ratio
+            elif qty > 0:
+                price = trade["price"] if trade["type"] in ("BUY", "TRANSFER") else 0
+                rate = trade["rate"]
+                cost = money(price * qty * rate + abs(trade["commission"]) * rate)
+                lots.append(
+                    {
+                        "date": trade["date"],
+                        "qty": qty,
+                        "price": Decimal(price),
+                        "rate": rate,
+                        "cost_pln": cost,
+                        "currency": trade["currency"],
+                        "source": trade.get("source", "UNKNOWN"),
+                    }
+                )
+            elif qty < 0:
+                self._consume(trade, lots, taxable=trade["type"] == "SELL")
+
+    def _consume(self, trade, lots, taxable):
+        remaining = -trade["qty"]
+        cost = Decimal("0.00")
+        matched = []
+        while remaining > 0 and lots:
+            lot = lots[0]
+            if lot["qty"] <= remaining + Decimal("0.00000001"):
+                cost += lot["cost_pln"]
+                matched.append(dict(lot))
+                lots.popleft()
+                remaining -= lot["qty"]
+            else:
+                part_cost = money(lot["cost_pln"] * (remaining / lot["qty"]))
+                matched.append(dict(lot, qty=remaining, cost_pln=part_cost))
+                cost += part_cost
+                lot["qty"] -= remaining
+                lot["cost_pln"] -= part_cost
+                remaining = 0
+
+        if taxable:
+            qty, rate = -trade["qty"], trade["rate"]
+            revenue = money(trade["price"] * qty * rate)
+            total_cost = cost + money(abs(trade["commission"]) * rate)
+            self.realized_pnl.append(
+                {
+                    "ticker": trade["ticker"],
+                    "sale_date": trade["date"],
+                    "cost_basis": total_cost,
+                    "profit_loss": revenue - total_cost,
+                    "matched_buys": matched,
+                }
+            )
+
+
+def compare(reference: ReferenceMatcher, matcher: TradeMatcher) -> int:
+    """
+    Asserts that `matcher` produced exactly the reference results: every sale
+    with its matched lots, then every open lot. Returns the number of sales.
+    """
+    gains = matcher.get_realized_gains()
+    assert len(gains) == len(reference.realized_pnl), "number of sales differs"
+    for got, want in zip(gains, reference.realized_pnl):
+        where = f"{want['ticker']} sale on {want['sale_date']}"
+        assert got["ticker"] == want["ticker"], where
+        assert got["sale_date"] == want["sale_date"], where
+        assert got["cost_basis"] == float(want["cost_basis"]), where
+        assert got["profit_loss"] == float(want["profit_loss"]), where
+        if matcher.keep_lot_detail:
+            assert got["matched_buys"] == want["matched_buys"], where
+
+    for ticker, lots in reference.inventory.items():
+        queue = matcher.inventory.get(ticker, ())
+        actual = [matcher._settle(ticker, lot).to_dict() for lot in queue]
+        assert actual == list(lots), f"open lots of {ticker}"
+    return len(gains)
+
+
+def run_scale(engine: str, n_events: int, seed: int = 0, workers: int = 1):
+    """Returns (matcher, events/s, peak traced MB) for one engine run."""
+    events = generate_events(seed, n_events, tickers=max(20, n_events // 5000))
+
+    start = time.perf_counter()
+    matcher = ENGINES[engine]()
+    matcher.process_trades(copy.deepcopy(events), workers=workers)
+    elapsed = time.perf_counter() - start
+
+    # Separate traced run: tracemalloc slows allocation-heavy code down
+    tracemalloc.start()
+    ENGINES[engine]().process_trades(events, workers=workers)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return matcher, len(events) / elapsed, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FIFO engine scale benchmark")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="standard")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--check", action="store_true", help="Also compare with the reference."
+    )
+    args = parser.parse_args()
+
+    matcher, rate, peak = run_scale(args.engine, args.events, args.seed, args.workers)
+    print(f"Engine:      {args.engine} ({args.workers} workers)")
+    print(f"Events:      {args.events:,}")
+    print(f"Throughput:  {rate:,.0f} events/s")
+    print(f"Peak memory: {peak:.1f} MB (traced)")
+
+    if args.check:
+        reference = ReferenceMatcher()
+        events = generate_events(
+            args.seed, args.events, tickers=max(20, args.events // 5000)
+        )
+        reference.process_trades(events)
+        sales = compare(reference, matcher)
+        print(f"Reference:   identical ({sales:,} sales)")
+
+
+if __name__ == "__main__":
+    main()
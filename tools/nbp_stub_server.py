@@ -0,0 +1,249 @@
+# tools/nbp_stub_server.py
+
+"""
+Local stand-in for the NBP exchange rates API (Table A).
+
+Serves /api/exchangerates/rates/a/{currency}/{start}/{end}/ from a fixture
+dataset so that the NBP client can be tested and benchmarked offline.
+Behaves like api.nbp.pl where it matters for the client:
+- 404 when the range holds no quotations (weekends, holidays, unknown currency);
+- 400 for malformed dates, reversed ranges or ranges longer than 93 days;
+- optional latency and error injection (HTTP 5xx or dropped connections).
+
+Usage:
+    python tools/nbp_stub_server.py --port 8081 --latency 0.05 --error-rate 0.1
+    NBP_API_URL=http://127.0.0.1:8081/api/exchangerates/rates/a python main.py ...
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+API_PREFIX = "/api/exchangerates/rates/a"
+MAX_RANGE_DAYS = 93
+
+_PATH_RE = re.compile(
+    r"^/api/exchangerates/rates/a/([A-Za-z]{3})/(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})/?$"
+)
+
+# Fixed-date Polish public holidays (no NBP table is published on these days)
+_FIXED_HOLIDAYS = {(1, 1), (1, 6), (5, 1), (5, 3), (8, 15), (11, 1), (11, 11)}
+_FIXED_HOLIDAYS |= {(12, 24), (12, 25), (12, 26)}
+
+_BASE_MIDS = {"USD": 4.0, "EUR": 4.3, "GBP": 5.0, "CHF": 4.4, "JPY": 0.03}
+
+
+def generate_fixture_rates(
+    currencies=("USD", "EUR"), start="2019-01-01", end="2025-12-31", seed=42
+) -> Dict[str, Dict[str, float]]:
+    """Deterministic synthetic Table A dataset: {currency: {date_str: mid}}."""
+    rng = random.Random(seed)
+    day = date.fromisoformat(start)
+    last = date.fromisoformat(end)
+    rates: Dict[str, Dict[str, float]] = {c: {} for c in currencies}
+    mids = {c: _BASE_MIDS.get(c, 1.0) for c in currencies}
+
+    while day <= last:
+        if day.weekday() < 5 and (day.month, day.day) not in _FIXED_HOLIDAYS:
+            for c in currencies:
+                mids[c] = max(mids[c] * (1 + rng.uniform(-0.005, 0.005)), 0.0001)
+                rates[c][day.isoformat()] = round(mids[c], 4)
+        day += timedelta(days=1)
+    return rates
+
+
+class NBPStubServer:
+    """
+    Threaded HTTP stand-in. Use as a context manager:
+
+        with NBPStubServer(latency=0.01) as stub:
+            monkeypatch.setattr(nbp, "API_URL", stub.base_url)
+    """
+
+    def __init__(
+        self,
+        rates: Optional[Dict[str, Dict[str, float]]] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        seed: int = 0,
+    ):
+        self.rates = rates if rates is not None else generate_fixture_rates()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._forced_errors = []
+        self.request_count = 0
+        self.status_counts: Dict[int, int] = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def inject_errors(self, count: int, status: Optional[int] = None) -> None:
+        """
+        The next `count` requests fail. status=None drops the connection
+        without a response (simulates a network failure), otherwise the
+        given HTTP status is returned.
+        """
+        with self._lock:
+            self._forced_errors.extend([status] * count)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.request_count = 0
+            self.status_counts = {}
+
+    def start(self) -> "NBPStubServer":
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    # --- Request handling ---
+
+    def _next_fault(self):
+        """Returns (failed, status) for the current request."""
+        with self._lock:
+            self.request_count += 1
+            if self._forced_errors:
+                return True, self._forced_errors.pop(0)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return True, self.error_status
+        return False, None
+
+    def _count(self, status: int) -> None:
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def _resolve(self, path: str):
+        """Returns (status, payload) for an API path."""
+        match = _PATH_RE.match(path.split("?", 1)[0])
+        if not match:
+            return 400, "400 BadRequest - Błędne zapytanie / Bad Request"
+
+        code = match.group(1).upper()
+        try:
+            start = date.fromisoformat(match.group(2))
+            end = date.fromisoformat(match.group(3))
+        except ValueError:
+            return 400, "400 BadRequest - Błędny zakres dat / Invalid date range"
+        if end < start or (end - start).days > MAX_RANGE_DAYS:
+            return 400, "400 BadRequest - Przekroczony limit 93 dni / Limit exceeded"
+
+        series = self.rates.get(code, {})
+        lo, hi = start.isoformat(), end.isoformat()
+        rates = [
+            {"no": f"{i + 1:03d}/A/NBP/{d[:4]}", "effectiveDate": d, "mid": series[d]}
+            for i, d in enumerate(sorted(d for d in series if lo <= d <= hi))
+        ]
+        if not rates:
+            return 404, "404 NotFound - Not Found - Brak danych"
+        return 200, {"table": "A", "currency": code, "code": code, "rates": rates}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                failed, status = stub._next_fault()
+                if failed and status is None:
+                    # Drop the connection: the client sees a network error
+                    stub._count(0)
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+
+                if failed:
+                    payload = f"{status} Injected error"
+                else:
+                    status, payload = stub._resolve(self.path)
+
+                if isinstance(payload, dict):
+                    body = json.dumps(payload).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                else:
+                    body = payload.encode("utf-8")
+                    content_type = "text/plain; charset=utf-8"
+
+                stub._count(status)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep test and benchmark output clean
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local NBP API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="0.0 - 1.0")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument(
+        "--fixture", help="JSON file {currency: {date: mid}} (default: synthetic)."
+    )
+    args = parser.parse_args()
+
+    rates = None
+    if args.fixture:
+        with open(args.fixture, "r", encoding="utf-8") as f:
+            rates = json.load(f)
+
+    stub = NBPStubServer(
+        rates=rates,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    print(f"NBP stub serving at {stub.base_url} (Ctrl+C to stop)")
+    try:
+        stub._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()